@@ -0,0 +1,102 @@
+"""
+Benchmarks of the file readers and image utilities, using pytest-benchmark.
+
+Run from the root directory with
+    python -m pytest benchmarks/bench_createc.py
+Set the environment variable CREATEC_BENCH_SIZES=large to include production sized synthetic files,
+and compare runs with --benchmark-autosave / --benchmark-compare.
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from corpus import make_corpus
+
+pytest.importorskip('pytest_benchmark')
+
+this_dir = os.path.dirname(__file__)
+sample_dir = os.path.join(this_dir, os.pardir, 'examples', 'sample_data')
+
+# name -> (dat (channels, y, x), vert points, specgrid (nx, ny, points, channels))
+SIZES = {'small': ((4, 256, 256), 1024, (32, 32, 500, 4)),
+         'medium': ((4, 1024, 1024), 10000, (128, 128, 1000, 4))}
+if os.environ.get('CREATEC_BENCH_SIZES') == 'large':
+    SIZES['large'] = ((8, 2048, 2048), 100000, (256, 256, 2000, 4))
+
+
+@pytest.fixture(scope='session', params=list(SIZES))
+def corpus(request, tmp_path_factory):
+    dat, vert, specgrid = SIZES[request.param]
+    out_dir = str(tmp_path_factory.mktemp(f'corpus_{request.param}'))
+    return make_corpus(out_dir, dat=dat, vert=vert, specgrid=specgrid)
+
+
+@pytest.mark.parametrize('file_path', sorted(glob.glob(os.path.join(sample_dir, '*.dat'))),
+                         ids=os.path.basename)
+def test_DAT_IMG_sample(benchmark, file_path):
+    from createc.Createc_pyFile import DAT_IMG
+    benchmark(DAT_IMG, file_path)
+
+
+def test_DAT_IMG(benchmark, corpus):
+    from createc.Createc_pyFile import DAT_IMG
+    benchmark(DAT_IMG, corpus['dat'][0])
+
+
+def test_DAT_IMG_first_channel(benchmark, corpus):
+    from createc.Createc_pyFile import DAT_IMG
+    benchmark(DAT_IMG, corpus['dat'][0], channels=[0])
+
+
+def test_read_meta(benchmark, corpus):
+    from createc.Createc_pyFile import read_meta
+    benchmark(read_meta, corpus['dat'][0])
+
+
+@pytest.mark.parametrize('file_path', sorted(glob.glob(os.path.join(sample_dir, '*.VERT'))),
+                         ids=os.path.basename)
+def test_VERT_SPEC_sample(benchmark, file_path):
+    from createc.Createc_pyFile import VERT_SPEC
+    benchmark(VERT_SPEC, file_path)
+
+
+def test_VERT_SPEC(benchmark, corpus):
+    from createc.Createc_pyFile import VERT_SPEC
+    benchmark(VERT_SPEC, corpus['vert'][0])
+
+
+def test_GRID_SPEC(benchmark, corpus):
+    from createc.Createc_pyFile import GRID_SPEC
+    benchmark(GRID_SPEC, corpus['specgrid'][0])
+
+
+def test_GRID_SPEC_memmap(benchmark, corpus):
+    from createc.Createc_pyFile import GRID_SPEC
+    benchmark(GRID_SPEC, corpus['specgrid'][0], memmap=True)
+
+
+def test_GRID_SPEC_mean_spectrum(benchmark, corpus):
+    from createc.Createc_pyFile import GRID_SPEC
+    file = GRID_SPEC(corpus['specgrid'][0], memmap=True)
+    benchmark(file.reduce, 'mean')
+
+
+def test_level_correction(benchmark, corpus):
+    from createc.Createc_pyFile import DAT_IMG
+    from createc.utils.image_utils import level_correction
+    imgs = np.stack(DAT_IMG(corpus['dat'][0]).imgs)
+    benchmark(level_correction, imgs)
+
+
+def test_Catalog_covering(benchmark, tmp_path):
+    from createc.catalog import Catalog
+    with Catalog(sample_dir, db_path=str(tmp_path / 'catalog.sqlite')) as catalog:
+        benchmark(catalog.covering, -2050, -350, radius=5)
+
+
+@pytest.mark.parametrize('volt', [0.08, 0.5, 1.0, 1.2, 1.5])
+def test_Volt2Kelvin(benchmark, volt):
+    from createc.utils.DT670 import Volt2Kelvin
+    benchmark(Volt2Kelvin, volt)
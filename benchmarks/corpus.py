@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic but format-valid .dat, .vert and .specgrid files for benchmarking
+
+The headers of .dat and .vert files are taken from the test files and only the size related fields are
+modified, the data are smooth random surfaces/curves plus noise so that zlib compresses them realistically.
+
+Usage:
+    python corpus.py out_dir --dat 8 2048 2048 --vert 10000 --specgrid 256 256 2000 4
+"""
+import argparse
+import os
+import re
+import zlib
+
+import numpy as np
+
+this_dir = os.path.dirname(__file__)
+tests_dir = os.path.join(this_dir, os.pardir, 'tests')
+DAT_TEMPLATE = os.path.join(tests_dir, 'A200622.081914.dat')
+VERT_TEMPLATE = os.path.join(tests_dir, 'A201222.074849.VERT')
+HEADER_BYTES = 16384  # see g_file_data_bin_offset
+
+
+def _set_header_fields(header, fields):
+    """
+    Replace values in a Createc header, keeping it at HEADER_BYTES bytes
+
+    Parameters
+    ----------
+    header : bytes
+        The original header
+    fields : dict
+        Header key (the whole part before the '=') -> new value
+
+    Returns
+    -------
+    header : bytes
+    """
+    for key, value in fields.items():
+        header = re.sub(rb'(?m)^' + re.escape(key.encode()) + rb'=[^\r\n]*',
+                        key.encode() + b'=' + str(value).encode(), header)
+    header = header[:HEADER_BYTES]
+    return header + b'\x00' * (HEADER_BYTES - len(header))
+
+
+def _surface(shape, rng):
+    """
+    A smooth random surface with noise, roughly like an STM image
+
+    Parameters
+    ----------
+    shape : tuple
+        (rows, columns)
+    rng : numpy.random.Generator
+        Random generator
+
+    Returns
+    -------
+    surface : numpy.array
+    """
+    rows, cols = np.ogrid[:shape[0], :shape[1]]
+    k = rng.uniform(0.01, 0.1, 4)
+    surface = np.sin(k[0] * rows + k[1] * cols) + np.cos(k[2] * rows - k[3] * cols)
+    return (surface + 0.05 * rng.standard_normal(shape)).astype('<f4')
+
+
+def write_dat(file_path, channels=4, y_pixel=512, x_pixel=512, seed=0):
+    """
+    Write a synthetic .dat file
+
+    Parameters
+    ----------
+    file_path : str
+        Output file path
+    channels : int
+        Number of channels
+    y_pixel : int
+        Number of rows
+    x_pixel : int
+        Number of columns
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    None : None
+    """
+    with open(DAT_TEMPLATE, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+    header = _set_header_fields(header, {'Num.X / Num.X': x_pixel, 'Num.Y / Num.Y': y_pixel,
+                                         'Channels / Channels': channels, 'Channels': channels})
+    rng = np.random.default_rng(seed)
+    data = np.concatenate([np.zeros(1, dtype='<f4')] +
+                          [_surface((y_pixel, x_pixel), rng).ravel() for _ in range(channels)])
+    with open(file_path, 'wb') as f:
+        f.write(header)
+        f.write(zlib.compress(data.tobytes()))
+
+
+def write_vert(file_path, points=1024, seed=0):
+    """
+    Write a synthetic .vert file with the same channels as VERT_TEMPLATE
+
+    Parameters
+    ----------
+    file_path : str
+        Output file path
+    points : int
+        Number of points of the spectrum
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    None : None
+    """
+    with open(VERT_TEMPLATE, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+        _, spec_meta, first_row = f.read().split(b'\n', maxsplit=3)[:3]
+    spec_meta = re.sub(rb'\d+', str(points).encode(), spec_meta, count=1)
+    n_values = first_row.count(b'\t') - 1  # index and trailing tab excluded
+
+    rng = np.random.default_rng(seed)
+    bias = np.linspace(-1000, 1000, points)
+    values = np.column_stack([bias] + [np.tanh(bias / rng.uniform(100, 500)) + 0.01 * rng.standard_normal(points)
+                                       for _ in range(n_values - 1)])
+    rows = [f'{i}\t' + '\t'.join(f'{v:.5E}' for v in row) + '\t\r\n' for i, row in enumerate(values)]
+    with open(file_path, 'wb') as f:
+        f.write(header)
+        f.write(b'\r\n' + spec_meta + b'\n')
+        f.write(''.join(rows).encode('cp1252'))
+
+
+def write_specgrid(file_path, nx=64, ny=64, points=500, channels=4, seed=0):
+    """
+    Write a synthetic .specgrid file
+
+    Parameters
+    ----------
+    file_path : str
+        Output file path
+    nx : int
+        Number of grid points along x
+    ny : int
+        Number of grid points along y
+    points : int
+        Number of points of each spectrum
+    channels : int
+        Number of channels of each spectrum
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    None : None
+    """
+    header = np.zeros(256, dtype=np.uint32)
+    header[[0, 1, 2, 3, 4, 7, 23, 24, 25, 26]] = [1, nx, ny, 1, 1, points, nx, ny, 1, 1]
+    header[14] = channels  # specgridchan
+    header_f = header.view(np.float32)
+    header_f[10], header_f[11] = 100., 1.  # bias and current
+
+    rng = np.random.default_rng(seed)
+    bias = np.linspace(-1000, 1000, points, dtype=np.float32)
+    specvz = np.column_stack([bias, np.zeros(points), np.zeros(points)]).astype(np.float32)
+    curve = np.tanh(bias / 300)
+    with open(file_path, 'wb') as f:
+        header.tofile(f)
+        specvz.tofile(f)
+        for _ in range(nx):  # one row of the grid at a time to bound memory
+            row = np.broadcast_to(curve[:, None], (ny, points, channels)) + \
+                  0.01 * rng.standard_normal((ny, points, channels))
+            row.astype(np.float32).tofile(f)
+
+
+def make_corpus(out_dir, dat=(4, 512, 512), vert=1024, specgrid=(64, 64, 500, 4), copies=1):
+    """
+    Write a corpus of synthetic files into out_dir
+
+    Parameters
+    ----------
+    out_dir : str
+        Output directory, created if not existing
+    dat : tuple or None
+        (channels, y_pixel, x_pixel) of the .dat files
+    vert : int or None
+        Number of points of the .vert files
+    specgrid : tuple or None
+        (nx, ny, points, channels) of the .specgrid files
+    copies : int
+        Number of files of each kind
+
+    Returns
+    -------
+    file_paths : dict
+        kind -> list of file paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    file_paths = {'dat': [], 'vert': [], 'specgrid': []}
+    for i in range(copies):
+        # file names follow the Createc convention, so that datetime works
+        stem = os.path.join(out_dir, f'A200101.{i // 3600:02d}{i // 60 % 60:02d}{i % 60:02d}')
+        if dat is not None:
+            write_dat(stem + '.dat', *dat, seed=i)
+            file_paths['dat'].append(stem + '.dat')
+        if vert is not None:
+            write_vert(stem + '.VERT', vert, seed=i)
+            file_paths['vert'].append(stem + '.VERT')
+        if specgrid is not None:
+            write_specgrid(stem + '.specgrid', *specgrid, seed=i)
+            file_paths['specgrid'].append(stem + '.specgrid')
+    return file_paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--dat', type=int, nargs=3, default=None, metavar=('CHANNELS', 'Y', 'X'))
+    parser.add_argument('--vert', type=int, default=None, metavar='POINTS')
+    parser.add_argument('--specgrid', type=int, nargs=4, default=None, metavar=('NX', 'NY', 'POINTS', 'CHANNELS'))
+    parser.add_argument('--copies', type=int, default=1)
+    args = parser.parse_args()
+    make_corpus(args.out_dir, dat=args.dat, vert=args.vert, specgrid=args.specgrid, copies=args.copies)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+The global constants defined in Createc_global_const.yaml, loaded once and shared by all modules as cgc
+
+The parsed constants are cached as a pickle in __pycache__, which is reused as long as the .yaml file
+keeps its mtime and size. If the cache cannot be written, the .yaml file is parsed at every import.
+"""
+import os
+import pickle
+import tempfile
+
+this_dir = os.path.dirname(__file__)
+cgc_file = os.path.join(this_dir, 'Createc_global_const.yaml')
+_cache_file = os.path.join(this_dir, '__pycache__', 'Createc_global_const.pickle')
+
+
+def _load():
+    """
+    Load the constants from the pickle cache if it is up to date, otherwise from the .yaml file
+
+    Returns
+    -------
+    cgc : dict
+    """
+    stat = os.stat(cgc_file)
+    key = (stat.st_mtime, stat.st_size)
+    try:
+        with open(_cache_file, 'rb') as f:
+            cache_key, cgc = pickle.load(f)
+        if cache_key == key:
+            return cgc
+    except Exception:
+        pass
+
+    import yaml
+    with open(cgc_file, 'rt') as f:
+        cgc = yaml.load(f.read(), Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    try:
+        os.makedirs(os.path.dirname(_cache_file), exist_ok=True)
+        # a tmp file of its own, as several processes may import at once, e.g. the workers of load_many()
+        fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(_cache_file))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, cgc), f)
+            os.replace(tmp_file, _cache_file)
+        except OSError:
+            os.remove(tmp_file)
+            raise
+    except OSError:
+        pass  # e.g. read-only installation
+    return cgc
+
+
+cgc = _load()
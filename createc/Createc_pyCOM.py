@@ -7,13 +7,7 @@ Created on Thu May 16 17:07:44 2019
 import numpy as np
 import time
 from .utils.misc import XY2D
-import yaml
-import os
-
-this_dir = os.path.dirname(__file__)
-cgc_file = os.path.join(this_dir, 'Createc_global_const.yaml')
-with open(cgc_file, 'rt') as f:
-    cgc = yaml.safe_load(f.read())
+from .Createc_global_const import cgc
 
 
 class CreatecWin32:
@@ -5,22 +5,280 @@ Created on Wed May  8 17:57:09 2019
 @author: xuc1
 """
 
+import hashlib
 import io
+import json
+import mmap
 import os
 import re
+import tempfile
 import zlib
+from collections import namedtuple
+from collections.abc import Sequence
 from itertools import compress
 
 import numpy as np
-import pandas as pd
-import yaml
 
-from .utils.misc import XY2D
+from .Createc_global_const import cgc
+from .utils.misc import XY2D, Affine2D
 
-this_dir = os.path.dirname(__file__)
-cgc_file = os.path.join(this_dir, 'Createc_global_const.yaml')
-with open(cgc_file, 'rt') as f:
-    cgc = yaml.safe_load(f.read())
+# result of VERT_SPEC.stack()
+SPEC_STACK = namedtuple('SPEC_STACK', ['data', 'headers', 'table'])
+
+# default directory for DAT_IMG.cached(), can be overridden by the environment variable CREATEC_CACHE_DIR
+DEFAULT_CACHE_DIR = os.environ.get('CREATEC_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'createc'))
+
+
+class _LazyList(Sequence):
+    """
+    Read-only list whose elements are produced by a loader function on first access and cached afterwards
+
+    Parameters
+    ----------
+    length : int
+        Number of elements
+    loader : callable
+        Function taking the index and returning the element
+    """
+    _not_loaded = object()
+
+    def __init__(self, length, loader):
+        self._items = [self._not_loaded] * length
+        self._loader = loader
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        item = self._items[i]
+        if item is self._not_loaded:
+            item = self._items[i] = self._loader(i)
+        return item
+
+
+# key=value lines of the meta data, lines with more than one '=' are ignored
+_meta_line_re = re.compile(r'^([^=\n]*)=([^=\n]*)$', re.MULTILINE)
+_meta_types = {'int': int, 'float': float, 'str': str}
+# property name -> (meta key, type), see g_file_meta_fields
+_meta_fields = {name: (key, _meta_types[type_name]) for name, (key, type_name) in cgc['g_file_meta_fields'].items()}
+
+
+def _parse_meta(meta_binary):
+    """
+    Convert meta binary to the meta dictionary in a single regex scan, using ansi encoding.
+    Here ansi means Windows-1252 extended ascii code page CP-1252
+
+    Parameters
+    ----------
+    meta_binary : bin
+        meta data in binary
+
+    Returns
+    -------
+    meta : dict
+        lower case keywords -> str values. A line 'Key1 / Key2=value' gives both keywords.
+    """
+    # the text ends at the first null byte, what follows is binary padding (e.g. an embedded icon)
+    end = meta_binary.find(b'\x00')
+    meta_str = (meta_binary if end < 0 else meta_binary[:end]).decode('cp1252', errors='ignore')
+    meta = {'file_version': meta_str.split('\n', 1)[0]}
+    for keywords, value in _meta_line_re.findall(meta_str):
+        value = value[:-1]  # the trailing '\r'
+        for kw in keywords.split(' / '):
+            meta[kw.strip().lower()] = value
+    return meta
+
+
+def _write_replace(file_path, write, mode='wb'):
+    """
+    Write a file through a tmp file of its own in the same directory, which then replaces the file,
+    so that concurrent writers do not interleave and readers never see a partial file
+
+    Parameters
+    ----------
+    file_path : str
+        The file path
+    write : callable
+        Function taking the open file object and writing the content
+    mode : str
+        'wb' or 'wt'
+
+    Returns
+    -------
+    None : None
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file_path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _datetime_from_name(file_name):
+    """
+    Datetime of a file from its name in the Createc convention, e.g. A200622.081914.dat
+
+    Parameters
+    ----------
+    file_name : str
+        The file name
+
+    Returns
+    -------
+    datetime : datetime.datetime
+    """
+    import textwrap, datetime
+    temp = textwrap.wrap(''.join(filter(str.isdigit, file_name)), 2)
+    temp = [int(s) for s in temp]
+    temp[0] += cgc['g_file_year_pre']
+    return datetime.datetime(*temp)
+
+
+class FILE_META:
+    """
+    Typed meta data of a Createc file.
+
+    The properties listed in g_file_meta_fields are converted once at initiation, and the derived quantities
+    offset, nom_size, dac_transform, datetime and timestamp are computed on first access and cached. The cache is
+    not updated if the meta dict is modified afterwards.
+
+    Parameters
+    ----------
+    meta : dict
+        The meta dictionary, see _parse_meta()
+    file_name : str
+        The file name, used for datetime
+
+    Returns
+    -------
+    file_meta : FILE_META
+    """
+    __slots__ = ('meta', 'fn', 'file_version', '_offset', '_nom_size', '_dac_transform', '_datetime') + \
+        tuple(_meta_fields)
+
+    def __init__(self, meta, file_name=None):
+        self.meta = meta
+        self.fn = file_name
+        self.file_version = ''.join(e for e in meta['file_version'] if e.isalnum())
+        for name, (key, type_) in _meta_fields.items():
+            setattr(self, name, type_(meta[key]))
+        self._offset = self._nom_size = self._dac_transform = self._datetime = None
+
+    @classmethod
+    def from_binary(cls, meta_binary, file_name=None):
+        """
+        Parse the meta binary of a file
+
+        Parameters
+        ----------
+        meta_binary : bin
+            meta data in binary
+        file_name : str
+            The file name
+
+        Returns
+        -------
+        file_meta : FILE_META
+        """
+        return cls(_parse_meta(meta_binary), file_name)
+
+    @property
+    def offset(self):
+        """
+        Return offset relatvie to the whole range in angstrom in the format of namedtuple (x, y)
+
+        Returns
+        -------
+        offset : XY2D
+        """
+        if self._offset is None:
+            x_offset = float(self.meta['scanrotoffx'])
+            y_offset = float(self.meta['scanrotoffy'])
+            x_offset = -x_offset * cgc['g_XY_volt'] * self.xPiezoConst / 2 ** cgc['g_XY_bits']
+            y_offset = -y_offset * cgc['g_XY_volt'] * self.yPiezoConst / 2 ** cgc['g_XY_bits']
+            self._offset = XY2D(y=y_offset, x=x_offset)
+        return self._offset
+
+    @property
+    def nom_size(self):
+        """
+        Return the nominal size of image in angstrom in namedtuple (x, y) assuming no pre-termination while scanning.
+
+        Returns
+        -------
+        nom_size : XY2D
+        """
+        if self._nom_size is None:
+            self._nom_size = XY2D(y=float(self.meta['length y[a]']),
+                                  x=float(self.meta['length x[a]']))
+        return self._nom_size
+
+    @property
+    def dac_step(self):
+        """
+        Return the size in angstrom of one DAC step of the x and y scan in namedtuple (x, y)
+
+        Returns
+        -------
+        dac_step : XY2D
+        """
+        volt_per_step = cgc['g_XY_volt'] / 2 ** cgc['g_XY_bits']
+        return XY2D(y=volt_per_step * self.yPiezoConst, x=volt_per_step * self.xPiezoConst)
+
+    @property
+    def dac_transform(self):
+        """
+        Return the transform of a position in the scan frame, in DAC steps from its top left corner, into scanner
+        coordinates in angstrom.
+
+        It composes the DAC bits, the piezo constants, the offset and the rotation, with the same geometry as the
+        scan frame drawn by the STM software (see point_rot2D_y_inv). The nominal frame spans xPixel * 'delta x'
+        by yPixel * 'delta y' steps.
+
+        Returns
+        -------
+        dac_transform : Affine2D
+            Call it with an array in the shape of (N, 2), or an XY2D of arrays
+        """
+        if self._dac_transform is None:
+            step = self.dac_step
+            offset = self.offset
+            width = self.xPixel * self.deltaX_dac
+            self._dac_transform = Affine2D.rotation(np.deg2rad(self.rotation), offset, y_inv=True) @ \
+                Affine2D.translation(offset.x - width * step.x / 2, offset.y) @ Affine2D.scaling(step.x, step.y)
+        return self._dac_transform
+
+    @property
+    def datetime(self):
+        """
+        Return datetime objext of the file using the file name
+
+        Returns
+        -------
+        datatime : datatime.datetime
+        """
+        if self._datetime is None:
+            self._datetime = _datetime_from_name(self.fn)
+        return self._datetime
+
+    @property
+    def timestamp(self):
+        """
+        Same as datetime, but it converts to seconds since 1970, 1, 1.
+
+        Returns
+        -------
+        timestamp : datetime.timestamp
+        """
+        return self.datetime.timestamp()
 
 
 class GENERIC_FILE:
@@ -32,13 +290,17 @@ class GENERIC_FILE:
     generic_file : GENERIC_FILE
     """
 
-    def __init__(self, file_path=None, file_binary=None, file_name=None):
+    def __init__(self, file_path=None, file_binary=None, file_name=None, lazy=False):
         self.meta = dict()
 
         if file_path is not None:
             self.fp = file_path
             _, self.fn = os.path.split(self.fp)
-            self._meta_binary, self._data_binary = self._read_binary()
+            if lazy:
+                self._meta_binary = self._read_meta_binary()
+                self._data_binary = None  # read on demand, see _read_data_binary()
+            else:
+                self._meta_binary, self._data_binary = self._read_binary()
         else:
             self.fn = file_name
             self._meta_binary = file_binary[:int(cgc['g_file_data_bin_offset'])]
@@ -65,6 +327,34 @@ class GENERIC_FILE:
 
         return _binary[:cgc['g_file_data_bin_offset']], _binary[cgc['g_file_data_bin_offset']:]
 
+    def _read_meta_binary(self):
+        """
+        Read only the meta data part of the file through a memory map, leaving the data section untouched
+
+        Returns
+        -------
+        _meta_binary : bin
+            meta data in binary
+        """
+        with open(self.fp, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:cgc['g_file_data_bin_offset']]
+
+    def _read_data_binary(self):
+        """
+        Read the data part of the file, in case it was deferred by a lazy initiation
+
+        Returns
+        -------
+        _data_binary : bin
+            data in binary
+        """
+        if self._data_binary is None:
+            with open(self.fp, 'rb') as f:
+                f.seek(cgc['g_file_data_bin_offset'])
+                self._data_binary = f.read()
+        return self._data_binary
+
     def _bin2meta_dict(self):
         """
         Convert meta binary to meta info using ansi encoding, filling out the meta dictionary
@@ -74,20 +364,11 @@ class GENERIC_FILE:
         -------
         None : None
         """
-
-        meta_list = self._meta_binary.decode('cp1252', errors='ignore').split('\n')
-        self.meta['file_version'] = meta_list[0]
-        for line in meta_list:
-            temp = line.split('=')
-            if len(temp) == 2:
-                keywords = temp[0].split(' / ')
-                keywords = [kw.strip().lower() for kw in keywords]
-                for kw in keywords:
-                    self.meta[kw] = temp[1][:-1]
+        self.meta.update(_parse_meta(self._meta_binary))
 
     def _extracted_meta(self):
         """
-        Assign meta data to easily readable properties.
+        Assign meta data to easily readable properties, as listed in g_file_meta_fields of Createc_global_const.
         One can expand these at will, one may use the method meta_key() to see what keys are available
 
         Returns
@@ -95,24 +376,10 @@ class GENERIC_FILE:
         None : None
             It just populates all the self.properties
         """
-        self.file_version = self.meta['file_version']
-        self.file_version = ''.join(e for e in self.file_version if e.isalnum())
-        self.xPixel = int(self.meta['num.x'])
-        self.yPixel = int(self.meta['num.y'])
-        self.channels = int(self.meta['channels'])
-        self.ch_zoff = float(self.meta['chmodezoff'])
-        self.ch_bias = float(self.meta['chmodebias[mv]'])
-        self.chmode = int(self.meta['chmode'])
-        self.rotation = float(self.meta['rotation'])
-        self.ddeltaX = int(self.meta['dx_div_ddelta-x'])
-        self.deltaX_dac = int(self.meta['delta x'])
-        self.channels_code = self.meta['channelselectval']
-        self.scan_ymode = int(self.meta['scanymode'])
-        self.xPiezoConst = float(self.meta['xpiezoconst'])
-        self.yPiezoConst = float(self.meta['ypiezoconst'])
-        self.zPiezoConst = float(self.meta['zpiezoconst'])
-        self.bias = float(self.meta['biasvoltage'])
-        self.current = float(self.meta['fblogiset'])
+        self._file_meta = FILE_META(self.meta, self.fn)
+        self.file_version = self._file_meta.file_version
+        for name in _meta_fields:
+            setattr(self, name, getattr(self._file_meta, name))
 
     def _spec_meta(self, spec_meta: str, index_header: str, vz_header: str, spec_headers: str):
         """
@@ -168,17 +435,7 @@ class GENERIC_FILE:
         -------
         offset : XY2D
         """
-        x_offset = np.float(self.meta['scanrotoffx'])
-        y_offset = np.float(self.meta['scanrotoffy'])
-
-        # x_piezo_const = np.float(self.meta['xpiezoconst'])
-        # y_piezo_const = np.float(self.meta['ypiezoconst'])
-
-        x_offset = -x_offset * cgc['g_XY_volt'] * self.xPiezoConst / 2 ** cgc['g_XY_bits']
-        y_offset = -y_offset * cgc['g_XY_volt'] * self.yPiezoConst / 2 ** cgc['g_XY_bits']
-
-        # Offset = namedtuple('Offset', ['y', 'x'])
-        return XY2D(y=y_offset, x=x_offset)
+        return self._file_meta.offset
 
     @property
     def size(self):
@@ -189,10 +446,11 @@ class GENERIC_FILE:
         -------
         size : XY2D
         """
-        x = float(self.meta['length x[a]']) * self.img_pixels.x / self.xPixel
-        y = float(self.meta['length y[a]']) * self.img_pixels.y / self.yPixel
-        # Size = namedtuple('Size', ['y', 'x'])
-        return XY2D(y=y, x=x)
+        if self._size is None:
+            # Size = namedtuple('Size', ['y', 'x'])
+            self._size = XY2D(y=self.nom_size.y * self.img_pixels.y / self.yPixel,
+                              x=self.nom_size.x * self.img_pixels.x / self.xPixel)
+        return self._size
 
     @property
     def nom_size(self):
@@ -203,9 +461,19 @@ class GENERIC_FILE:
         -------
         nom_size : XY2D
         """
-        # Size = namedtuple('Size', ['y', 'x'])
-        return XY2D(y=float(self.meta['length y[a]']),
-                    x=float(self.meta['length x[a]']))
+        return self._file_meta.nom_size
+
+    @property
+    def dac_transform(self):
+        """
+        Return the transform of a position in the scan frame, in DAC steps from its top left corner, into scanner
+        coordinates in angstrom, see FILE_META.dac_transform
+
+        Returns
+        -------
+        dac_transform : Affine2D
+        """
+        return self._file_meta.dac_transform
 
     @property
     def datetime(self):
@@ -216,11 +484,7 @@ class GENERIC_FILE:
         -------
         datatime : datatime.datetime
         """
-        import textwrap, datetime
-        temp = textwrap.wrap(''.join(filter(str.isdigit, self.fn)), 2)
-        temp = [int(s) for s in temp]
-        temp[0] += cgc['g_file_year_pre']
-        return datetime.datetime(*temp)
+        return self._file_meta.datetime
 
     @property
     def timestamp(self):
@@ -231,7 +495,31 @@ class GENERIC_FILE:
         -------
         timestamp : datetime.timestamp
         """
-        return self.datetime.timestamp()
+        return self._file_meta.timestamp
+
+
+def read_meta(file):
+    """
+    Read only the meta data of a .dat, .vert file etc. without touching the data section.
+
+    Only the first g_file_data_bin_offset bytes are read, so it is cheap enough to index large directories.
+
+    Parameters
+    ----------
+    file : str or file object
+        Full file path, or a binary stream positioned at the beginning of the file
+
+    Returns
+    -------
+    generic_file : GENERIC_FILE
+        With the meta dict and the properties extracted from it, e.g. xPixel, bias, current, rotation, offset
+    """
+    if not hasattr(file, 'read'):
+        return GENERIC_FILE(file_path=file, lazy=True)
+
+    name = getattr(file, 'name', None)
+    file_name = os.path.basename(name) if isinstance(name, str) else None
+    return GENERIC_FILE(file_binary=file.read(cgc['g_file_data_bin_offset']), file_name=file_name)
 
 
 class VERT_SPEC(GENERIC_FILE):
@@ -249,23 +537,109 @@ class VERT_SPEC(GENERIC_FILE):
     """
 
     def __init__(self, file_path=None, file_binary=None, file_name=None):
+        import pandas as pd  # imported here, as it takes long and is only needed for the .vert files
         super().__init__(file_path, file_binary, file_name)
 
-        spec_data = self._data_binary.decode('cp1252', errors='ignore')
-        _, spec_meta, spec_f_obj = spec_data.split('\n', maxsplit=2)
+        _, spec_meta, spec_f_obj = self._data_binary.split(b'\n', maxsplit=2)
 
-        super()._spec_meta(spec_meta=spec_meta,
+        super()._spec_meta(spec_meta=spec_meta.decode('cp1252', errors='ignore'),
                            index_header='g_file_spec_index_header',
                            vz_header='g_file_spec_vz_header',
                            spec_headers='g_file_spec_headers')
         # f_obj = io.StringIO('\n'.join(self._line_list[cgc['g_file_spec_skip_rows'][self.file_version]:]))
-        self.spec = pd.read_csv(filepath_or_buffer=io.StringIO(spec_f_obj), sep=cgc['g_file_spec_delimiter'],
+        # the table is parsed from the raw bytes by the C engine of pandas, a single char delimiter is required
+        self.spec = pd.read_csv(filepath_or_buffer=io.BytesIO(spec_f_obj), sep=cgc['g_file_spec_delimiter'],
                                 header=None,
                                 names=self.spec_headers,
                                 index_col=cgc['g_file_spec_index_header'],
-                                engine='python',
+                                encoding='cp1252',
+                                engine='c',
                                 usecols=range(len(self.spec_headers)))
 
+    @staticmethod
+    def _read_head(file_path):
+        """
+        Read only the meta data and the spec meta line of a .vert file
+
+        Parameters
+        ----------
+        file_path : str
+            Full file path
+
+        Returns
+        -------
+        head : GENERIC_FILE
+            With the meta data and the spec_* attributes populated
+        """
+        head = GENERIC_FILE(file_path, lazy=True)
+        with open(file_path, 'rb') as f:
+            f.seek(cgc['g_file_data_bin_offset'])
+            f.readline()
+            spec_meta = f.readline()
+        head._spec_meta(spec_meta=spec_meta.decode('cp1252', errors='ignore'),
+                        index_header='g_file_spec_index_header',
+                        vz_header='g_file_spec_vz_header',
+                        spec_headers='g_file_spec_headers')
+        return head
+
+    @classmethod
+    def stack(cls, file_paths, workers=None):
+        """
+        Read a series of .vert files sharing the same channels and number of points into one 3d array.
+
+        The files are first checked to share spec_headers and spec_total_pt, reading only their headers,
+        then the tables are parsed in a thread pool directly into a preallocated array.
+
+        Parameters
+        ----------
+        file_paths : iterable of str
+            The file paths
+        workers : int, optional
+            Number of threads, the default None lets ThreadPoolExecutor decide
+
+        Returns
+        -------
+        spec_stack : SPEC_STACK
+            namedtuple (data, headers, table), where data is a float array in the shape of
+            (files, points, channels), headers are the channel names along the last axis, i.e. spec_headers
+            without the index, and table is a MetaTable with one row per file, including the columns
+            spec_pos_x and spec_pos_y
+        """
+        import pandas as pd
+        from concurrent.futures import ThreadPoolExecutor
+        from .meta_table import MetaTable
+
+        file_paths = list(file_paths)
+        if not file_paths:
+            raise ValueError('No files to stack')
+        with ThreadPoolExecutor(workers) as executor:
+            heads = list(executor.map(cls._read_head, file_paths))
+            first = heads[0]
+            for fp, head in zip(file_paths, heads):
+                if head.spec_headers != first.spec_headers or head.spec_total_pt != first.spec_total_pt:
+                    raise ValueError(f'{fp} has the channels {head.spec_headers} and {head.spec_total_pt} points, '
+                                     f'but {file_paths[0]} has {first.spec_headers} and {first.spec_total_pt}')
+
+            n_cols = len(first.spec_headers)
+            data = np.empty((len(file_paths), first.spec_total_pt, n_cols - 1))
+
+            def fill(i):
+                with open(file_paths[i], 'rb') as f:
+                    f.seek(cgc['g_file_data_bin_offset'])
+                    _, _, spec_f_obj = f.read().split(b'\n', maxsplit=2)
+                table = pd.read_csv(io.BytesIO(spec_f_obj), sep=cgc['g_file_spec_delimiter'], header=None,
+                                    usecols=range(1, n_cols), dtype=np.float64, engine='c').to_numpy()
+                if table.shape != data.shape[1:]:
+                    raise ValueError(f'{file_paths[i]} has {len(table)} rows instead of {first.spec_total_pt}')
+                data[i] = table
+
+            list(executor.map(fill, range(len(file_paths))))
+
+        table = MetaTable(heads, paths=file_paths,
+                          extra={'spec_pos_x': [head.spec_pos_x for head in heads],
+                                 'spec_pos_y': [head.spec_pos_y for head in heads]})
+        return SPEC_STACK(data=data, headers=first.spec_headers[1:], table=table)
+
 
 class DAT_IMG(GENERIC_FILE):
     """
@@ -289,6 +663,12 @@ class DAT_IMG(GENERIC_FILE):
         the binary content of the file together
     file_name : str
         the file_name as a string
+    lazy : bool
+        If True, only the meta data is read at initiation. The data section is read, decompressed and cropped
+        when an element of imgs or img_array_list is accessed for the first time.
+    channels : list[int], optional
+        Indices of the channels to load at initiation. The data is only decompressed as far as these channels,
+        the other channels are loaded on first access as in the lazy mode.
 
     Returns
     -------
@@ -297,40 +677,176 @@ class DAT_IMG(GENERIC_FILE):
         Meta data is a dict, one can expand the dict at will.
         Images are a list of numpy arrays.
     """
+    _decompress_chunk_size = 1 << 18  # bytes of compressed data fed to zlib at a time
+
+    def __init__(self, file_path=None, file_binary=None, file_name=None, lazy=False, channels=None):
+        super().__init__(file_path, file_binary, file_name, lazy=lazy)
+        self._img_pixels = None
+        self._size = None
+        self._img_buffer = None
+        self._pixel_transform = None
+        if lazy or channels is not None:
+            self.img_array_list = _LazyList(self.channels, self._load_img_array)
+            self.imgs = _LazyList(self.channels, self._load_img)
+            if channels:
+                self._read_img(max(channels) + 1)
+                for i in channels:
+                    self.imgs[i]
+        else:
+            self.img_array_list = self._read_img()
+            # imgs are numpy arrays, with rows with only zeros cropped off
+            self.imgs = [self._crop_img(arr) for arr in self.img_array_list]
+        # assert(len(set(img.shape for img in self.imgs)) <= 1)
 
-    def __init__(self, file_path=None, file_binary=None, file_name=None):
-        super().__init__(file_path, file_binary, file_name)
-        self.img_array_list = []
-        self._read_img()
+    @property
+    def img_pixels(self):
+        """
+        Return the number of pixels of the cropped image in namedtuple (x, y)
 
-        # imgs are numpy arrays, with rows with only zeros cropped off
-        self.imgs = [self._crop_img(arr) for arr in self.img_array_list]
-        # assert(len(set(img.shape for img in self.imgs)) <= 1)
-        # Pixels = namedtuple('Pixels', ['y', 'x'])
-        self.img_pixels = XY2D(y=self.imgs[0].shape[0],
-                               x=self.imgs[0].shape[1])  # size in (y, x)
+        Returns
+        -------
+        img_pixels : XY2D
+        """
+        if self._img_pixels is None:
+            # Pixels = namedtuple('Pixels', ['y', 'x'])
+            self._img_pixels = XY2D(y=self.imgs[0].shape[0],
+                                    x=self.imgs[0].shape[1])  # size in (y, x)
+        return self._img_pixels
+
+    @property
+    def pixel_transform(self):
+        """
+        Return the transform of pixel indices into scanner coordinates in angstrom, computed on first access.
+
+        It is dac_transform after the DAC steps of a pixel ('delta x', 'delta y'), so it composes the DAC bits,
+        the piezo constants, the offset and the rotation into one matrix. Points are (x, y) = (column, row) of the
+        cropped images, integers being the pixel centers.
+
+        Returns
+        -------
+        pixel_transform : Affine2D
+            Call it with an array in the shape of (N, 2), or an XY2D of arrays, e.g.
+            file.pixel_transform(XY2D(x=cols, y=rows)); its inverse() maps angstrom to pixel indices
+        """
+        if self._pixel_transform is None:
+            delta_x = self.deltaX_dac
+            delta_y = float(self.meta.get('delta y', delta_x))
+            # the frame starts scanning from the bottom for scan_ymode 2, i.e. the cropped rows are on the top
+            skipped = self.yPixel - self.img_pixels.y if self.scan_ymode == 2 else 0
+            self._pixel_transform = self.dac_transform @ \
+                Affine2D.translation(0.5 * delta_x, (skipped + 0.5) * delta_y) @ Affine2D.scaling(delta_x, delta_y)
+        return self._pixel_transform
+
+    def _load_img_array(self, i):
+        """
+        Loader of the i-th element of img_array_list for the lazy mode
+
+        Parameters
+        ----------
+        i : int
+            channel index
+
+        Returns
+        -------
+        arr : numpy array
+            Individual image
+        """
+        return self._read_img(i + 1)[i]
+
+    def _load_img(self, i):
+        """
+        Loader of the i-th element of imgs for the lazy mode
+
+        Parameters
+        ----------
+        i : int
+            channel index
+
+        Returns
+        -------
+        arr : numpy array
+            Cropped image
+        """
+        return self._crop_img(self.img_array_list[i])
 
-    def _read_img(self):
+    def _read_img(self, n_channels=None):
         """
-        Convert img binary to numpy array's, filling out the img_array_list.
-        The image was compressed using zlib. So here they are decompressed.
+        Convert img binary to a list of numpy array's, one for each channel.
+        The image was compressed using zlib. So here they are decompressed incrementally into a preallocated
+        array, stopping as soon as the first n_channels channels are filled. A later call with more channels
+        resumes the decompression where it stopped.
         prerequisite: self.xPixel, self.yPixel, self.channels
 
+        Parameters
+        ----------
+        n_channels : int, optional
+            Number of channels needed, all channels by default
+
+        Returns
+        -------
+        img_array_list : list[numpy array]
+            The first n_channels channels
+        """
+        if n_channels is None:
+            n_channels = self.channels
+        dtype = np.dtype(cgc['g_file_dat_img_pixel_data_npdtype'])
+        channel_bytes = self.xPixel * self.yPixel * dtype.itemsize
+        if self._img_buffer is None:
+            # the first value in the data section is not part of the images, hence the extra item
+            self._img_buffer = bytearray(dtype.itemsize + channel_bytes * self.channels)
+            self._img_filled = 0
+            self._data_pos = 0
+            self._decompressor = zlib.decompressobj()
+        if self._decompressor is not None:
+            self._decompress(dtype.itemsize + channel_bytes * n_channels)
+
+        img_array = np.frombuffer(self._img_buffer, dtype, offset=dtype.itemsize)
+        img_array = np.reshape(img_array, (self.channels * self.yPixel, self.xPixel))
+        return [img_array[self.yPixel * i:self.yPixel * (i + 1)] for i in range(n_channels)]
+
+    def _decompress(self, n_bytes):
+        """
+        Decompress the data binary into self._img_buffer, until at least the first n_bytes are filled,
+        the data is exhausted or the buffer is full. A ValueError is raised if the data is exhausted before the
+        buffer is full, e.g. for a file still being written.
+
+        Parameters
+        ----------
+        n_bytes : int
+            Number of bytes needed
+
         Returns
         -------
         None : None
         """
-        try:
-            # if it is compressed data, then decompress it
-            decompressed_data = zlib.decompress(self._data_binary)
-        except zlib.error:
-            # else if it is not compressed, then do nothing
-            decompressed_data = self._data_binary
-        img_array = np.frombuffer(decompressed_data, np.dtype(cgc['g_file_dat_img_pixel_data_npdtype']))
-        img_array = np.reshape(img_array[1: self.xPixel * self.yPixel * self.channels + 1],
-                               (self.channels * self.yPixel, self.xPixel))
-        for i in range(self.channels):
-            self.img_array_list.append(img_array[self.yPixel * i:self.yPixel * (i + 1)])
+        data = memoryview(self._read_data_binary())
+        buffer = memoryview(self._img_buffer)
+        decompressor = self._decompressor
+        while self._img_filled < n_bytes:
+            chunk = decompressor.unconsumed_tail
+            if not chunk:
+                chunk = data[self._data_pos:self._data_pos + self._decompress_chunk_size]
+                self._data_pos += len(chunk)
+            if not chunk or decompressor.eof:
+                break
+            try:
+                # if it is compressed data, then decompress it
+                out = decompressor.decompress(chunk, n_bytes - self._img_filled)
+            except zlib.error:
+                if self._img_filled:
+                    raise
+                # else if it is not compressed, then take it as it is
+                out = data[:len(buffer)]
+                self._data_pos = len(data)
+            buffer[self._img_filled:self._img_filled + len(out)] = out
+            self._img_filled += len(out)
+
+        exhausted = self._data_pos >= len(data) and not decompressor.unconsumed_tail
+        if exhausted and not decompressor.eof and self._img_filled < len(buffer):
+            raise ValueError(f'The data section of {self.fn} is truncated, only {self._img_filled} of '
+                             f'{len(buffer)} bytes could be decompressed')
+        if self._img_filled == len(buffer) or decompressor.eof or exhausted:
+            self._decompressor = None
 
     @staticmethod
     def _crop_img(arr):
@@ -349,6 +865,182 @@ class DAT_IMG(GENERIC_FILE):
         """
         return arr[~np.all(arr == 0, axis=1)]
 
+    def _source_stat(self):
+        """
+        Return the mtime and size of the source file, used to validate a cache
+
+        Returns
+        -------
+        source_stat : dict or None
+            None if the instance was not created from a file path
+        """
+        fp = getattr(self, 'fp', None)
+        if fp is None:
+            return None
+        stat = os.stat(fp)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+    def to_cache(self, path):
+        """
+        Save the instance into a cache directory, which can be reopened by from_cache() almost for free.
+
+        The cache holds the uncompressed image array as .npy, the rows kept by the cropping of each channel,
+        and a JSON copy of meta together with the mtime and size of the source file.
+
+        Parameters
+        ----------
+        path : str
+            The cache directory, created if not existing
+
+        Returns
+        -------
+        None : None
+        """
+        os.makedirs(path, exist_ok=True)
+        channel_arrays = list(self.img_array_list)
+        # written aside and moved into place, as other instances may have the old files memory-mapped,
+        # and other processes may write the same cache at once
+        for name, arr in [('img_array', np.concatenate(channel_arrays)),
+                          ('rows', np.stack([~np.all(arr == 0, axis=1) for arr in channel_arrays]))]:
+            _write_replace(os.path.join(path, name + '.npy'), lambda f, arr=arr: np.save(f, arr))
+        # meta.json is written last, so that its presence marks a complete cache
+        cache = {'fn': self.fn, 'source': self._source_stat(), 'meta': self.meta}
+        _write_replace(os.path.join(path, 'meta.json'), lambda f: json.dump(cache, f), mode='wt')
+
+    @classmethod
+    def from_cache(cls, path, file_path=None):
+        """
+        Reopen an instance saved by to_cache(). The images are memory-mapped copy-on-write from the cache,
+        i.e. they are only read on access and can be modified without affecting the cache.
+
+        Parameters
+        ----------
+        path : str
+            The cache directory
+        file_path : str, optional
+            The source file. If given, the cache is checked against its mtime and size.
+
+        Returns
+        -------
+        dat_img : DAT_IMG or None
+            None if the cache does not exist or is outdated
+        """
+        try:
+            with open(os.path.join(path, 'meta.json'), 'rt') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self = cls.__new__(cls)
+        self.meta = cache['meta']
+        self.fn = cache['fn']
+        if file_path is not None:
+            self.fp = file_path
+            try:
+                if self._source_stat() != cache['source']:
+                    return None
+            except OSError:
+                return None
+        self._meta_binary = self._data_binary = None
+        self._extracted_meta()
+        self._img_pixels = None
+        self._size = None
+        self._img_buffer = None
+        self._decompressor = None
+        self._pixel_transform = None
+
+        self._set_img_array(np.load(os.path.join(path, 'img_array.npy'), mmap_mode='c'),
+                            np.load(os.path.join(path, 'rows.npy')))
+        return self
+
+    def _set_img_array(self, img_array, rows):
+        """
+        Set img_array_list as views of one array of all channels, and imgs as the kept rows of each channel
+
+        Parameters
+        ----------
+        img_array : numpy array
+            The images of all channels stacked along the rows, in the shape of (channels * yPixel, xPixel)
+        rows : numpy array
+            bool array in the shape of (channels, yPixel), the rows kept by the cropping of each channel
+
+        Returns
+        -------
+        None : None
+        """
+        self.img_array_list = [img_array[self.yPixel * i:self.yPixel * (i + 1)] for i in range(self.channels)]
+        self.imgs = []
+        for arr, kept in zip(self.img_array_list, rows):
+            kept_idx = np.flatnonzero(kept)
+            if len(kept_idx) and kept_idx[-1] - kept_idx[0] + 1 == len(kept_idx):
+                self.imgs.append(arr[kept_idx[0]:kept_idx[-1] + 1])  # contiguous rows, stay a view
+            else:
+                self.imgs.append(arr[kept])
+
+    def __getstate__(self):
+        """
+        Pickle the images as one array of all channels, without the raw binaries, the decompression state
+        and the cropped copies, e.g. for the results of load_many(). A lazy instance loads all channels first.
+
+        Returns
+        -------
+        state : dict
+        """
+        state = self.__dict__.copy()
+        for key in ['_meta_binary', '_data_binary', '_img_buffer', '_img_filled', '_data_pos', '_decompressor',
+                    'img_array_list', 'imgs']:
+            state.pop(key, None)
+        channel_arrays = list(self.img_array_list)
+        state['img_array'] = np.concatenate(channel_arrays)
+        state['rows'] = np.stack([~np.all(arr == 0, axis=1) for arr in channel_arrays])
+        return state
+
+    def __setstate__(self, state):
+        """
+        Unpickle an instance pickled by __getstate__(), the images are rebuilt as views of one array
+
+        Parameters
+        ----------
+        state : dict
+
+        Returns
+        -------
+        None : None
+        """
+        state = dict(state)
+        img_array, rows = state.pop('img_array'), state.pop('rows')
+        self.__dict__.update(state)
+        self._meta_binary = self._data_binary = None
+        self._img_buffer = None
+        self._decompressor = None
+        self._set_img_array(img_array, rows)
+
+    @classmethod
+    def cached(cls, file_path, cache_dir=None):
+        """
+        Open a .dat file through the automatic cache. The cache is (re)built if it does not exist,
+        or if the mtime or size of the file has changed.
+
+        Parameters
+        ----------
+        file_path : str
+            the full path to the .dat file
+        cache_dir : str, optional
+            The root cache directory, DEFAULT_CACHE_DIR by default
+
+        Returns
+        -------
+        dat_img : DAT_IMG
+        """
+        cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        key = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(cache_dir, f'{os.path.basename(file_path)}.{key}')
+        file = cls.from_cache(path, file_path=file_path)
+        if file is None:
+            file = cls(file_path)
+            file.to_cache(path)
+        return file
+
 
 class GRID_SPEC:
     """
@@ -358,15 +1050,25 @@ class GRID_SPEC:
     ----------
     file_path : str
         The file path to the .specgrid file
+    memmap : bool
+        If True, the file is memory-mapped read-only instead of being read into memory. specdata and cube_array
+        are then zero-copy views over the file, and only the pages actually accessed are read from disk.
+        Combined with the chunked methods reduce(), gradient() and map_spectra(), grids larger than the memory
+        can be processed.
     """
-    def __init__(self, file_path):
+    _chunk_bytes = 1 << 26  # bytes of specdata processed at a time by the chunked methods
+
+    def __init__(self, file_path, memmap=False):
 
         self.fp = file_path
         _, self.fn = os.path.split(self.fp)
         # self.DAT_IMG = DAT_IMG(file_path + ".dat")
 
-        with open(file_path, "rb") as file:
-            b = np.fromfile(file, dtype=np.float32)
+        if memmap:
+            b = np.memmap(file_path, dtype=np.float32, mode='r')
+        else:
+            with open(file_path, "rb") as file:
+                b = np.fromfile(file, dtype=np.float32)
 
         a = b[:256].view(np.uint32)
 
@@ -418,3 +1120,338 @@ class GRID_SPEC:
         self.cube_array = self.specdata[:, :, :, 1].T
 
         _, self.xpix, self.ypix = self.cube_array.shape
+
+    def spectrum(self, ix, iy, channel=None):
+        """
+        Return the spectrum at one grid point, i.e. specdata[ix, iy], which is shown at cube_array[:, iy, ix]
+
+        Parameters
+        ----------
+        ix : int
+            Index along the first axis of specdata
+        iy : int
+            Index along the second axis of specdata
+        channel : int, optional
+            Channel index, all channels by default
+
+        Returns
+        -------
+        spectrum : numpy array
+            In the shape of (vertpoints, channels), or (vertpoints,) if channel is given
+        """
+        spec = self.specdata[ix, iy]
+        return np.array(spec if channel is None else spec[:, channel])
+
+    def energy_slice(self, k, channel=1):
+        """
+        Return the map of one channel at the k-th spectrum point, same as cube_array[k] for the default channel
+
+        Parameters
+        ----------
+        k : int
+            Index of the spectrum point, see specvz3 for the corresponding bias
+        channel : int
+            Channel index
+
+        Returns
+        -------
+        energy_slice : numpy array
+            2d map
+        """
+        return np.array(self.specdata[:, :, k, channel].T)
+
+    def _chunks(self, chunk_bytes=None):
+        """
+        Split specdata along its first axis into chunks of about chunk_bytes
+
+        Parameters
+        ----------
+        chunk_bytes : int, optional
+            Bytes per chunk, _chunk_bytes by default
+
+        Returns
+        -------
+        chunks : list[slice]
+        """
+        chunk_bytes = self._chunk_bytes if chunk_bytes is None else chunk_bytes
+        step = max(1, chunk_bytes // max(1, self.specdata[0].nbytes))
+        return [slice(i, i + step) for i in range(0, self.specdata.shape[0], step)]
+
+    @staticmethod
+    def _run(func, chunks, workers):
+        """
+        Apply func to the chunks, in a thread pool if workers > 1
+
+        Parameters
+        ----------
+        func : callable
+            Function of a slice
+        chunks : list[slice]
+            See _chunks()
+        workers : int
+            Number of threads
+
+        Returns
+        -------
+        results : list
+            In the order of the chunks
+        """
+        if workers == 1 or len(chunks) <= 1:
+            return [func(chunk) for chunk in chunks]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(func, chunks))
+
+    @staticmethod
+    def _select(block, channel):
+        """
+        Select a channel of a block of specdata
+
+        Parameters
+        ----------
+        block : numpy.array
+            In the shape of (n, ny, vertpoints, channels)
+        channel : int or None
+            Channel index, or None for all channels
+
+        Returns
+        -------
+        block : numpy.array
+        """
+        return block if channel is None else block[..., channel]
+
+    def reduce(self, op='mean', axis='grid', channel=None, chunk_bytes=None, workers=1):
+        """
+        Reduce the grid with bounded memory, streaming over chunks of grid rows
+
+        Parameters
+        ----------
+        op : str
+            'sum', 'mean', 'min' or 'max'
+        axis : str
+            'grid' to reduce over all grid points, giving e.g. the mean spectrum, or 'bias' to reduce each
+            spectrum along the bias axis, giving a map
+        channel : int, optional
+            Channel index, all channels by default
+        chunk_bytes : int, optional
+            Bytes of specdata processed at a time
+        workers : int
+            Number of threads, numpy releases the GIL during the reductions
+
+        Returns
+        -------
+        result : numpy array
+            For axis='grid' a spectrum in the shape of (vertpoints, channels), or (vertpoints,) if channel is
+            given. For axis='bias' a map oriented as energy_slice(), with a last axis of channels if channel is
+            None. Sums and means are accumulated in float64.
+        """
+        if op not in ('sum', 'mean', 'min', 'max'):
+            raise ValueError(f'Unknown op {op}, use sum, mean, min or max')
+        if axis not in ('grid', 'bias'):
+            raise ValueError(f'Unknown axis {axis}, use grid or bias')
+        func = {'sum': np.sum, 'mean': np.sum, 'min': np.min, 'max': np.max}[op]
+        kwargs = {'dtype': np.float64} if op in ('sum', 'mean') else {}
+
+        if axis == 'grid':
+            def reduce_chunk(chunk):
+                return func(self._select(self.specdata[chunk], channel), axis=(0, 1), **kwargs)
+
+            partials = np.stack(self._run(reduce_chunk, self._chunks(chunk_bytes), workers))
+            result = func(partials, axis=0)
+            return result / (self.specdata.shape[0] * self.specdata.shape[1]) if op == 'mean' else result
+
+        shape = self.specdata.shape[:2] + (() if channel is not None else self.specdata.shape[3:])
+        out = np.empty(shape, dtype=np.float64 if op in ('sum', 'mean') else self.specdata.dtype)
+
+        def reduce_chunk(chunk):
+            values = func(self._select(self.specdata[chunk], channel), axis=2, **kwargs)
+            out[chunk] = values / self.specdata.shape[2] if op == 'mean' else values
+
+        self._run(reduce_chunk, self._chunks(chunk_bytes), workers)
+        return np.swapaxes(out, 0, 1)
+
+    def map_spectra(self, func, channel=None, out=None, chunk_bytes=None, workers=1):
+        """
+        Apply a vectorized kernel to all spectra with bounded memory, streaming over chunks of grid rows.
+
+        func gets a batch of spectra in the shape of (n, vertpoints, channels), or (n, vertpoints) if channel is
+        given, and returns an array whose first axis is n, e.g. normalized spectra or fitted parameters.
+
+        Parameters
+        ----------
+        func : callable
+            Kernel applied to batches of spectra
+        channel : int, optional
+            Channel index, all channels by default
+        out : numpy.array, optional
+            Output in the shape of (specdata.shape[0], specdata.shape[1]) + result shape of one spectrum, e.g. a
+            numpy.lib.format.open_memmap for results too large for the memory. Allocated by default.
+        chunk_bytes : int, optional
+            Bytes of specdata processed at a time
+        workers : int
+            Number of threads, only useful if func releases the GIL, as most numpy operations do
+
+        Returns
+        -------
+        out : numpy.array
+            Results in the layout of specdata, i.e. out[ix, iy] belongs to specdata[ix, iy]
+
+        Examples
+        --------
+        >>> # normalize each spectrum of channel 1 to its mean
+        >>> grid.map_spectra(lambda s: s / s.mean(axis=1, keepdims=True), channel=1)
+        """
+        n_a, n_b = self.specdata.shape[:2]
+
+        def apply(chunk):
+            block = self._select(self.specdata[chunk], channel)
+            result = np.asarray(func(block.reshape((-1,) + block.shape[2:])))
+            return result.reshape(block.shape[:2] + result.shape[1:])
+
+        chunks = self._chunks(chunk_bytes)
+        first = apply(chunks[0])
+        if out is None:
+            out = np.empty((n_a, n_b) + first.shape[2:], dtype=first.dtype)
+        out[chunks[0]] = first
+
+        def fill(chunk):
+            out[chunk] = apply(chunk)
+
+        self._run(fill, chunks[1:], workers)
+        return out
+
+    def gradient(self, channel=1, out=None, chunk_bytes=None, workers=1):
+        """
+        Numerical derivative of the spectra along the bias axis, e.g. dI/dV, with bounded memory
+
+        Parameters
+        ----------
+        channel : int
+            Channel index
+        out : numpy.array, optional
+            Output in the shape of (specdata.shape[0], specdata.shape[1], vertpoints), see map_spectra()
+        chunk_bytes : int, optional
+            Bytes of specdata processed at a time
+        workers : int
+            Number of threads
+
+        Returns
+        -------
+        gradient : numpy.array
+            In the layout of specdata, i.e. gradient[ix, iy] is the derivative of specdata[ix, iy, :, channel]
+            with respect to the bias in specvz3[:, 0]
+        """
+        bias = self.specvz3[:, 0].astype(np.float64)
+        return self.map_spectra(lambda spectra: np.gradient(spectra, bias, axis=1).astype(self.specdata.dtype),
+                                channel=channel, out=out, chunk_bytes=chunk_bytes, workers=workers)
+
+
+_file_classes = {'dat': DAT_IMG, 'vert': VERT_SPEC, 'specgrid': GRID_SPEC}
+
+
+def _file_kind(file_path):
+    """
+    Guess the kind of a Createc file from its extension, i.e. one of the keys in _file_classes
+
+    Parameters
+    ----------
+    file_path : str
+        The file path
+
+    Returns
+    -------
+    kind : str
+    """
+    kind = os.path.splitext(file_path)[1][1:].lower()
+    if kind not in _file_classes:
+        raise ValueError(f'Unknown Createc file type: {file_path}')
+    return kind
+
+
+def _load(file_path, kind='auto', **kwargs):
+    """
+    Create the file instance according to the kind, to be called in the worker processes of load_many()
+
+    Parameters
+    ----------
+    file_path : str
+        The file path
+    kind : str
+        'auto', 'dat', 'vert' or 'specgrid'
+    kwargs :
+        Extra keyword arguments of the file class
+
+    Returns
+    -------
+    file : DAT_IMG, VERT_SPEC or GRID_SPEC
+    """
+    if kind == 'auto':
+        kind = _file_kind(file_path)
+    return _file_classes[kind](file_path, **kwargs)
+
+
+def load_many(file_paths, workers=None, kind='auto', ordered=True):
+    """
+    Load many .dat, .vert and .specgrid files in parallel using a process pool.
+
+    On Windows the call has to be guarded by if __name__ == '__main__' in the calling script,
+    as the worker processes are spawned.
+
+    Parameters
+    ----------
+    file_paths : iterable of str
+        The file paths
+    workers : int, optional
+        Number of worker processes, the default None means the number of CPUs. With workers=1 the files are
+        loaded in the current process.
+    kind : str
+        'auto' to decide the class from the file extension, or one of 'dat', 'vert', 'specgrid'
+    ordered : bool
+        If True, return a list in the input order. Otherwise return a generator yielding the files as soon as
+        they are loaded.
+
+    Returns
+    -------
+    files : list or generator
+        DAT_IMG, VERT_SPEC or GRID_SPEC instances
+    """
+    file_paths = list(file_paths)
+    kinds = [_file_kind(fp) if kind == 'auto' else kind for fp in file_paths]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if ordered:
+        if workers == 1:
+            return [_load(fp, k) for fp, k in zip(file_paths, kinds)]
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(file_paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_load, file_paths, kinds, chunksize=chunksize))
+    return _load_as_completed(file_paths, kinds, workers)
+
+
+def _load_as_completed(file_paths, kinds, workers):
+    """
+    Generator for load_many(ordered=False)
+
+    Parameters
+    ----------
+    file_paths : list[str]
+        The file paths
+    kinds : list[str]
+        The kinds of the files
+    workers : int
+        Number of worker processes
+
+    Yields
+    ------
+    file : DAT_IMG, VERT_SPEC or GRID_SPEC
+    """
+    if workers == 1:
+        for fp, k in zip(file_paths, kinds):
+            yield _load(fp, k)
+        return
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_load, fp, k) for fp, k in zip(file_paths, kinds)]
+        for future in as_completed(futures):
+            yield future.result()
@@ -3,9 +3,36 @@
 Created on Wed May 20 22:24:50 2020
 
 @author: xuc1
+
+The classes and functions below are imported lazily on first access, so that importing createc is cheap,
+e.g. Createc_pyCOM is never imported on machines only analysing data.
 """
 __version__ = '1.0'
 
-from .Createc_pyCOM import CreatecWin32
-from .Createc_pyFile import DAT_IMG
-from .Createc_pyFile import VERT_SPEC
+# name -> submodule
+_lazy_attrs = {'CreatecWin32': 'Createc_pyCOM',
+               'DAT_IMG': 'Createc_pyFile',
+               'VERT_SPEC': 'Createc_pyFile',
+               'GRID_SPEC': 'Createc_pyFile',
+               'read_meta': 'Createc_pyFile',
+               'load_many': 'Createc_pyFile',
+               'MetaTable': 'meta_table',
+               'aload': 'aio',
+               'aload_many': 'aio',
+               'watch': 'watcher',
+               'Mosaic': 'mosaic'}
+
+__all__ = list(_lazy_attrs)
+
+
+def __getattr__(name):
+    if name in _lazy_attrs:
+        import importlib
+        value = getattr(importlib.import_module('.' + _lazy_attrs[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs))
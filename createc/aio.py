@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio interface to load Createc files without blocking the event loop
+
+The reading and decoding run in an executor, by default the thread pool of the event loop.
+zlib and the pandas C parser release the GIL for most of the work. A ProcessPoolExecutor can be passed
+for a full isolation, but only for eager loads: the files are pickled back from the worker processes,
+so lazy=True and channels=... are rejected with it.
+"""
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from .Createc_pyFile import DAT_IMG, VERT_SPEC, _file_classes, _file_kind
+
+
+def _load_any(file, file_name=None, kind='auto', kwargs=None):
+    """
+    Create the file instance from a path or from the binary content, to be run in the executor
+
+    Parameters
+    ----------
+    file : str or bytes
+        File path or the binary content of the file
+    file_name : str, optional
+        The file name, needed for the binary content
+    kind : str
+        'auto', 'dat', 'vert' or 'specgrid'
+    kwargs : dict, optional
+        Extra keyword arguments of the file class
+
+    Returns
+    -------
+    file : DAT_IMG, VERT_SPEC or GRID_SPEC
+    """
+    kwargs = {} if kwargs is None else kwargs
+    is_binary = isinstance(file, (bytes, bytearray, memoryview))
+    if kind == 'auto':
+        if is_binary and file_name is None:
+            raise ValueError('file_name is needed to find the file type of a binary content')
+        kind = _file_kind(file_name if is_binary else file)
+    file_class = _file_classes[kind]
+    if not is_binary:
+        return file_class(file, **kwargs)
+    if file_class not in (DAT_IMG, VERT_SPEC):
+        raise ValueError(f'{file_class.__name__} can only be loaded from a file path')
+    return file_class(file_binary=bytes(file), file_name=file_name, **kwargs)
+
+
+def _check_executor(executor, kwargs):
+    """
+    Reject the lazy loads in a process pool, whose results are pickled back with all channels loaded
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor or None
+        The executor
+    kwargs : dict
+        Extra keyword arguments of the file class
+
+    Returns
+    -------
+    None : None
+    """
+    if isinstance(executor, ProcessPoolExecutor) and (kwargs.get('lazy') or kwargs.get('channels') is not None):
+        raise ValueError('lazy and channels cannot be used with a ProcessPoolExecutor, as the files are pickled '
+                         'back from the worker processes. Use a thread pool, or load the files eagerly.')
+
+
+async def aload(file, file_name=None, kind='auto', executor=None, **kwargs):
+    """
+    Load a .dat, .vert or .specgrid file in an executor.
+
+    Cancelling the coroutine returns control immediately, the parsing already started in a thread is finished
+    in the background and its result discarded.
+
+    Parameters
+    ----------
+    file : str or bytes
+        File path or the binary content of the file, e.g. from an upload
+    file_name : str, optional
+        The file name, needed for the binary content
+    kind : str
+        'auto' to decide the class from the file name, or one of 'dat', 'vert', 'specgrid'
+    executor : concurrent.futures.Executor, optional
+        Executor to run the parsing, the default executor of the event loop by default.
+        A ProcessPoolExecutor only supports eager loads.
+    kwargs :
+        Extra keyword arguments of the file class, e.g. lazy=True
+
+    Returns
+    -------
+    file : DAT_IMG, VERT_SPEC or GRID_SPEC
+    """
+    _check_executor(executor, kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_load_any, file, file_name, kind, kwargs))
+
+
+async def aload_many(files, kind='auto', executor=None, max_pending=8, **kwargs):
+    """
+    Asynchronous generator loading many files and yielding each one as soon as it is parsed.
+
+    At most max_pending files are parsed at the same time, so that a large batch does not flood the executor.
+    Closing the generator, or cancelling the task iterating over it, cancels the pending loads.
+
+    Parameters
+    ----------
+    files : iterable of str or (bytes, str)
+        File paths, or tuples of (binary content, file name)
+    kind : str
+        'auto' to decide the class from the file names, or one of 'dat', 'vert', 'specgrid'
+    executor : concurrent.futures.Executor, optional
+        Executor to run the parsing, the default executor of the event loop by default.
+        A ProcessPoolExecutor only supports eager loads.
+    max_pending : int
+        Maximum number of files being parsed at the same time
+    kwargs :
+        Extra keyword arguments of the file class
+
+    Yields
+    ------
+    file : DAT_IMG, VERT_SPEC or GRID_SPEC
+    """
+    _check_executor(executor, kwargs)
+    files = iter(files)
+    pending = set()
+
+    def submit():
+        for file in files:
+            file, file_name = file if isinstance(file, tuple) else (file, None)
+            pending.add(asyncio.ensure_future(aload(file, file_name, kind, executor, **kwargs)))
+            if len(pending) >= max_pending:
+                return
+
+    try:
+        submit()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+            submit()
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
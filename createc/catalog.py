@@ -0,0 +1,635 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent meta data catalog of Createc data directories
+
+The catalog is a SQLite database holding the extracted meta data of every .dat, .vert and .specgrid file
+under a root directory, so that files can be searched without re-reading their headers. It also holds a spatial
+index (an SQLite R*Tree) of the footprints of the scans and the positions of the spectra in scanner coordinates,
+to find the files covering a location.
+"""
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+from .Createc_pyFile import VERT_SPEC, read_meta
+
+CATALOG_FILE_NAME = '.createc_catalog.sqlite'
+
+# column name -> sqlite type, in the order of the table
+_columns = {'path': 'TEXT PRIMARY KEY',
+            'kind': 'TEXT',
+            'mtime': 'REAL',
+            'file_size': 'INTEGER',
+            'datetime': 'REAL',
+            'bias': 'REAL',
+            'current': 'REAL',
+            'xPixel': 'INTEGER',
+            'yPixel': 'INTEGER',
+            'channels': 'INTEGER',
+            'chmode': 'INTEGER',
+            'rotation': 'REAL',
+            'offset_x': 'REAL',
+            'offset_y': 'REAL',
+            'nom_size_x': 'REAL',
+            'nom_size_y': 'REAL'}
+_indexed_columns = ['kind', 'datetime', 'bias', 'current', 'offset_x', 'offset_y']
+_extensions = {'.dat': 'dat', '.vert': 'vert', '.specgrid': 'specgrid'}
+_footprint_kinds = ['dat', 'vert']  # kinds of files having a location, see _footprint()
+_next_corner = [1, 2, 3, 0]  # corners of a footprint are in the order around the quadrilateral
+_max_variables = 500  # parameters per SQL statement, below the SQLite limit
+_max_scan = 2048  # nearest() computes the distances to all matching files if they are fewer
+_nearest_batch = 64  # nearest() checks the footprints with the closest bounding boxes in batches from this size
+
+
+def _footprint_id(path):
+    """
+    Id of a file in the R*Tree, a hash of the path which stays valid when the files table is rebuilt
+
+    Parameters
+    ----------
+    path : str
+        Path relative to root
+
+    Returns
+    -------
+    id : int
+        Positive 63-bit integer
+    """
+    return int.from_bytes(hashlib.blake2b(path.encode(), digest_size=8).digest(), 'big') >> 1
+
+
+def _scan(root):
+    """
+    Walk through the root directory and find all Createc files
+
+    Parameters
+    ----------
+    root : str
+        Root directory
+
+    Yields
+    ------
+    (str, str, os.stat_result)
+        Path relative to root, kind of file and stat result
+    """
+    for dir_path, _, file_names in os.walk(root):
+        for fn in file_names:
+            kind = _extensions.get(os.path.splitext(fn)[1].lower())
+            if kind is None:
+                continue
+            full_path = os.path.join(dir_path, fn)
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:  # deleted since the walk listed it
+                continue
+            yield os.path.relpath(full_path, root), kind, stat
+
+
+def _file_record(full_path, kind):
+    """
+    Extract the catalog fields of one file by reading its header only
+
+    Parameters
+    ----------
+    full_path : str
+        Full file path
+    kind : str
+        'dat', 'vert' or 'specgrid'
+
+    Returns
+    -------
+    record : dict
+        column name -> value, and 'footprint' -> corners for .dat and .vert files, see _footprint()
+    """
+    if kind == 'specgrid':
+        # the .specgrid header is 256 words, see GRID_SPEC
+        b = np.fromfile(full_path, dtype=np.float32, count=256)
+        a = b.view(np.uint32)
+        return {'xPixel': int(a[1]), 'yPixel': int(a[2]), 'bias': float(b[10]), 'current': float(b[11])}
+
+    file = VERT_SPEC._read_head(full_path) if kind == 'vert' else read_meta(full_path)
+    record = {'footprint': _footprint(file, kind),
+              'xPixel': file.xPixel, 'yPixel': file.yPixel, 'channels': file.channels, 'chmode': file.chmode,
+              'bias': file.bias, 'current': file.current, 'rotation': file.rotation,
+              'offset_x': file.offset.x, 'offset_y': file.offset.y,
+              'nom_size_x': file.nom_size.x, 'nom_size_y': file.nom_size.y}
+    try:
+        record['datetime'] = file.timestamp
+    except (ValueError, TypeError):
+        pass  # file name not in the standard format
+    return record
+
+
+def _footprint(file, kind):
+    """
+    Corners of the area covered by a file in scanner coordinates
+
+    Parameters
+    ----------
+    file : GENERIC_FILE
+        The meta data of a .dat file, or of a .vert file with spec_pos_x and spec_pos_y
+    kind : str
+        'dat' or 'vert'
+
+    Returns
+    -------
+    corners : numpy.array
+        In the shape of (4, 2), the nominal scan frame of a .dat file, or 4 times the position of a spectrum,
+        taking spec_pos_x and spec_pos_y as DAC steps from the top left corner of the scan frame
+    """
+    if kind == 'vert':
+        return np.repeat(file.dac_transform(np.array([[file.spec_pos_x, file.spec_pos_y]])), 4, axis=0)
+    width = file.xPixel * file.deltaX_dac
+    height = file.yPixel * float(file.meta.get('delta y', file.deltaX_dac))
+    return file.dac_transform(np.array([[0, 0], [width, 0], [width, height], [0, height]]))
+
+
+def _corners(blob):
+    """
+    Corners of a footprint stored in the R*Tree
+
+    Parameters
+    ----------
+    blob : bytes
+        As stored by Catalog.refresh()
+
+    Returns
+    -------
+    corners : numpy.array
+        In the shape of (4, 2)
+    """
+    return np.frombuffer(blob, dtype=np.float64).reshape(4, 2)
+
+
+def _distances(corners, x, y):
+    """
+    Distances from a point to footprints, 0 inside
+
+    Parameters
+    ----------
+    corners : numpy.array
+        In the shape of (N, 4, 2), convex quadrilaterals, possibly shrunk to a point
+    x : float
+        x of the point
+    y : float
+        y of the point
+
+    Returns
+    -------
+    distances : numpy.array
+        In the shape of (N,)
+    """
+    edges = corners[:, _next_corner] - corners
+    ex, ey = edges[..., 0], edges[..., 1]
+    px, py = x - corners[..., 0], y - corners[..., 1]
+    # inside if the point is on the inner side of all edges, the orientation is 0 for a point or a line
+    orientation = np.sign(ex[:, 0] * ey[:, 1] - ey[:, 0] * ex[:, 1])
+    inside = (orientation != 0) & ((ex * py - ey * px) * orientation[:, None] >= 0).all(axis=1)
+    # distance to the closest point on each edge
+    length2 = ex * ex + ey * ey
+    t = np.clip((px * ex + py * ey) / np.where(length2 > 0, length2, 1), 0, 1)
+    dx, dy = px - t * ex, py - t * ey
+    return np.where(inside, 0, np.sqrt((dx * dx + dy * dy).min(axis=1)))
+
+
+def _intersect_rect(corners, x_range, y_range):
+    """
+    Whether footprints intersect an axis-aligned rectangle, given that their bounding boxes do
+
+    Parameters
+    ----------
+    corners : numpy.array
+        In the shape of (N, 4, 2), convex quadrilaterals, possibly shrunk to a point
+    x_range : tuple
+        (min, max) of x
+    y_range : tuple
+        (min, max) of y
+
+    Returns
+    -------
+    intersect : numpy.array
+        Boolean array in the shape of (N,)
+    """
+    # separating axis test along the edge normals of the footprints, the rectangle axes are covered by the boxes
+    rect = np.array([[x, y] for x in x_range for y in y_range], dtype=np.float64)
+    edges = corners[:, _next_corner] - corners
+    normals = np.stack([-edges[..., 1], edges[..., 0]], axis=-1)  # (N, 4, 2)
+    own = normals @ corners.transpose(0, 2, 1)  # projections of the footprint corners, (N, 4, 4)
+    other = normals @ rect.T
+    separated = (own.max(axis=-1) < other.min(axis=-1)) | (other.max(axis=-1) < own.min(axis=-1))
+    return ~separated.any(axis=1)
+
+
+def _conditions(conditions):
+    """
+    SQL clauses of query conditions
+
+    Parameters
+    ----------
+    conditions : dict
+        column -> value for equality, or column -> (min, max) for a closed range, either bound may be None
+
+    Returns
+    -------
+    (list[str], list)
+        The clauses, to be joined with AND, and their parameters
+    """
+    clauses, params = [], []
+    for col, value in conditions.items():
+        if col not in _columns:
+            raise KeyError(f'Unknown catalog column: {col}')
+        if isinstance(value, (tuple, list)):
+            low, high = value
+            if low is not None:
+                clauses.append(f'{col} >= ?')
+                params.append(low)
+            if high is not None:
+                clauses.append(f'{col} <= ?')
+                params.append(high)
+        else:
+            clauses.append(f'{col} = ?')
+            params.append(value)
+    return clauses, params
+
+
+class Catalog:
+    """
+    Persistent meta data catalog of all .dat, .vert and .specgrid files under a root directory.
+
+    The catalog columns are path (relative to root), kind, mtime, file_size, datetime (timestamp from the
+    file name), bias, current, xPixel, yPixel, channels, chmode, rotation, offset_x, offset_y, nom_size_x and
+    nom_size_y. Fields not available for a file type are NULL.
+
+    The footprints of the .dat files (the nominal scan frame, rotated) and the positions of the .vert spectra
+    are stored in an R*Tree, and held in memory as arrays from the first spatial query, for the vectorized queries
+    covering(), in_rect() and nearest().
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the data
+    db_path : str, optional
+        Path to the SQLite file, by default it is CATALOG_FILE_NAME inside the root directory
+    refresh : bool
+        Whether to refresh the catalog right away
+
+    Examples
+    --------
+    >>> catalog = Catalog('path/to/data')
+    >>> catalog.query(kind='dat', chmode=1, bias=(2, 5), near=(100, -200, 50))
+    >>> catalog.covering(100, -200, radius=5)  # scans containing the point, and spectra within 5 angstrom
+    """
+
+    def __init__(self, root, db_path=None, refresh=True):
+        self.root = root
+        self.db_path = os.path.join(root, CATALOG_FILE_NAME) if db_path is None else db_path
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        columns = ', '.join(f'{k} {v}' for k, v in _columns.items())
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS files ({columns})')
+            for col in _indexed_columns:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_files_{col} ON files ({col})')
+            # corners is the (4, 2) float64 array of the footprint as bytes, see _footprint()
+            self.conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS footprints '
+                              'USING rtree(id, min_x, max_x, min_y, max_y, +path, +corners)')
+        self._geometry = None  # id -> (path, corners) of the footprints, loaded on the first spatial query
+        self._arrays = None  # the footprints as arrays, see _load_arrays()
+        if refresh:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Update the catalog, re-reading only the files which are new or whose mtime or size have changed,
+        and removing the files which no longer exist.
+
+        Returns
+        -------
+        (int, int)
+            Number of files (re-)read and number of files removed
+        """
+        known = {row['path']: (row['mtime'], row['file_size'])
+                 for row in self.conn.execute('SELECT path, mtime, file_size FROM files')}
+        # e.g. a catalog created before the spatial index
+        indexed = {row['path'] for row in self.conn.execute('SELECT path FROM footprints')}
+        records, footprints = [], []
+        for path, kind, stat in _scan(self.root):
+            if known.pop(path, None) == (stat.st_mtime, stat.st_size) and \
+                    (kind not in _footprint_kinds or path in indexed):
+                continue
+            try:
+                record = _file_record(os.path.join(self.root, path), kind)
+            except (OSError, ValueError, KeyError, IndexError):
+                continue  # incomplete or unreadable file, try again at the next refresh
+            record.update(path=path, kind=kind, mtime=stat.st_mtime, file_size=stat.st_size)
+            records.append(tuple(record.get(col) for col in _columns))
+            corners = record.get('footprint')
+            if corners is not None:
+                footprints.append((_footprint_id(path), corners[:, 0].min(), corners[:, 0].max(),
+                                   corners[:, 1].min(), corners[:, 1].max(), path, corners.tobytes()))
+
+        placeholders = ', '.join('?' * len(_columns))
+        removed = [(path,) for path in known]
+        dropped = [_footprint_id(record[0]) for record in records + removed]
+        with self.conn:
+            self.conn.executemany(f'INSERT OR REPLACE INTO files VALUES ({placeholders})', records)
+            self.conn.executemany('DELETE FROM files WHERE path = ?', removed)
+            self.conn.executemany('DELETE FROM footprints WHERE id = ?', [(i,) for i in dropped])
+            self.conn.executemany('INSERT INTO footprints VALUES (?, ?, ?, ?, ?, ?, ?)', footprints)
+        if self._geometry is not None:
+            for i in dropped:
+                self._geometry.pop(i, None)
+            self._geometry.update((i, (path, _corners(corners))) for i, *_, path, corners in footprints)
+        if records or removed:
+            self._arrays = None
+        return len(records), len(known)
+
+    def query(self, near=None, order_by='datetime', **conditions):
+        """
+        Query the catalog.
+
+        Parameters
+        ----------
+        near : (float, float, float), optional
+            (x, y, radius) in angstrom, select files whose offset is within radius of (x, y)
+        order_by : str
+            Column to sort the result
+        conditions :
+            column=value for equality, or column=(min, max) for a closed range, either bound may be None
+
+        Returns
+        -------
+        rows : list[sqlite3.Row]
+            Rows can be accessed like dicts by column names, path is relative to root
+        """
+        clauses, params = _conditions(conditions)
+        if near is not None:
+            x, y, r = near
+            # bounding box first to use the indices, then the exact distance
+            clauses.append('offset_x BETWEEN ? AND ? AND offset_y BETWEEN ? AND ?')
+            params.extend([x - r, x + r, y - r, y + r])
+            clauses.append('(offset_x - ?) * (offset_x - ?) + (offset_y - ?) * (offset_y - ?) <= ?')
+            params.extend([x, x, y, y, r * r])
+        if order_by not in _columns:
+            raise KeyError(f'Unknown catalog column: {order_by}')
+
+        sql = 'SELECT * FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY {order_by}'
+        return self.conn.execute(sql, params).fetchall()
+
+    def _load_geometry(self):
+        """
+        Return the paths and corners of all footprints, read from the R*Tree on the first call
+
+        Returns
+        -------
+        geometry : dict
+            id -> (path, corners), see _footprint_id() and _footprint()
+        """
+        if self._geometry is None:
+            self._geometry = {i: (path, _corners(blob))
+                              for i, path, blob in self.conn.execute('SELECT id, path, corners FROM footprints')}
+        return self._geometry
+
+    def _load_arrays(self):
+        """
+        Return the footprints as arrays for the vectorized spatial queries, built from _load_geometry()
+
+        Returns
+        -------
+        (numpy.array, numpy.array, numpy.array)
+            The paths, the corners in the shape of (N, 4, 2), and the bounding boxes (min_x, max_x, min_y, max_y)
+            in the shape of (4, N), each row contiguous for the comparisons
+        """
+        if self._arrays is None:
+            geometry = self._load_geometry()
+            paths = np.array([path for path, _ in geometry.values()], dtype=object)
+            corners = np.stack([corners for _, corners in geometry.values()]) if geometry else np.empty((0, 4, 2))
+            boxes = np.stack([corners[..., 0].min(axis=1), corners[..., 0].max(axis=1),
+                              corners[..., 1].min(axis=1), corners[..., 1].max(axis=1)])
+            self._arrays = paths, corners, boxes
+        return self._arrays
+
+    def _in_box(self, x_range, y_range):
+        """
+        Footprints whose bounding box intersects a box
+
+        Parameters
+        ----------
+        x_range : tuple
+            (min, max) of x in angstrom
+        y_range : tuple
+            (min, max) of y in angstrom
+
+        Returns
+        -------
+        (list[str], numpy.array)
+            The paths, and the corners of the footprints in the shape of (N, 4, 2)
+        """
+        paths, corners, boxes = self._load_arrays()
+        # a vectorized comparison with all boxes in memory is faster than a query of the R*Tree
+        min_x, max_x, min_y, max_y = boxes
+        idx = np.flatnonzero((max_x >= min(x_range)) & (min_x <= max(x_range)) &
+                             (max_y >= min(y_range)) & (min_y <= max(y_range)))
+        return list(paths[idx]), corners[idx]
+
+    def _rows(self, paths, conditions, columns='*'):
+        """
+        Rows of files matching conditions
+
+        Parameters
+        ----------
+        paths : list[str]
+            Paths relative to root
+        conditions : dict
+            Conditions on the catalog columns, see query()
+        columns : str
+            Columns to select, they must include path
+
+        Returns
+        -------
+        rows : dict
+            path -> sqlite3.Row
+        """
+        clauses, params = _conditions(conditions)
+        rows = {}
+        for start in range(0, len(paths), _max_variables):
+            chunk = paths[start:start + _max_variables]
+            sql = f'SELECT {columns} FROM files WHERE path IN ({", ".join("?" * len(chunk))})'
+            sql += ''.join(' AND ' + clause for clause in clauses)
+            rows.update((row['path'], row) for row in self.conn.execute(sql, list(chunk) + params))
+        return rows
+
+    def covering(self, x, y, radius=0, order_by='datetime', **conditions):
+        """
+        Query the files covering a point in scanner coordinates, e.g. the previous scans and spectra of a location.
+
+        Parameters
+        ----------
+        x : float
+            x in angstrom
+        y : float
+            y in angstrom
+        radius : float
+            Tolerance in angstrom, select the scans within radius of the point and the spectra within radius,
+            a spectrum being a point
+        order_by : str
+            Column to sort the result
+        conditions :
+            column=value for equality, or column=(min, max) for a closed range, see query()
+
+        Returns
+        -------
+        rows : list[sqlite3.Row]
+            Rows as from query()
+        """
+        if order_by not in _columns:
+            raise KeyError(f'Unknown catalog column: {order_by}')
+        paths, corners = self._in_box((x - radius, x + radius), (y - radius, y + radius))
+        if paths:
+            paths = [path for path, distance in zip(paths, _distances(corners, x, y)) if distance <= radius]
+        rows = list(self._rows(paths, conditions).values())
+        return sorted(rows, key=lambda row: (row[order_by] is None, row[order_by]))
+
+    def in_rect(self, x_range, y_range, order_by='datetime', **conditions):
+        """
+        Query the files whose footprint intersects a rectangle in scanner coordinates, e.g. a viewport
+
+        Parameters
+        ----------
+        x_range : tuple
+            (min, max) of x in angstrom
+        y_range : tuple
+            (min, max) of y in angstrom
+        order_by : str
+            Column to sort the result
+        conditions :
+            column=value for equality, or column=(min, max) for a closed range, see query()
+
+        Returns
+        -------
+        rows : list[sqlite3.Row]
+            Rows as from query()
+        """
+        if order_by not in _columns:
+            raise KeyError(f'Unknown catalog column: {order_by}')
+        x_range, y_range = (min(x_range), max(x_range)), (min(y_range), max(y_range))
+        paths, corners = self._in_box(x_range, y_range)
+        if paths:
+            paths = [path for path, keep in zip(paths, _intersect_rect(corners, x_range, y_range)) if keep]
+        rows = list(self._rows(paths, conditions).values())
+        return sorted(rows, key=lambda row: (row[order_by] is None, row[order_by]))
+
+    def nearest(self, x, y, k=1, **conditions):
+        """
+        Query the k files nearest to a point in scanner coordinates, by the distance to their footprints
+
+        The footprints are checked in the order of the distances to their bounding boxes, in batches growing
+        geometrically, until the k-th distance found is within the box distances of the footprints not checked.
+
+        Parameters
+        ----------
+        x : float
+            x in angstrom
+        y : float
+            y in angstrom
+        k : int
+            Number of files
+        conditions :
+            column=value for equality, or column=(min, max) for a closed range, see query()
+
+        Returns
+        -------
+        (list[sqlite3.Row], numpy.array)
+            Up to k rows as from query(), nearest first, and their distances in angstrom, 0 for the scans
+            containing the point
+        """
+        paths, corners, boxes = self._load_arrays()
+        if not len(paths) or k < 1:
+            return [], np.empty(0)
+        if conditions:
+            clauses, params = _conditions(conditions)
+            where = ' AND '.join(clauses)
+            n_matching, = self.conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM files WHERE {where} LIMIT ?)',
+                                            params + [_max_scan + 1]).fetchone()
+            if n_matching <= _max_scan:  # e.g. the spectra, faster than searching among all footprints
+                matching = self.conn.execute(f'SELECT path FROM files WHERE {where}', params).fetchall()
+                geometry = self._load_geometry()
+                found = [geometry[i] for i in (_footprint_id(path) for path, in matching) if i in geometry]
+                paths = [path for path, _ in found]
+                distances = _distances(np.stack([corners for _, corners in found]), x, y) if found else []
+                return self._nearest_rows(sorted(zip(distances, paths))[:k])
+        # lower bounds of the distances, 0 if the point is in the bounding box
+        min_x, max_x, min_y, max_y = boxes
+        dx = np.maximum(min_x - x, x - max_x)
+        dy = np.maximum(min_y - y, y - max_y)
+        lower = np.sqrt(np.maximum(dx, 0, out=dx) ** 2 + np.maximum(dy, 0, out=dy) ** 2)
+        n = max(k, _nearest_batch)
+        while True:
+            if n < len(paths):
+                partition = np.argpartition(lower, n)
+                idx, limit = partition[:n], lower[partition[n]]
+            else:
+                idx, limit = np.arange(len(paths)), np.inf
+            found = sorted(zip(_distances(corners[idx], x, y), paths[idx]))
+            if conditions:
+                matching = self._rows([path for _, path in found], conditions, columns='path')
+                found = [(distance, path) for distance, path in found if path in matching]
+            # the footprints not checked are at least limit away
+            if len(found) >= k and found[k - 1][0] <= limit or limit == np.inf:
+                return self._nearest_rows(found[:k])
+            n *= 4
+
+    def _nearest_rows(self, found):
+        """
+        Rows and distances of the result of nearest()
+
+        Parameters
+        ----------
+        found : list[tuple]
+            (distance, path) of the nearest files
+
+        Returns
+        -------
+        (list[sqlite3.Row], numpy.array)
+        """
+        rows = self._rows([path for _, path in found], {})
+        return [rows[path] for _, path in found], np.array([distance for distance, _ in found])
+
+    def full_path(self, row):
+        """
+        Return the full path of a file in the catalog
+
+        Parameters
+        ----------
+        row : sqlite3.Row
+            A row returned by query()
+
+        Returns
+        -------
+        full_path : str
+        """
+        return os.path.join(self.root, row['path'])
+
+    def close(self):
+        """
+        Close the database connection
+
+        Returns
+        -------
+        None : None
+        """
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Fit a model to every spectrum of a GRID_SPEC, giving parameter maps
+
+Models linear in their parameters are fitted in batched least squares solves. Other models are fitted spectrum by
+spectrum in a process pool, the worker processes reading the spectra from a shared memory block instead of
+receiving pickled copies. The progress can be reported and saved into a checkpoint file, to resume an interrupted
+fit.
+"""
+import os
+
+import numpy as np
+
+
+class LinearModel:
+    """
+    Model linear in its parameters, y = sum_i p_i * f_i(x), fitted to many spectra in one batched solve
+
+    Parameters
+    ----------
+    basis : list[callable]
+        Basis functions f_i of the bias array
+    param_names : list[str], optional
+        Names of the parameters, p0, p1, ... by default
+    """
+
+    def __init__(self, basis, param_names=None):
+        self.basis = list(basis)
+        self.param_names = list(param_names) if param_names is not None else \
+            [f'p{i}' for i in range(len(self.basis))]
+
+    def design_matrix(self, x):
+        """
+        Evaluate the basis functions
+
+        Parameters
+        ----------
+        x : numpy.array
+            The bias array
+
+        Returns
+        -------
+        design_matrix : numpy.array
+            In the shape of (len(x), number of parameters)
+        """
+        return np.stack([np.broadcast_to(f(x), x.shape) for f in self.basis], axis=-1)
+
+    def fit_batch(self, x, spectra):
+        """
+        Least squares fit of a batch of spectra
+
+        Parameters
+        ----------
+        x : numpy.array
+            The bias array
+        spectra : numpy.array
+            In the shape of (n, len(x))
+
+        Returns
+        -------
+        params : numpy.array
+            In the shape of (n, number of parameters)
+        """
+        return spectra @ np.linalg.pinv(self.design_matrix(x)).T
+
+
+class PolynomialModel(LinearModel):
+    """
+    Polynomial y = c0 + c1 * x + ... + c_order * x^order
+
+    Parameters
+    ----------
+    order : int
+        Polynomial order
+    """
+
+    def __init__(self, order=1):
+        super().__init__([lambda x, p=p: x ** p for p in range(order + 1)],
+                         param_names=[f'c{p}' for p in range(order + 1)])
+
+    def design_matrix(self, x):
+        return np.vander(x, len(self.basis), increasing=True)
+
+
+class FunctionModel:
+    """
+    Model fitted spectrum by spectrum by a user function, e.g. a wrapper of scipy.optimize.curve_fit.
+
+    The function must be picklable, i.e. defined at the top level of a module, to be sent to the worker processes.
+    If it raises an exception for a spectrum, the parameters of that spectrum are NaN.
+
+    Parameters
+    ----------
+    func : callable
+        func(x, y) returning the parameters of one spectrum as a sequence
+    param_names : list[str]
+        Names of the parameters, in the order returned by func
+    """
+
+    def __init__(self, func, param_names):
+        self.func = func
+        self.param_names = list(param_names)
+
+    def fit_one(self, x, y):
+        """
+        Fit one spectrum
+
+        Parameters
+        ----------
+        x : numpy.array
+            The bias array
+        y : numpy.array
+            The spectrum
+
+        Returns
+        -------
+        params : numpy.array
+            NaN if the fit failed
+        """
+        try:
+            return np.asarray(self.func(x, y), dtype=np.float64)
+        except Exception:  # a failed fit of one spectrum must not stop the whole grid
+            return np.full(len(self.param_names), np.nan)
+
+
+# shared memory attached by each worker process, see _attach()
+_worker_shared = {}
+
+
+def _attach(name, shape, dtype):
+    """
+    Initializer of the worker processes, attaching the shared memory block holding the spectra
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block
+    shape : tuple
+        (rows, columns, points) of the spectra
+    dtype : numpy.dtype
+        Data type of the spectra
+
+    Returns
+    -------
+    None : None
+    """
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    _worker_shared['shm'] = shm  # keep a reference, otherwise the buffer is released
+    _worker_shared['spectra'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _fit_rows(model, x, start, stop):
+    """
+    Fit the spectra of the grid rows start:stop in a worker process
+
+    Parameters
+    ----------
+    model : FunctionModel
+        The model
+    x : numpy.array
+        The bias array
+    start : int
+        First grid row
+    stop : int
+        Grid row after the last one
+
+    Returns
+    -------
+    params : numpy.array
+        In the shape of (stop - start, columns, number of parameters)
+    """
+    spectra = _worker_shared['spectra'][start:stop]
+    params = np.empty(spectra.shape[:2] + (len(model.param_names),))
+    for index in np.ndindex(*spectra.shape[:2]):
+        params[index] = model.fit_one(x, spectra[index])
+    return params
+
+
+def _load_checkpoint(checkpoint, shape):
+    """
+    Load the parameters and the finished grid rows from a checkpoint file, or start from scratch
+
+    Parameters
+    ----------
+    checkpoint : str or None
+        Checkpoint file path
+    shape : tuple
+        (rows, columns, number of parameters)
+
+    Returns
+    -------
+    (numpy.array, numpy.array)
+        Parameters and a boolean array of the finished grid rows
+    """
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with np.load(checkpoint) as saved:
+            params, done = saved['params'], saved['done']
+        if params.shape != shape:
+            raise ValueError(f'The checkpoint {checkpoint} has parameters in the shape of {params.shape}, '
+                             f'not {shape}')
+        return params, done
+    return np.full(shape, np.nan), np.zeros(shape[0], dtype=bool)
+
+
+def _save_checkpoint(checkpoint, params, done):
+    """
+    Save the parameters and the finished grid rows, replacing the checkpoint file atomically
+
+    Parameters
+    ----------
+    checkpoint : str
+        Checkpoint file path
+    params : numpy.array
+        Parameters
+    done : numpy.array
+        Boolean array of the finished grid rows
+
+    Returns
+    -------
+    None : None
+    """
+    tmp = checkpoint + '.tmp.npz'
+    np.savez(tmp, params=params, done=done)
+    os.replace(tmp, checkpoint)
+
+
+def fit_grid(grid, model, channel=1, workers=None, checkpoint=None, progress=None, chunk_bytes=None):
+    """
+    Fit a model to every spectrum of a GRID_SPEC against the bias in specvz3[:, 0].
+
+    Models with a fit_batch method, e.g. LinearModel and PolynomialModel, are fitted chunk by chunk in batched
+    solves. Other models, e.g. FunctionModel, are fitted in a process pool, with the channel copied once into
+    shared memory.
+
+    Parameters
+    ----------
+    grid : GRID_SPEC
+        The grid spectroscopy file
+    model : LinearModel, PolynomialModel or FunctionModel
+        The model, it must have param_names
+    channel : int
+        Channel index
+    workers : int, optional
+        Number of worker processes for models without fit_batch, the number of CPUs by default
+    checkpoint : str, optional
+        File path (.npz) to save the progress after each chunk. If it exists, the finished grid rows are loaded
+        from it and skipped, to resume an interrupted fit.
+    progress : callable, optional
+        Called with (number of spectra fitted, total number of spectra) after each chunk
+    chunk_bytes : int, optional
+        Bytes of specdata per chunk, see GRID_SPEC._chunks()
+
+    Returns
+    -------
+    maps : dict
+        Parameter name -> map, oriented as GRID_SPEC.energy_slice()
+    """
+    x = grid.specvz3[:, 0].astype(np.float64)
+    n_a, n_b = grid.specdata.shape[:2]
+    params, done = _load_checkpoint(checkpoint, (n_a, n_b, len(model.param_names)))
+    chunks = [chunk for chunk in grid._chunks(chunk_bytes) if not done[chunk].all()]
+
+    def finished(chunk, values):
+        params[chunk] = values
+        done[chunk] = True
+        if checkpoint is not None:
+            _save_checkpoint(checkpoint, params, done)
+        if progress is not None:
+            progress(int(done.sum()) * n_b, n_a * n_b)
+
+    if hasattr(model, 'fit_batch'):
+        for chunk in chunks:
+            spectra = np.asarray(grid.specdata[chunk, :, :, channel], dtype=np.float64)
+            values = model.fit_batch(x, spectra.reshape(-1, spectra.shape[-1]))
+            finished(chunk, values.reshape(spectra.shape[:2] + (-1,)))
+    elif chunks:
+        _fit_in_pool(grid, model, channel, x, chunks, workers, finished)
+
+    return {name: params[..., i].T for i, name in enumerate(model.param_names)}
+
+
+def _fit_in_pool(grid, model, channel, x, chunks, workers, finished):
+    """
+    Fit the chunks in a process pool, reading the spectra from shared memory
+
+    Parameters
+    ----------
+    grid : GRID_SPEC
+        The grid spectroscopy file
+    model : FunctionModel
+        The model
+    channel : int
+        Channel index
+    x : numpy.array
+        The bias array
+    chunks : list[slice]
+        Grid rows to fit
+    workers : int or None
+        Number of worker processes
+    finished : callable
+        Called with (chunk, params) for each finished chunk
+
+    Returns
+    -------
+    None : None
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from multiprocessing import shared_memory
+
+    shape = grid.specdata.shape[:3]
+    dtype = grid.specdata.dtype
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    spectra = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        for chunk in grid._chunks():  # copied chunk by chunk, so that a memmap is not read at once
+            spectra[chunk] = grid.specdata[chunk, :, :, channel]
+        with ProcessPoolExecutor(workers, initializer=_attach, initargs=(shm.name, shape, dtype)) as executor:
+            futures = {executor.submit(_fit_rows, model, x, chunk.start, min(chunk.stop, shape[0])): chunk
+                       for chunk in chunks}
+            try:
+                for future in as_completed(futures):
+                    finished(futures[future], future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        del spectra  # the buffer cannot be closed while exported to an array
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar in-memory table of the meta data of many Createc files
+
+Instead of one dict of about 570 strings per file, the meta data of all files are kept column by column:
+the typed properties as numpy arrays, and the strings as categorical codes into a shared list of unique values.
+"""
+import os
+import sys
+
+import numpy as np
+
+from .Createc_global_const import cgc
+from .Createc_pyFile import FILE_META, _meta_fields
+
+# derived numeric columns -> function of FILE_META
+_derived_columns = {'offset_x': lambda fm: fm.offset.x,
+                    'offset_y': lambda fm: fm.offset.y,
+                    'nom_size_x': lambda fm: fm.nom_size.x,
+                    'nom_size_y': lambda fm: fm.nom_size.y,
+                    'timestamp': lambda fm: fm.timestamp}
+
+
+def _codes_dtype(n_categories):
+    """
+    Smallest signed integer dtype for categorical codes, -1 meaning missing
+
+    Parameters
+    ----------
+    n_categories : int
+        Number of unique values
+
+    Returns
+    -------
+    dtype : numpy.dtype
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _categorical(values):
+    """
+    Encode a list of strings (or None for missing) as categorical codes
+
+    Parameters
+    ----------
+    values : list
+        str or None
+
+    Returns
+    -------
+    (numpy.array, numpy.array)
+        codes and the categories (unique values) as an object array
+    """
+    lookup = {}
+    codes = [-1 if v is None else lookup.setdefault(v, len(lookup)) for v in values]
+    categories = np.empty(len(lookup), dtype=object)
+    categories[:] = list(lookup)
+    return np.array(codes, dtype=_codes_dtype(len(lookup))), categories
+
+
+class MetaTable:
+    """
+    Columnar table of the meta data of many files, one row per file.
+
+    The numeric columns are the typed properties listed in g_file_meta_fields (xPixel, bias, current,
+    rotation, ...), plus offset_x, offset_y, nom_size_x, nom_size_y and timestamp, as numpy arrays.
+    The string columns are path, fn, file_version and channels_code. With all_meta=True every key of the meta
+    dicts is kept too as a string column, so that the full meta dict of a row can be restored.
+    String columns are stored as categorical codes, with the values shared between rows.
+
+    Parameters
+    ----------
+    file_metas : iterable of FILE_META or GENERIC_FILE
+        The meta data of the files
+    paths : iterable of str, optional
+        The file paths, in the same order
+    all_meta : bool
+        Whether to keep all the meta keys, or only the typed and derived columns
+    extra : dict, optional
+        Extra numeric columns, name -> array with one value per file, e.g. the spec positions
+
+    Examples
+    --------
+    >>> table = MetaTable.from_paths(glob.glob('path/to/data/*.dat'))
+    >>> table.filter(chmode=1, bias=(2, 5)).sort('timestamp').to_dataframe()
+    """
+
+    def __init__(self, file_metas=(), paths=None, all_meta=False, extra=None):
+        file_metas = [getattr(fm, '_file_meta', fm) for fm in file_metas]
+        self._numeric = {}
+        self._codes = {}
+        self._categories = {}
+
+        strings = {'path': list(paths) if paths is not None else [None] * len(file_metas),
+                   'fn': [fm.fn for fm in file_metas],
+                   'file_version': [fm.file_version for fm in file_metas]}
+        for name, (_, type_) in _meta_fields.items():
+            if type_ is str:
+                strings[name] = [getattr(fm, name) for fm in file_metas]
+            else:
+                self._numeric[sys.intern(name)] = np.array([getattr(fm, name) for fm in file_metas],
+                                                           dtype=np.float64 if type_ is float else np.int64)
+        for name, func in _derived_columns.items():
+            self._numeric[sys.intern(name)] = np.array([self._try(func, fm) for fm in file_metas],
+                                                       dtype=np.float64)
+        for name, values in (extra or {}).items():
+            self._numeric[sys.intern(name)] = np.asarray(values)
+        if all_meta:
+            keys = dict.fromkeys(k for fm in file_metas for k in fm.meta)
+            for key in keys:
+                strings['meta:' + key] = [fm.meta.get(key) for fm in file_metas]
+        for name, values in strings.items():
+            name = sys.intern(name)
+            self._codes[name], self._categories[name] = _categorical(values)
+
+    @staticmethod
+    def _try(func, file_meta):
+        """
+        Evaluate a derived column, NaN if it cannot be derived, e.g. a file name not in the standard format
+
+        Parameters
+        ----------
+        func : callable
+            Function of FILE_META
+        file_meta : FILE_META
+            The meta data of one file
+
+        Returns
+        -------
+        value : float
+        """
+        try:
+            return func(file_meta)
+        except (ValueError, TypeError, KeyError):
+            return np.nan
+
+    @classmethod
+    def from_paths(cls, paths, all_meta=False):
+        """
+        Build the table by reading only the headers of the files
+
+        Parameters
+        ----------
+        paths : iterable of str
+            File paths of .dat, .vert files etc.
+        all_meta : bool
+            Whether to keep all the meta keys
+
+        Returns
+        -------
+        meta_table : MetaTable
+        """
+        paths = list(paths)
+        file_metas = []
+        for fp in paths:
+            with open(fp, 'rb') as f:
+                file_metas.append(FILE_META.from_binary(f.read(cgc['g_file_data_bin_offset']), os.path.basename(fp)))
+        return cls(file_metas, paths=paths, all_meta=all_meta)
+
+    def __len__(self):
+        return len(self._codes['fn'])
+
+    @property
+    def columns(self):
+        """
+        Return the column names
+
+        Returns
+        -------
+        columns : list[str]
+        """
+        return list(self._numeric) + list(self._codes)
+
+    def column(self, name):
+        """
+        Return one column as a numpy array, string columns are decoded into an object array with None as missing
+
+        Parameters
+        ----------
+        name : str
+            Column name
+
+        Returns
+        -------
+        column : numpy.array
+        """
+        if name in self._numeric:
+            return self._numeric[name]
+        codes = self._codes[name]
+        categories = np.append(self._categories[name], None)  # code -1 -> None
+        return categories[codes]
+
+    def __getitem__(self, index):
+        """
+        Select rows by a boolean mask, an index array or a slice, sharing the categories with this table
+
+        Parameters
+        ----------
+        index : numpy.array or slice
+            Row selection
+
+        Returns
+        -------
+        meta_table : MetaTable
+        """
+        subset = MetaTable.__new__(MetaTable)
+        subset._numeric = {k: v[index] for k, v in self._numeric.items()}
+        subset._codes = {k: v[index] for k, v in self._codes.items()}
+        subset._categories = self._categories
+        return subset
+
+    def mask(self, **conditions):
+        """
+        Vectorized row selection
+
+        Parameters
+        ----------
+        conditions :
+            column=value for equality, or column=(min, max) for a closed range of a numeric column,
+            either bound may be None
+
+        Returns
+        -------
+        mask : numpy.array
+            Boolean array, True for the selected rows
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            if isinstance(value, (tuple, list)):
+                low, high = value
+                col = self._numeric[name]
+                if low is not None:
+                    mask &= col >= low
+                if high is not None:
+                    mask &= col <= high
+            elif name in self._numeric:
+                mask &= self._numeric[name] == value
+            else:
+                matches = np.flatnonzero(self._categories[name] == value)
+                mask &= np.isin(self._codes[name], matches)
+        return mask
+
+    def filter(self, **conditions):
+        """
+        Select the rows matching all conditions, see mask()
+
+        Returns
+        -------
+        meta_table : MetaTable
+        """
+        return self[self.mask(**conditions)]
+
+    def sort(self, by, descending=False):
+        """
+        Sort the rows by one or more numeric columns
+
+        Parameters
+        ----------
+        by : str or list[str]
+            Column name(s), the first being the primary key
+        descending : bool
+            Sort in descending order
+
+        Returns
+        -------
+        meta_table : MetaTable
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        order = np.lexsort([self._numeric[name] for name in reversed(by)])
+        return self[order[::-1] if descending else order]
+
+    def to_dataframe(self, columns=None):
+        """
+        Convert into a pandas DataFrame, string columns become pandas Categorical without copying the values
+
+        Parameters
+        ----------
+        columns : list[str], optional
+            Columns to include, all by default
+
+        Returns
+        -------
+        df : pandas.DataFrame
+        """
+        import pandas as pd
+        columns = self.columns if columns is None else columns
+        data = {}
+        for name in columns:
+            if name in self._numeric:
+                data[name] = self._numeric[name]
+            else:
+                data[name] = pd.Categorical.from_codes(self._codes[name], categories=self._categories[name])
+        return pd.DataFrame(data)
+
+    def row(self, i):
+        """
+        Return one row as a dict of the column values
+
+        Parameters
+        ----------
+        i : int
+            Row index
+
+        Returns
+        -------
+        row : dict
+        """
+        row = {name: col[i].item() for name, col in self._numeric.items()}
+        for name, codes in self._codes.items():
+            code = codes[i]
+            row[name] = None if code < 0 else self._categories[name][code]
+        return row
+
+    def file_meta(self, i):
+        """
+        Restore the FILE_META of one row, only possible if the table was built with all_meta=True
+
+        Parameters
+        ----------
+        i : int
+            Row index
+
+        Returns
+        -------
+        file_meta : FILE_META
+        """
+        meta = {name[len('meta:'):]: value for name, value in self.row(i).items()
+                if name.startswith('meta:') and value is not None}
+        if not meta:
+            raise KeyError('The table was built without all_meta=True')
+        return FILE_META(meta, self.row(i)['fn'])
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Mosaic of many images stitched into one canvas in scanner coordinates
+
+The canvas spans the scanner range and is split into square tiles, only the tiles covered by a scan are
+allocated, and adding a scan only updates the tiles it covers.
+"""
+import math
+
+import numpy as np
+
+from .utils.image_utils import warp_to_canvas
+from .utils.misc import XY2D
+
+SCAN_BOUNDARY = XY2D(x=3000, y=3000)  # scanner range in angstrom, the canvas spans +- this
+
+
+class Mosaic:
+    """
+    Stitch DAT_IMGs into a tiled canvas, placing them by offset, size and rotation.
+
+    Canvas pixel (row, col) is centered at the scanner coordinate
+    (origin.x + (col + 0.5) * pixel_size, origin.y + (row + 0.5) * pixel_size), with origin = -boundary and
+    the y axis pointing down as in the images.
+
+    Parameters
+    ----------
+    pixel_size : float
+        Canvas pixel size in angstrom
+    boundary : XY2D
+        Half of the scanner range in angstrom
+    tile_size : int
+        Tile width and height in pixels
+    channel : int
+        Channel index of the images
+    blend : str
+        'mean' to average overlapping scans, or 'latest' to show the most recent scan on top
+    order : str
+        'nearest' or 'bilinear' interpolation
+    preprocess : callable, optional
+        Applied to each image before placing it, e.g. image_utils.level_correction
+    workers : int, optional
+        Number of threads resampling the images, the default None lets ThreadPoolExecutor decide
+
+    Examples
+    --------
+    >>> mosaic = Mosaic(pixel_size=2, preprocess=level_correction)
+    >>> mosaic.add(load_many(glob.glob('path/to/data/*.dat')))
+    >>> img, corner = mosaic.to_array()
+    """
+
+    def __init__(self, pixel_size=1.0, boundary=SCAN_BOUNDARY, tile_size=512, channel=0, blend='mean',
+                 order='bilinear', preprocess=None, workers=None):
+        if blend not in ('mean', 'latest'):
+            raise ValueError(f'Unknown blend {blend}, use mean or latest')
+        self.pixel_size = pixel_size
+        self.origin = XY2D(x=-boundary.x, y=-boundary.y)
+        self.shape = (math.ceil(2 * boundary.y / pixel_size), math.ceil(2 * boundary.x / pixel_size))
+        self.tile_size = tile_size
+        self.channel = channel
+        self.blend = blend
+        self.order = order
+        self.preprocess = preprocess
+        self.workers = workers
+        self.files = {}  # file name -> (corner, extent) of the placed canvas
+        # tile key (tile row, tile col) -> sum and count of the values for 'mean', value and timestamp for 'latest'
+        self._acc = {}
+        self._dirty = set()
+        self._n_added = 0
+
+    @property
+    def tiles(self):
+        """
+        Return the keys (tile row, tile col) of the allocated tiles
+
+        Returns
+        -------
+        tiles : list[tuple]
+        """
+        return sorted(self._acc)
+
+    def _warp(self, file):
+        """
+        Resample one file onto the canvas grid, run in the threads
+
+        Parameters
+        ----------
+        file : DAT_IMG
+            The file
+
+        Returns
+        -------
+        (numpy.array, XY2D, XY2D)
+            See warp_to_canvas()
+        """
+        img = file.imgs[self.channel]
+        if self.preprocess is not None:
+            img = self.preprocess(img)
+        return warp_to_canvas(file, self.channel, pixel_size=self.pixel_size, order=self.order, img=img,
+                              grid_origin=self.origin)
+
+    def add(self, files):
+        """
+        Place files on the canvas, files already placed (by file name) are skipped
+
+        Parameters
+        ----------
+        files : DAT_IMG or iterable of DAT_IMG
+            The files
+
+        Returns
+        -------
+        tiles : set
+            Keys of the tiles updated
+        """
+        files = [files] if hasattr(files, 'imgs') else list(files)
+        files = [file for file in dict((file.fn, file) for file in files).values() if file.fn not in self.files]
+        updated = set()
+        if self.workers == 1 or len(files) <= 1:
+            warped = map(self._warp, files)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(self.workers)
+            warped = executor.map(self._warp, files)
+        try:
+            for file, (canvas, corner, extent) in zip(files, warped):
+                self.files[file.fn] = (corner, extent)
+                self._n_added += 1
+                try:
+                    timestamp = file.timestamp
+                except (ValueError, TypeError):  # not a standard file name, the order of adding is used
+                    timestamp = self._n_added
+                updated |= self._accumulate(canvas, corner, timestamp)
+        finally:
+            if not (self.workers == 1 or len(files) <= 1):
+                executor.shutdown()
+        self._dirty |= updated
+        return updated
+
+    def _accumulate(self, canvas, corner, timestamp):
+        """
+        Add a warped canvas into the tiles it covers
+
+        Parameters
+        ----------
+        canvas : numpy.array
+            Aligned to the canvas grid, NaN outside the scan
+        corner : XY2D
+            Scanner coordinate of the top left corner of canvas
+        timestamp : float
+            For blend='latest'
+
+        Returns
+        -------
+        tiles : set
+            Keys of the tiles updated
+        """
+        row0 = int(round((corner.y - self.origin.y) / self.pixel_size))
+        col0 = int(round((corner.x - self.origin.x) / self.pixel_size))
+        # clip to the scanner range
+        top, left = max(row0, 0), max(col0, 0)
+        bottom = min(row0 + canvas.shape[0], self.shape[0])
+        right = min(col0 + canvas.shape[1], self.shape[1])
+        ts = self.tile_size
+        updated = set()
+        for tile_row in range(top // ts, (bottom - 1) // ts + 1 if bottom > top else top // ts):
+            for tile_col in range(left // ts, (right - 1) // ts + 1 if right > left else left // ts):
+                r0, r1 = max(top, tile_row * ts), min(bottom, (tile_row + 1) * ts)
+                c0, c1 = max(left, tile_col * ts), min(right, (tile_col + 1) * ts)
+                part = canvas[r0 - row0:r1 - row0, c0 - col0:c1 - col0]
+                valid = ~np.isnan(part)
+                if not valid.any():
+                    continue
+                first, second = self._tile_acc((tile_row, tile_col))
+                window = np.s_[r0 - tile_row * ts:r1 - tile_row * ts, c0 - tile_col * ts:c1 - tile_col * ts]
+                if self.blend == 'mean':
+                    first[window][valid] += part[valid]
+                    second[window][valid] += 1
+                else:
+                    newer = valid & (timestamp >= second[window])
+                    first[window][newer] = part[newer]
+                    second[window][newer] = timestamp
+                updated.add((tile_row, tile_col))
+        return updated
+
+    def _tile_acc(self, key):
+        """
+        Return the accumulators of a tile, allocating them on first use
+
+        Parameters
+        ----------
+        key : tuple
+            (tile row, tile col)
+
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            sum and count for 'mean', value and timestamp for 'latest'
+        """
+        if key not in self._acc:
+            shape = (self.tile_size, self.tile_size)
+            if self.blend == 'mean':
+                self._acc[key] = (np.zeros(shape), np.zeros(shape, dtype=np.uint16))
+            else:
+                self._acc[key] = (np.full(shape, np.nan, dtype=np.float32), np.full(shape, -np.inf))
+        return self._acc[key]
+
+    def tile(self, key):
+        """
+        Return the blended image of a tile, NaN where no scan is placed
+
+        Parameters
+        ----------
+        key : tuple
+            (tile row, tile col)
+
+        Returns
+        -------
+        tile : numpy.array
+            In the shape of (tile_size, tile_size), the tile of an edge may extend beyond the scanner range
+        """
+        if key not in self._acc:
+            return np.full((self.tile_size, self.tile_size), np.nan, dtype=np.float32)
+        first, second = self._acc[key]
+        if self.blend == 'latest':
+            return first.copy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (first / second).astype(np.float32)
+
+    def pop_dirty(self):
+        """
+        Return the keys of the tiles updated since the last call, e.g. to refresh only those in a viewer
+
+        Returns
+        -------
+        tiles : set
+        """
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def to_array(self, x_range=None, y_range=None):
+        """
+        Assemble the canvas, or a part of it, from the tiles
+
+        Parameters
+        ----------
+        x_range : tuple, optional
+            (min, max) scanner x in angstrom, the allocated tiles by default
+        y_range : tuple, optional
+            (min, max) scanner y in angstrom, the allocated tiles by default
+
+        Returns
+        -------
+        (numpy.array, XY2D)
+            The image, NaN where no scan is placed, and the scanner coordinate of its top left corner
+        """
+        ts = self.tile_size
+        tiles = self.tiles
+        if x_range is None:
+            cols = (min(c for _, c in tiles) * ts, (max(c for _, c in tiles) + 1) * ts) if tiles else (0, 0)
+        else:
+            cols = tuple(int(math.floor((x - self.origin.x) / self.pixel_size)) for x in x_range)
+        if y_range is None:
+            rows = (min(r for r, _ in tiles) * ts, (max(r for r, _ in tiles) + 1) * ts) if tiles else (0, 0)
+        else:
+            rows = tuple(int(math.floor((y - self.origin.y) / self.pixel_size)) for y in y_range)
+        result = np.full((rows[1] - rows[0], cols[1] - cols[0]), np.nan, dtype=np.float32)
+        for tile_row, tile_col in tiles:
+            r0, r1 = max(rows[0], tile_row * ts), min(rows[1], (tile_row + 1) * ts)
+            c0, c1 = max(cols[0], tile_col * ts), min(cols[1], (tile_col + 1) * ts)
+            if r0 < r1 and c0 < c1:
+                tile = self.tile((tile_row, tile_col))
+                result[r0 - rows[0]:r1 - rows[0], c0 - cols[0]:c1 - cols[0]] = \
+                    tile[r0 - tile_row * ts:r1 - tile_row * ts, c0 - tile_col * ts:c1 - tile_col * ts]
+        corner = XY2D(x=self.origin.x + cols[0] * self.pixel_size, y=self.origin.y + rows[0] * self.pixel_size)
+        return result, corner
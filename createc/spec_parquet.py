@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Export of spectra of VERT_SPEC and GRID_SPEC into a columnar Parquet dataset, and the selective reader
+
+One row per spectrum, with the meta columns fn, spec_pos_x, spec_pos_y, bias, current and timestamp, and one list
+column per channel holding the whole spectrum. The rows are written in row groups whose min/max statistics let
+the reader skip the row groups not matching the filters on the meta columns.
+
+pyarrow is an optional dependency, imported only when these functions are called.
+"""
+import numpy as np
+
+from .Createc_pyFile import GRID_SPEC, SPEC_STACK, _datetime_from_name
+
+META_COLUMNS = ['fn', 'spec_pos_x', 'spec_pos_y', 'bias', 'current', 'timestamp']
+
+
+def _import_pyarrow():
+    """
+    Import pyarrow and pyarrow.parquet, with a helpful message if not installed
+
+    Returns
+    -------
+    (module, module)
+        pyarrow and pyarrow.parquet
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('pyarrow is needed for the Parquet export, e.g. pip install pyarrow') from e
+    return pa, pq
+
+
+def _timestamp(file_name):
+    """
+    Timestamp from the file name, NaN if the name is not in the Createc convention
+
+    Parameters
+    ----------
+    file_name : str
+        The file name
+
+    Returns
+    -------
+    timestamp : float
+    """
+    try:
+        return _datetime_from_name(file_name).timestamp()
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def _batches(spec, grid_rows):
+    """
+    Split a spectroscopy file into batches of spectra
+
+    Parameters
+    ----------
+    spec : VERT_SPEC or GRID_SPEC
+        The file
+    grid_rows : int
+        Approximate number of spectra per batch of a GRID_SPEC
+
+    Yields
+    ------
+    (dict, dict)
+        meta column -> 1d array, and channel -> 2d array in the shape of (spectra, points)
+    """
+    if isinstance(spec, GRID_SPEC):
+        n_a, n_b, _, n_ch = spec.specdata.shape
+        step = max(1, grid_rows // n_b)
+        bias = spec.specvz3[:, 0]
+        for start in range(0, n_a, step):
+            block = np.asarray(spec.specdata[start:start + step])  # only this part is read from a memmap
+            n = block.shape[0] * n_b
+            ix, iy = np.meshgrid(np.arange(start, start + block.shape[0]), np.arange(n_b), indexing='ij')
+            meta = {'fn': np.full(n, spec.fn, dtype=object),
+                    'spec_pos_x': ix.ravel().astype(np.float64),
+                    'spec_pos_y': iy.ravel().astype(np.float64),
+                    'bias': np.full(n, spec.biasvoltage, dtype=np.float64),
+                    'current': np.full(n, spec.tunnelcurrent, dtype=np.float64),
+                    'timestamp': np.full(n, _timestamp(spec.fn))}
+            channels = {'V': np.broadcast_to(bias, (n, len(bias)))}
+            channels.update({f'ch{i}': block[..., i].reshape(n, -1) for i in range(n_ch)})
+            yield meta, channels
+    else:
+        meta = {'fn': np.array([spec.fn], dtype=object),
+                'spec_pos_x': np.array([spec.spec_pos_x], dtype=np.float64),
+                'spec_pos_y': np.array([spec.spec_pos_y], dtype=np.float64),
+                'bias': np.array([spec.bias], dtype=np.float64),
+                'current': np.array([spec.current], dtype=np.float64),
+                'timestamp': np.array([_timestamp(spec.fn)])}
+        yield meta, {name: spec.spec[name].to_numpy()[None, :] for name in spec.spec.columns}
+
+
+def _to_table(pa, batches):
+    """
+    Concatenate batches into an arrow table
+
+    Parameters
+    ----------
+    pa : module
+        pyarrow
+    batches : list
+        (meta, channels) as from _batches(), all with the same channels
+
+    Returns
+    -------
+    table : pyarrow.Table
+    """
+    columns = {}
+    for name in META_COLUMNS:
+        values = np.concatenate([meta[name] for meta, _ in batches])
+        columns[name] = pa.array(values, type=pa.string() if name == 'fn' else pa.float64())
+    names = list(batches[0][1])
+    for _, channels in batches[1:]:
+        if list(channels) != names:
+            raise ValueError(f'The channels {list(channels)} do not match those of the other spectra {names}')
+    for name in names:
+        arrs = [channels[name] for _, channels in batches]
+        lengths = np.concatenate([np.full(len(arr), arr.shape[1]) for arr in arrs])
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+        # always float64, so that the schema does not depend on the dtypes inferred for a row group
+        values = np.concatenate([np.ravel(arr) for arr in arrs]).astype(np.float64, copy=False)
+        columns[name] = pa.ListArray.from_arrays(pa.array(offsets), pa.array(values))
+    return pa.table(columns)
+
+
+def to_parquet(specs, path, row_group_size=4096, grid_rows=None, compression='zstd'):
+    """
+    Write the spectra of VERT_SPEC and/or GRID_SPEC objects into a Parquet file, one row per spectrum.
+
+    The spectra of all objects must have the same channels: the spec_headers without the index for VERT_SPEC,
+    or V (the bias of specvz3) and ch0, ch1, ... for GRID_SPEC. For GRID_SPEC, spec_pos_x and spec_pos_y are
+    the grid indices, and the cube is read in blocks, so a memory-mapped GRID_SPEC is exported out of core.
+
+    Parameters
+    ----------
+    specs : iterable of VERT_SPEC or GRID_SPEC
+        The spectroscopy files, e.g. a generator to avoid holding all of them in memory
+    path : str
+        Output file path
+    row_group_size : int
+        Number of spectra per row group, smaller row groups make the filters more selective
+    grid_rows : int, optional
+        Number of spectra read at a time from a GRID_SPEC, row_group_size by default
+    compression : str
+        Parquet compression codec
+
+    Returns
+    -------
+    n_rows : int
+        Number of spectra written
+    """
+    pa, pq = _import_pyarrow()
+    grid_rows = row_group_size if grid_rows is None else grid_rows
+    writer = None
+    pending, n_pending, n_rows = [], 0, 0
+
+    def flush():
+        nonlocal writer
+        table = _to_table(pa, pending)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema, compression=compression)
+        elif table.schema != writer.schema:
+            raise ValueError(f'The channels {table.column_names[len(META_COLUMNS):]} do not match those already '
+                             f'written {writer.schema.names[len(META_COLUMNS):]}')
+        writer.write_table(table, row_group_size=row_group_size)
+        pending.clear()
+
+    try:
+        for spec in specs:
+            for meta, channels in _batches(spec, grid_rows):
+                pending.append((meta, channels))
+                n_pending += len(meta['fn'])
+                n_rows += len(meta['fn'])
+                if n_pending >= row_group_size:
+                    flush()
+                    n_pending = 0
+        if pending:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def read_parquet(path, channels=None, filters=None):
+    """
+    Read spectra from a Parquet file or a directory of them, as written by to_parquet().
+
+    Only the requested channels are read, and the row groups not matching the filters are skipped.
+
+    Parameters
+    ----------
+    path : str
+        Parquet file or directory
+    channels : list[str], optional
+        Channels to read, all by default
+    filters : list, optional
+        pyarrow filters on the meta columns, e.g. [('bias', '>', 100), ('fn', '=', 'A201222.074849.VERT')]
+
+    Returns
+    -------
+    spec_stack : SPEC_STACK
+        namedtuple (data, headers, table), where data is an array in the shape of (spectra, points, channels),
+        headers are the channel names and table is a pandas.DataFrame of the meta columns, one row per spectrum
+    """
+    _, pq = _import_pyarrow()
+    dataset = pq.ParquetDataset(path, filters=filters)
+    if channels is None:
+        channels = [name for name in dataset.schema.names if name not in META_COLUMNS]
+    table = dataset.read(columns=META_COLUMNS + list(channels))
+
+    arrays = []
+    for name in channels:
+        column = table.column(name).combine_chunks()
+        lengths = np.diff(column.offsets.to_numpy())
+        if len(lengths) and np.any(lengths != lengths[0]):
+            raise ValueError('The spectra have different numbers of points, select them with filters')
+        arrays.append(column.flatten().to_numpy().reshape(len(column), -1))
+    data = np.stack(arrays, axis=-1) if arrays else np.empty((table.num_rows, 0, 0))
+    return SPEC_STACK(data=data, headers=list(channels), table=table.select(META_COLUMNS).to_pandas())
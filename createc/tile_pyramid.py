@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution tile pyramid of a Mosaic, cached on disk
+
+Level 0 are the tiles of the Mosaic at full resolution. Each tile of level k covers 2 x 2 tiles of level k - 1,
+downsampled by averaging 2 x 2 pixels, up to the level where the whole canvas fits into one tile. A viewer then
+requests only the tiles of the level matching its zoom and covering its viewport, so the data sent depends on the
+screen size, not on the number of scans.
+"""
+import io
+import math
+import os
+import warnings
+
+import numpy as np
+
+from .utils.misc import XY2D
+
+
+class TilePyramid:
+    """
+    Tiles of a Mosaic at decreasing resolutions, computed on demand and cached as .npy files
+
+    Parameters
+    ----------
+    mosaic : Mosaic
+        The mosaic, see createc.mosaic
+    cache_dir : str
+        Directory of the cached tiles, created if not existing. Tiles cached by a previous pyramid are removed,
+        as they may not match the mosaic.
+
+    Examples
+    --------
+    >>> pyramid = TilePyramid(mosaic, 'path/to/cache')
+    >>> mosaic.add(file)
+    >>> pyramid.update()  # drop the cached tiles covering the new scan
+    >>> for key in pyramid.visible_tiles((-500, 500), (-500, 500), 800):
+    ...     tile = pyramid.tile(*key)
+    """
+
+    def __init__(self, mosaic, cache_dir):
+        self.mosaic = mosaic
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        ts = mosaic.tile_size
+        self.grid_shape = (math.ceil(mosaic.shape[0] / ts), math.ceil(mosaic.shape[1] / ts))  # tiles of level 0
+        self.max_level = max(0, math.ceil(math.log2(max(self.grid_shape))))
+        self._versions = {}  # (level, row, col) -> number of invalidations, e.g. to bust browser caches
+        self._existing = None  # level -> set of (row, col) having data, see _exists()
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all cached tiles
+
+        Returns
+        -------
+        None : None
+        """
+        for level in range(self.max_level + 1):
+            level_dir = os.path.join(self.cache_dir, str(level))
+            if os.path.isdir(level_dir):
+                for fn in os.listdir(level_dir):
+                    os.remove(os.path.join(level_dir, fn))
+        self._existing = None
+
+    def update(self):
+        """
+        Invalidate the cached tiles covering the tiles updated in the mosaic since the last call
+
+        Returns
+        -------
+        tiles : set
+            Keys (level, row, col) of the invalidated tiles
+        """
+        return self.invalidate(self.mosaic.pop_dirty())
+
+    def invalidate(self, mosaic_tiles):
+        """
+        Invalidate the cached tiles of all levels covering some tiles of the mosaic
+
+        Parameters
+        ----------
+        mosaic_tiles : iterable of tuple
+            Keys (row, col) of the mosaic tiles, i.e. of level 0
+
+        Returns
+        -------
+        tiles : set
+            Keys (level, row, col) of the invalidated tiles
+        """
+        invalidated = {(level, row >> level, col >> level)
+                       for row, col in mosaic_tiles for level in range(self.max_level + 1)}
+        for key in invalidated:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            path = self._path(*key)
+            if os.path.exists(path):
+                os.remove(path)
+        if invalidated:
+            self._existing = None
+        return invalidated
+
+    def version(self, level, row, col):
+        """
+        Return the number of times a tile was invalidated
+
+        Returns
+        -------
+        version : int
+        """
+        return self._versions.get((level, row, col), 0)
+
+    def _path(self, level, row, col):
+        """
+        File path of a cached tile
+
+        Returns
+        -------
+        path : str
+        """
+        return os.path.join(self.cache_dir, str(level), f'{row}_{col}.npy')
+
+    def _exists(self, level, row, col):
+        """
+        Whether a tile covers any scan
+
+        Returns
+        -------
+        exists : bool
+        """
+        if self._existing is None:
+            tiles = self.mosaic.tiles
+            self._existing = {level: {(r >> level, c >> level) for r, c in tiles}
+                              for level in range(self.max_level + 1)}
+        return (row, col) in self._existing.get(level, ())
+
+    def tile(self, level, row, col):
+        """
+        Return a tile, from the disk cache if available
+
+        Parameters
+        ----------
+        level : int
+            0 for the full resolution, up to max_level
+        row : int
+            Tile row
+        col : int
+            Tile column
+
+        Returns
+        -------
+        tile : numpy.array or None
+            float32 array in the shape of (tile_size, tile_size), NaN where no scan is placed,
+            None if the tile does not cover any scan
+        """
+        if not self._exists(level, row, col):
+            return None
+        path = self._path(level, row, col)
+        try:
+            return np.load(path)
+        except FileNotFoundError:  # not cached yet, or removed by invalidate() meanwhile
+            pass
+        if level == 0:
+            tile = self.mosaic.tile((row, col))
+        else:
+            ts = self.mosaic.tile_size
+            children = np.full((2 * ts, 2 * ts), np.nan, dtype=np.float32)
+            for i in range(2):
+                for j in range(2):
+                    child = self.tile(level - 1, 2 * row + i, 2 * col + j)
+                    if child is not None:
+                        children[i * ts:(i + 1) * ts, j * ts:(j + 1) * ts] = child
+            with warnings.catch_warnings():  # all-NaN blocks outside the scans stay NaN
+                warnings.simplefilter('ignore', RuntimeWarning)
+                tile = np.nanmean(children.reshape(ts, 2, ts, 2), axis=(1, 3)).astype(np.float32)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npy'
+        np.save(tmp, tile)
+        os.replace(tmp, path)
+        return tile
+
+    def tile_extent(self, level, row, col):
+        """
+        Return the scanner coordinates covered by a tile
+
+        Returns
+        -------
+        (XY2D, float)
+            Scanner coordinate of the top left corner, and the width (= height) in angstrom
+        """
+        size = self.mosaic.tile_size * 2 ** level * self.mosaic.pixel_size
+        return XY2D(x=self.mosaic.origin.x + col * size, y=self.mosaic.origin.y + row * size), size
+
+    def level_for(self, x_range, width_px):
+        """
+        Return the level whose resolution matches a viewport
+
+        Parameters
+        ----------
+        x_range : tuple
+            (min, max) scanner x of the viewport in angstrom
+        width_px : int
+            Width of the viewport in screen pixels
+
+        Returns
+        -------
+        level : int
+        """
+        mosaic_px = abs(x_range[1] - x_range[0]) / self.mosaic.pixel_size
+        level = math.ceil(math.log2(max(mosaic_px / max(width_px, 1), 1)))
+        return min(level, self.max_level)
+
+    def visible_tiles(self, x_range, y_range, width_px):
+        """
+        Return the tiles covering a viewport, at the level matching its resolution
+
+        Parameters
+        ----------
+        x_range : tuple
+            (min, max) scanner x of the viewport in angstrom
+        y_range : tuple
+            (min, max) scanner y of the viewport in angstrom
+        width_px : int
+            Width of the viewport in screen pixels
+
+        Returns
+        -------
+        tiles : list[tuple]
+            Keys (level, row, col) of the tiles covering any scan
+        """
+        level = self.level_for(x_range, width_px)
+        _, size = self.tile_extent(level, 0, 0)
+        origin = self.mosaic.origin
+        cols = range(max(0, math.floor((min(x_range) - origin.x) / size)),
+                     math.floor((max(x_range) - origin.x) / size) + 1)
+        rows = range(max(0, math.floor((min(y_range) - origin.y) / size)),
+                     math.floor((max(y_range) - origin.y) / size) + 1)
+        return [(level, row, col) for row in rows for col in cols if self._exists(level, row, col)]
+
+    def value_range(self, percentiles=(1, 99)):
+        """
+        Return a robust range of the values, from the coarsest level, e.g. for a common contrast of all tiles
+
+        Parameters
+        ----------
+        percentiles : tuple
+            Lower and upper percentiles
+
+        Returns
+        -------
+        (float, float)
+            (nan, nan) if the mosaic is empty
+        """
+        level = self.max_level
+        tiles = [self.tile(level, row, col) for row, col in self._exists_keys(level)]
+        values = np.concatenate([tile[~np.isnan(tile)] for tile in tiles]) if tiles else np.empty(0)
+        if not len(values):
+            return np.nan, np.nan
+        low, high = np.percentile(values, percentiles)
+        return float(low), float(high)
+
+    def _exists_keys(self, level):
+        """
+        Keys (row, col) of the tiles of a level covering any scan
+
+        Returns
+        -------
+        keys : set
+        """
+        self._exists(level, 0, 0)
+        return self._existing.get(level, set())
+
+    def to_png(self, level, row, col, vmin=None, vmax=None, cmap='gray'):
+        """
+        Encode a tile as a PNG image, transparent where no scan is placed. matplotlib is needed.
+
+        Parameters
+        ----------
+        level : int
+            Tile level
+        row : int
+            Tile row
+        col : int
+            Tile column
+        vmin : float, optional
+            Value shown as the lowest color, see value_range() for a common contrast of all tiles
+        vmax : float, optional
+            Value shown as the highest color
+        cmap : str
+            matplotlib colormap
+
+        Returns
+        -------
+        png : bytes or None
+            None if the tile does not cover any scan
+        """
+        import matplotlib.image
+        tile = self.tile(level, row, col)
+        if tile is None:
+            return None
+        buffer = io.BytesIO()
+        matplotlib.image.imsave(buffer, np.ma.masked_invalid(tile), vmin=vmin, vmax=vmax, cmap=cmap,
+                                format='png')
+        return buffer.getvalue()
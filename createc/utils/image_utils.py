@@ -1,29 +1,506 @@
 # -*- coding: utf-8 -*-
 #
+from collections import OrderedDict, namedtuple
+from functools import lru_cache, wraps
+import threading
+import warnings
 
+import numpy as np
 
-def level_correction(img):
+from .misc import XY2D, point_rot2D_y_inv
+
+
+@lru_cache(maxsize=32)
+def _plane_fit_weights(m, n):
+    """
+    Precompute the closed-form solution of the plane-fit normal equations for images of shape (m, n).
+
+    With the pixel coordinates centered, the columns of the design matrix [1, row, col] are orthogonal,
+    so the slopes are weighted sums of the row and column sums of the image.
+
+    Parameters
+    ----------
+    m : int
+        Number of rows
+    n : int
+        Number of columns
+
+    Returns
+    -------
+    (numpy.array, numpy.array, numpy.array, numpy.array)
+        Centered row and column coordinates, and the weights giving the row and column slopes
+    """
+    rows = np.arange(m) - (m - 1) / 2
+    cols = np.arange(n) - (n - 1) / 2
+    row_weights = rows / (n * np.sum(rows ** 2))
+    col_weights = cols / (m * np.sum(cols ** 2))
+    for arr in (rows, cols, row_weights, col_weights):
+        arr.flags.writeable = False
+    return rows, cols, row_weights, col_weights
+
+
+def level_correction(img, inplace=False):
     """
     Do level correction for an input image img in the format of numpy 2d array
     returns the result image in numpy 2d array
 
+    A stack of images in the shape of (N, m, n) is corrected image by image in one batched operation.
+
+    Parameters
+    ----------
+    img : numpy.array
+        An image in 2d numpy.array, or a stack of images in 3d numpy.array
+    inplace : bool
+        If True, subtract the planes from img itself, which must then be a float array
+    Returns
+    -------
+    result : numpy.array
+        Level corrected image in 2d numpy.array, or a stack of them in 3d numpy.array
+    """
+    m, n = img.shape[-2:]
+    assert m >= 2 and n >= 2
+    rows, cols, row_weights, col_weights = _plane_fit_weights(m, n)
+    mean = img.mean(axis=(-2, -1), dtype=np.float64)[..., None, None]
+    row_slope = (img.sum(axis=-1, dtype=np.float64) @ row_weights)[..., None, None]
+    col_slope = (img.sum(axis=-2, dtype=np.float64) @ col_weights)[..., None, None]
+
+    result = img if inplace else img - mean
+    if inplace:
+        result -= mean.astype(result.dtype)
+    result -= (row_slope * rows[:, None]).astype(result.dtype)
+    result -= (col_slope * cols).astype(result.dtype)
+    return result
+
+
+def _read_only(*arrs):
+    """
+    Make cached arrays read-only, so that they cannot be modified by accident
+
+    Parameters
+    ----------
+    arrs : numpy.array
+        Arrays to be cached
+
+    Returns
+    -------
+    arrs : tuple
+    """
+    for arr in arrs:
+        arr.flags.writeable = False
+    return arrs
+
+
+_CacheInfo = namedtuple('_CacheInfo', ['hits', 'misses', 'max_bytes', 'currsize', 'nbytes'])
+
+
+def _lru_cache_bytes(max_bytes):
+    """
+    LRU cache decorator like functools.lru_cache, but bounded by the total nbytes of the cached arrays instead of
+    the number of entries, for functions returning a tuple of numpy arrays. Results larger than max_bytes are not
+    cached.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total nbytes of the cached arrays
+
+    Returns
+    -------
+    decorator : callable
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        stats = {'hits': 0, 'misses': 0, 'nbytes': 0}
+
+        @wraps(func)
+        def wrapper(*args):
+            with lock:
+                result = cache.get(args)
+                if result is not None:
+                    cache.move_to_end(args)
+                    stats['hits'] += 1
+                    return result
+                stats['misses'] += 1
+            result = func(*args)
+            nbytes = sum(arr.nbytes for arr in result)
+            with lock:
+                if args not in cache and nbytes <= max_bytes:
+                    cache[args] = result
+                    stats['nbytes'] += nbytes
+                    while stats['nbytes'] > max_bytes:
+                        _, old = cache.popitem(last=False)
+                        stats['nbytes'] -= sum(arr.nbytes for arr in old)
+            return result
+
+        def cache_info():
+            with lock:
+                return _CacheInfo(stats['hits'], stats['misses'], max_bytes, len(cache), stats['nbytes'])
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats.update(hits=0, misses=0, nbytes=0)
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
+
+
+@lru_cache(maxsize=32)
+def _line_basis(n, order):
+    """
+    Vandermonde basis for fitting polynomials along rows of length n, with the coordinates scaled to [-1, 1]
+
+    Parameters
+    ----------
+    n : int
+        Number of columns
+    order : int
+        Polynomial order
+
+    Returns
+    -------
+    (numpy.array, numpy.array)
+        The basis in the shape of (n, order + 1) and its pseudo-inverse
+    """
+    basis = np.vander(np.linspace(-1, 1, n), order + 1, increasing=True)
+    return _read_only(basis, np.linalg.pinv(basis))
+
+
+@lru_cache(maxsize=4)  # the bases are as large as the images
+def _poly2d_basis(m, n, order):
+    """
+    Vandermonde basis for fitting 2d polynomials to (m, n) images, with the coordinates scaled to [-1, 1].
+    The terms are row^p * col^q with p + q <= order.
+
+    Parameters
+    ----------
+    m : int
+        Number of rows
+    n : int
+        Number of columns
+    order : int
+        Polynomial order
+
+    Returns
+    -------
+    (numpy.array, numpy.array)
+        The basis in the shape of (m * n, number of terms) and its pseudo-inverse
+    """
+    rows, cols = np.meshgrid(np.linspace(-1, 1, m), np.linspace(-1, 1, n), indexing='ij')
+    basis = np.stack([rows.ravel() ** p * cols.ravel() ** q
+                      for p in range(order + 1) for q in range(order + 1 - p)], axis=-1)
+    return _read_only(basis, np.linalg.pinv(basis))
+
+
+def _fit_background(data, basis, basis_pinv, mask=None):
+    """
+    Least squares fit of all data[..., :] vectors to a basis in one batched solve
+
+    Parameters
+    ----------
+    data : numpy.array
+        Data in the shape of (..., s)
+    basis : numpy.array
+        Basis in the shape of (s, k)
+    basis_pinv : numpy.array
+        Pseudo-inverse of the basis in the shape of (k, s)
+    mask : numpy.array, optional
+        Boolean array broadcastable to data, only the True elements are used for the fit
+
+    Returns
+    -------
+    background : numpy.array
+        Fitted background in the same shape as data
+    """
+    if mask is None:
+        coef = data @ basis_pinv.T
+    else:
+        weights = np.broadcast_to(mask, data.shape).astype(np.float64)
+        gram = np.einsum('...s,sk,sl->...kl', weights, basis, basis, optimize=True)
+        rhs = np.einsum('...s,sk->...k', weights * data, basis, optimize=True)
+        coef = (np.linalg.pinv(gram) @ rhs[..., None])[..., 0]
+    return coef @ basis.T
+
+
+def _subtract(img, background, inplace):
+    """
+    Subtract the background from the image, either in place or into a new float array
+
+    Parameters
+    ----------
+    img : numpy.array
+        Image or stack of images
+    background : numpy.array
+        Background broadcastable to img
+    inplace : bool
+        Whether to modify img itself
+
+    Returns
+    -------
+    result : numpy.array
+    """
+    if inplace:
+        img -= background.astype(img.dtype)
+        return img
+    return img - background
+
+
+def line_correction(img, order=0, mask=None, inplace=False):
+    """
+    Line-by-line flattening, subtracting a polynomial fitted to each row (scan line) of the image.
+    order=0 removes a per-row offset, order=1 a per-row offset and slope.
+
+    All rows of an image, or of a stack of images in the shape of (N, m, n), are fitted in one batched solve.
+
+    Parameters
+    ----------
+    img : numpy.array
+        An image in 2d numpy.array, or a stack of images in 3d numpy.array
+    order : int
+        Polynomial order of the fit along the rows
+    mask : numpy.array, optional
+        Boolean array broadcastable to img, only the True pixels are used for the fit, e.g. to exclude
+        adsorbates. The background is subtracted from all pixels.
+    inplace : bool
+        If True, subtract the background from img itself, which must then be a float array
+    Returns
+    -------
+    result : numpy.array
+        Flattened image(s)
+    """
+    basis, basis_pinv = _line_basis(img.shape[-1], order)
+    return _subtract(img, _fit_background(img, basis, basis_pinv, mask), inplace)
+
+
+def median_diff_correction(img, mask=None, inplace=False):
+    """
+    Line-by-line flattening by the median of differences, i.e. each row is shifted by the median difference
+    to the previous row. It is robust against steps and adsorbates. The first row is kept as the reference.
+
     Parameters
     ----------
     img : numpy.array
-        An image in 2d numpy.array
+        An image in 2d numpy.array, or a stack of images in 3d numpy.array
+    mask : numpy.array, optional
+        Boolean array broadcastable to img, only the True pixels are used to compute the differences.
+        A row without any pair of True pixels with its previous row is not shifted relative to it.
+    inplace : bool
+        If True, subtract the background from img itself, which must then be a float array
     Returns
     -------
     result : numpy.array
-        Level corrected image in 2d numpy.array
+        Flattened image(s)
+    """
+    diffs = np.diff(img, axis=-2).astype(np.float64)
+    if mask is None:
+        offsets = np.median(diffs, axis=-1)
+    else:
+        mask = np.broadcast_to(mask, img.shape)
+        diffs[~(mask[..., 1:, :] & mask[..., :-1, :])] = np.nan
+        with warnings.catch_warnings():  # all-NaN slices of the fully masked rows
+            warnings.simplefilter('ignore', RuntimeWarning)
+            offsets = np.nanmedian(diffs, axis=-1)
+        offsets[np.isnan(offsets)] = 0  # a NaN would spread to all the following rows by the cumsum
+    offsets = np.concatenate([np.zeros(offsets.shape[:-1] + (1,)), np.cumsum(offsets, axis=-1)], axis=-1)
+    return _subtract(img, offsets[..., None], inplace)
+
+
+def poly_correction(img, order=2, mask=None, inplace=False):
     """
-    import numpy as np
+    Subtract a 2d polynomial background of a given order, order=1 being the same as level_correction.
+
+    A stack of images in the shape of (N, m, n) is fitted in one batched solve, and the Vandermonde basis is
+    cached per image shape and order.
 
+    Parameters
+    ----------
+    img : numpy.array
+        An image in 2d numpy.array, or a stack of images in 3d numpy.array
+    order : int
+        Polynomial order
+    mask : numpy.array, optional
+        Boolean array broadcastable to img, only the True pixels are used for the fit
+    inplace : bool
+        If True, subtract the background from img itself, which must then be a float array
+    Returns
+    -------
+    result : numpy.array
+        Corrected image(s)
+    """
+    m, n = img.shape[-2:]
+    basis, basis_pinv = _poly2d_basis(m, n, order)
+    data = np.reshape(img, img.shape[:-2] + (m * n,))
+    if mask is not None:
+        mask = np.reshape(np.broadcast_to(mask, img.shape), data.shape)
+    background = _fit_background(data, basis, basis_pinv, mask)
+    return _subtract(img, np.reshape(background, img.shape), inplace)
+
+
+def _affine_index_map(src_shape, out_shape, matrix, order):
+    """
+    Precompute the source pixels and weights of an affine resampling
+
+    Parameters
+    ----------
+    src_shape : tuple
+        (rows, columns) of the source image
+    out_shape : tuple
+        (rows, columns) of the output image
+    matrix : tuple
+        6 floats (a, b, c, d, e, f), the output pixel (R, C) is taken from the source pixel
+        (a * R + b * C + c, d * R + e * C + f)
+    order : str
+        'nearest' or 'bilinear'
+
+    Returns
+    -------
+    (numpy.array, numpy.array, numpy.array)
+        Flat source indices in the shape of (k, out rows * out columns) with k = 1 or 4, their weights in the
+        same shape, and the mask of output pixels inside the source
+    """
+    m, n = src_shape
+    a, b, c, d, e, f = matrix
+    out_rows, out_cols = np.indices(out_shape, dtype=np.float64).reshape(2, -1)
+    rows = a * out_rows + b * out_cols + c
+    cols = d * out_rows + e * out_cols + f
+    # pixel centers are at integer coordinates, a pixel covers +- 0.5 around its center
+    inside = (rows >= -0.5) & (rows <= m - 0.5) & (cols >= -0.5) & (cols <= n - 0.5)
+    rows = np.clip(rows, 0, m - 1)
+    cols = np.clip(cols, 0, n - 1)
+    # int32 indices halve the size of the cached index maps
+    index_dtype = np.int32 if m * n <= np.iinfo(np.int32).max else np.intp
+    if order == 'nearest':
+        indices = (np.rint(rows).astype(index_dtype) * n + np.rint(cols).astype(index_dtype))[None]
+        weights = np.ones(indices.shape, dtype=np.float32)
+    elif order == 'bilinear':
+        r0 = np.minimum(np.floor(rows).astype(index_dtype), max(m - 2, 0))
+        c0 = np.minimum(np.floor(cols).astype(index_dtype), max(n - 2, 0))
+        r1 = np.minimum(r0 + 1, m - 1)
+        c1 = np.minimum(c0 + 1, n - 1)
+        wr, wc = rows - r0, cols - c0
+        indices = np.stack([r0 * n + c0, r0 * n + c1, r1 * n + c0, r1 * n + c1])
+        # float32 weights are accurate enough for display, and keep float32 images in float32
+        weights = np.stack([(1 - wr) * (1 - wc), (1 - wr) * wc, wr * (1 - wc), wr * wc]).astype(np.float32)
+    else:
+        raise ValueError(f'Unknown order {order}, use nearest or bilinear')
+    return indices, weights, inside
+
+
+@_lru_cache_bytes(256 * 2 ** 20)  # the index maps are as large as the output, e.g. 66 MB for 1024 x 1024 at 45 deg
+def _cached_affine_index_map(src_shape, out_shape, matrix, order):
+    """
+    _affine_index_map() cached, the arrays are read-only
+    """
+    return _read_only(*_affine_index_map(src_shape, out_shape, matrix, order))
+
+
+def affine_warp(img, matrix, out_shape, order='bilinear', fill=np.nan, cache=True):
+    """
+    Resample an image by an affine map from output pixels to source pixels.
+
+    The index maps are cached per (source shape, output shape, matrix, order), so warping the channels of a
+    file, or many files with the same shape and rotation, computes the geometry only once.
+
+    Parameters
+    ----------
+    img : numpy.array
+        An image in 2d numpy.array, or a stack of images in 3d numpy.array
+    matrix : numpy.array
+        2x3 matrix, the output pixel (R, C) is taken from the source pixel matrix @ (R, C, 1)
+    out_shape : tuple
+        (rows, columns) of the output
+    order : str
+        'nearest' or 'bilinear' interpolation
+    fill : float
+        Value of the output pixels outside the source
+    cache : bool
+        Whether to cache the index maps, e.g. False for matrices used only once
+    Returns
+    -------
+    result : numpy.array
+        Warped image(s) in the shape of img.shape[:-2] + out_shape
+    """
+    m, n = img.shape[-2:]
+    matrix = tuple(float(v) for v in np.ravel(matrix))
+    index_map = _cached_affine_index_map if cache else _affine_index_map
+    indices, weights, inside = index_map((m, n), tuple(out_shape), matrix, order)
+    flat = np.reshape(img, img.shape[:-2] + (m * n,))
+    if order == 'nearest':
+        result = flat[..., indices[0]]
+    else:
+        result = sum(flat[..., idx] * w for idx, w in zip(indices, weights))
+    result = np.where(inside, result, fill)
+    return result.reshape(img.shape[:-2] + tuple(out_shape))
+
+
+def warp_to_canvas(file, channel=0, pixel_size=None, order='bilinear', fill=np.nan, img=None, grid_origin=None):
+    """
+    Resample a channel of a DAT_IMG, rotated by file.rotation, onto an axis-aligned canvas in scanner coordinates,
+    with the y axis pointing down as in the images. The geometry follows point_rot2D_y_inv, the same as the
+    scan frame shown by the STM software.
+
+    Parameters
+    ----------
+    file : DAT_IMG
+        The file, with offset, size, rotation, scan_ymode and nom_size
+    channel : int
+        Channel index
+    pixel_size : float, optional
+        Canvas pixel size in angstrom, the smaller pixel size of the image by default
+    order : str
+        'nearest' or 'bilinear' interpolation
+    fill : float
+        Value of the canvas pixels outside the scan
+    img : numpy.array, optional
+        Image to warp instead of file.imgs[channel], e.g. after a background correction
+    grid_origin : XY2D, optional
+        If given, the canvas pixels are aligned to a global grid of pixel_size starting at this scanner
+        coordinate, so that canvases of several files can be added pixel to pixel. Otherwise the canvas is centered
+        on the scan.
+    Returns
+    -------
+    (numpy.array, XY2D, XY2D)
+        The canvas, the scanner coordinate of its top left corner, and its width and height in angstrom
+    """
+    img = file.imgs[channel] if img is None else img
     m, n = img.shape
-    assert m >= 2 and n >= 2
-    X1, X2 = np.mgrid[:m, :n]
-    X = np.hstack((np.reshape(X1, (m * n, 1)), np.reshape(X2, (m * n, 1))))
-    X = np.hstack((np.ones((m * n, 1)), X))
-    YY = np.reshape(img, (m * n, 1))
-    theta = np.dot(np.dot(np.linalg.pinv(np.dot(X.transpose(), X)), X.transpose()), YY)
-    plane = np.reshape(np.dot(X, theta), (m, n))
-    return img - plane
+    dx, dy = file.size.x / n, file.size.y / m
+    pixel_size = min(dx, dy) if pixel_size is None else pixel_size
+
+    temp = file.nom_size.y - file.size.y if file.scan_ymode == 2 else 0
+    radians = np.deg2rad(file.rotation)
+    center = point_rot2D_y_inv(XY2D(x=file.offset.x, y=file.offset.y + temp + file.size.y / 2),
+                               XY2D(x=file.offset.x, y=file.offset.y), radians)
+
+    # point_rot2D_y_inv maps a vector (u, v) of the scan frame to (c * u + s * v, -s * u + c * v)
+    cos_rad, sin_rad = np.cos(radians), np.sin(radians)
+    half_x = (abs(cos_rad) * file.size.x + abs(sin_rad) * file.size.y) / 2
+    half_y = (abs(sin_rad) * file.size.x + abs(cos_rad) * file.size.y) / 2
+    if grid_origin is None:
+        out_shape = (int(np.ceil(2 * half_y / pixel_size - 1e-6)), int(np.ceil(2 * half_x / pixel_size - 1e-6)))
+        x0, y0 = -out_shape[1] * pixel_size / 2, -out_shape[0] * pixel_size / 2  # relative to the center
+    else:
+        col0 = int(np.floor((center.x - half_x - grid_origin.x) / pixel_size + 1e-6))
+        col1 = int(np.ceil((center.x + half_x - grid_origin.x) / pixel_size - 1e-6))
+        row0 = int(np.floor((center.y - half_y - grid_origin.y) / pixel_size + 1e-6))
+        row1 = int(np.ceil((center.y + half_y - grid_origin.y) / pixel_size - 1e-6))
+        out_shape = (row1 - row0, col1 - col0)
+        x0 = grid_origin.x + col0 * pixel_size - center.x
+        y0 = grid_origin.y + row0 * pixel_size - center.y
+
+    # canvas pixel (R, C) -> (X, Y) relative to the center -> (u, v) = (c * X - s * Y, s * X + c * Y)
+    # -> source pixel (v / dy + m / 2 - 0.5, u / dx + n / 2 - 0.5)
+    x_c, y_c = x0 + pixel_size / 2, y0 + pixel_size / 2
+    matrix = [[cos_rad * pixel_size / dy, sin_rad * pixel_size / dy,
+               (sin_rad * x_c + cos_rad * y_c) / dy + m / 2 - 0.5],
+              [-sin_rad * pixel_size / dx, cos_rad * pixel_size / dx,
+               (cos_rad * x_c - sin_rad * y_c) / dx + n / 2 - 0.5]]
+    # the matrix of a centered canvas only depends on the shapes and the rotation, whereas on a global grid
+    # the sub-pixel phase of the translation differs for each scan position, so caching would never hit
+    canvas = affine_warp(img, matrix, out_shape, order=order, fill=fill, cache=grid_origin is None)
+    return canvas, XY2D(x=center.x + x0, y=center.y + y0), \
+        XY2D(x=out_shape[1] * pixel_size, y=out_shape[0] * pixel_size)
@@ -61,3 +61,210 @@ def point_rot2D_y_inv(target=XY2D(1, 1), origin=XY2D(0, 0), radians=0):
                          origin=XY2D(x=origin.x, y=-origin.y),
                          radians=radians)
     return XY2D(x=result.x, y=-result.y)
+
+
+def _as_points(points):
+    """
+    Convert points into an array of (x, y) in the last axis
+
+    Parameters
+    ----------
+    points : numpy.array or XY2D
+        Array in the shape of (..., 2), or XY2D of broadcastable x and y arrays
+
+    Returns
+    -------
+    (numpy.array, bool)
+        Array in the shape of (..., 2), and whether the input was an XY2D
+    """
+    if isinstance(points, XY2D):
+        x, y = np.broadcast_arrays(np.asarray(points.x, dtype=np.float64), np.asarray(points.y, dtype=np.float64))
+        return np.stack([x, y], axis=-1), True
+    points = np.asarray(points, dtype=np.float64)
+    if points.shape[-1:] != (2,):
+        raise ValueError(f'Points must be in the shape of (..., 2), not {points.shape}')
+    return points, False
+
+
+def _from_points(points, as_xy2d):
+    """
+    Inverse of _as_points()
+    """
+    return XY2D(x=points[..., 0], y=points[..., 1]) if as_xy2d else points
+
+
+def rot2D_matrix(radians=0, y_inv=False):
+    """
+    Matrix of the rotation by an angle in radians, acting on column vectors (x, y)
+
+    Parameters
+    ----------
+    radians : float or numpy.array
+        Rotation angle in radian, an array gives a stack of matrices
+    y_inv : bool
+        The rotation of point_rot2D_y_inv(), i.e. in the opposite direction as y is flipped
+    Returns
+    -------
+    matrix : numpy.array
+        In the shape of (..., 2, 2)
+    """
+    cos_rad = np.cos(radians)
+    sin_rad = np.sin(radians) * (-1 if y_inv else 1)
+    return np.stack([np.stack([cos_rad, -sin_rad], axis=-1),
+                     np.stack([sin_rad, cos_rad], axis=-1)], axis=-2)
+
+
+def points_rot2D(points, origin=XY2D(0, 0), radians=0):
+    """
+    Rotate many 2D points around an origin by angles in radians, the array version of point_rot2D
+
+    Parameters
+    ----------
+    points : numpy.array or XY2D
+        Array in the shape of (..., 2), e.g. (N, 2), or XY2D of broadcastable x and y arrays
+    origin : XY2D or numpy.array
+        Rotation origin location, or an array of origins broadcastable to points
+    radians : float or numpy.array
+        Rotation angle in radian, or an array of angles broadcastable to points[..., 0]
+    Returns
+    -------
+    result : numpy.array or XY2D
+        Result after rotation, in the form of points
+    """
+    points, as_xy2d = _as_points(points)
+    origin = np.asarray(origin, dtype=np.float64)
+    matrix = rot2D_matrix(radians)
+    result = origin + np.einsum('...ij,...j->...i', matrix, points - origin)
+    return _from_points(result, as_xy2d)
+
+
+def points_rot2D_y_inv(points, origin=XY2D(0, 0), radians=0):
+    """
+    Rotate many 2D points around an origin by angles in radians with y flipped, the array version of
+    point_rot2D_y_inv
+
+    Parameters
+    ----------
+    points : numpy.array or XY2D
+        Array in the shape of (..., 2), e.g. (N, 2), or XY2D of broadcastable x and y arrays
+    origin : XY2D or numpy.array
+        Rotation origin location, or an array of origins broadcastable to points
+    radians : float or numpy.array
+        Rotation angle in radian, or an array of angles broadcastable to points[..., 0]
+    Returns
+    -------
+    result : numpy.array or XY2D
+        Result after rotation and flipping in y, in the form of points
+    """
+    points, as_xy2d = _as_points(points)
+    origin = np.asarray(origin, dtype=np.float64)
+    matrix = rot2D_matrix(radians, y_inv=True)
+    result = origin + np.einsum('...ij,...j->...i', matrix, points - origin)
+    return _from_points(result, as_xy2d)
+
+
+class Affine2D:
+    """
+    2D affine transform as a 3 x 3 matrix acting on column vectors (x, y, 1)
+
+    Transforms are composed with @, where (a @ b)(points) == a(b(points)), so that a chain of scalings,
+    rotations and translations is applied to many points in one matrix multiply.
+
+    Parameters
+    ----------
+    matrix : numpy.array
+        In the shape of (3, 3), or (2, 3) without the last row (0, 0, 1)
+
+    Examples
+    --------
+    >>> transform = Affine2D.translation(10, 0) @ Affine2D.rotation(np.pi / 2)
+    >>> transform(np.array([[1, 0], [0, 1]]))  # (10, 1) and (9, 0)
+    """
+
+    def __init__(self, matrix):
+        matrix = np.array(matrix, dtype=np.float64)  # a copy, the caller's array stays writeable
+        if matrix.shape == (2, 3):
+            matrix = np.vstack([matrix, [0, 0, 1]])
+        if matrix.shape != (3, 3):
+            raise ValueError(f'The matrix must be in the shape of (3, 3) or (2, 3), not {matrix.shape}')
+        self.matrix = matrix
+        self.matrix.flags.writeable = False
+
+    @classmethod
+    def translation(cls, x=0, y=0):
+        """
+        Translation by (x, y)
+
+        Returns
+        -------
+        transform : Affine2D
+        """
+        return cls([[1, 0, x], [0, 1, y]])
+
+    @classmethod
+    def scaling(cls, x=1, y=1):
+        """
+        Scaling of x and y
+
+        Returns
+        -------
+        transform : Affine2D
+        """
+        return cls([[x, 0, 0], [0, y, 0]])
+
+    @classmethod
+    def rotation(cls, radians=0, origin=XY2D(0, 0), y_inv=False):
+        """
+        Rotation around an origin, as point_rot2D, or point_rot2D_y_inv if y_inv
+
+        Parameters
+        ----------
+        radians : float
+            Rotation angle in radian
+        origin : XY2D
+            Rotation origin location
+        y_inv : bool
+            Rotate as point_rot2D_y_inv
+
+        Returns
+        -------
+        transform : Affine2D
+        """
+        return cls.translation(*origin) @ cls(np.hstack([rot2D_matrix(radians, y_inv), [[0], [0]]])) @ \
+            cls.translation(-origin[0], -origin[1])
+
+    def __matmul__(self, other):
+        if not isinstance(other, Affine2D):
+            return NotImplemented
+        return Affine2D(self.matrix @ other.matrix)
+
+    def __call__(self, points):
+        """
+        Apply the transform
+
+        Parameters
+        ----------
+        points : numpy.array or XY2D
+            Array in the shape of (..., 2), e.g. (N, 2), or XY2D of broadcastable x and y arrays
+
+        Returns
+        -------
+        result : numpy.array or XY2D
+            In the form of points
+        """
+        points, as_xy2d = _as_points(points)
+        result = points @ self.matrix[:2, :2].T + self.matrix[:2, 2]
+        return _from_points(result, as_xy2d)
+
+    def inverse(self):
+        """
+        Return the inverse transform
+
+        Returns
+        -------
+        transform : Affine2D
+        """
+        return Affine2D(np.linalg.inv(self.matrix))
+
+    def __repr__(self):
+        return f'Affine2D({self.matrix[:2].tolist()})'
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Directory watcher pushing newly saved Createc files to subscribers
+
+The directory is polled for the size and mtime of the files. A file is taken as complete, once its size and mtime
+have not changed for a settle time, and is then parsed in a background pool. If the optional package watchdog is
+installed, its inotify (or platform equivalent) events wake the polling up immediately, so the polling interval
+only bounds the latency when no events are available.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .Createc_global_const import cgc
+from .Createc_pyFile import _file_kind, _load
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher:
+    """
+    Watch a directory for new or rewritten .dat, .vert and .specgrid files, and push the parsed objects to the
+    subscribers.
+
+    The subscribers are called in the worker threads of the pool, in the order the files are completed.
+
+    Parameters
+    ----------
+    root : str
+        Directory to watch
+    kinds : iterable of str
+        Kinds of files to ingest, see _file_classes
+    recursive : bool
+        Whether to watch the subdirectories too
+    interval : float
+        Polling interval in seconds
+    settle : float
+        Seconds the size and mtime of a file must stay unchanged before it is parsed
+    existing : bool
+        Whether to ingest the files already present when starting
+    executor : concurrent.futures.Executor, optional
+        Pool to parse the files, a ThreadPoolExecutor owned by the watcher by default
+    kwargs :
+        Extra keyword arguments of the file classes, e.g. lazy=True
+
+    Examples
+    --------
+    >>> with Watcher('path/to/data') as watcher:
+    ...     watcher.subscribe(lambda file: print(file.fn, file.datetime))
+    ...     run_experiment()
+    """
+
+    def __init__(self, root, kinds=('dat', 'vert'), recursive=True, interval=0.5, settle=0.2,
+                 existing=False, executor=None, **kwargs):
+        self.root = root
+        self.kinds = set(kinds)
+        self.recursive = recursive
+        self.interval = interval
+        self.settle = settle
+        self.existing = existing
+        self.kwargs = kwargs
+        self._own_executor = executor is None
+        self._executor = ThreadPoolExecutor(max_workers=2) if executor is None else executor
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._observer = None
+        self._done = {}  # path -> (size, mtime_ns) already parsed
+        self._candidates = {}  # path -> ((size, mtime_ns), time first seen with it)
+
+    def subscribe(self, callback, on_error=None):
+        """
+        Register a subscriber
+
+        Parameters
+        ----------
+        callback : callable
+            Called with each parsed file object
+        on_error : callable, optional
+            Called with (file_path, exception) if a file cannot be parsed
+
+        Returns
+        -------
+        unsubscribe : callable
+            Call it to remove the subscriber
+        """
+        subscriber = (callback, on_error)
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            with self._lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+        return unsubscribe
+
+    def start(self):
+        """
+        Start the polling thread, and the watchdog observer if available
+
+        Returns
+        -------
+        watcher : Watcher
+        """
+        if self._thread is not None:
+            return self
+        self._stopped.clear()
+        self._poll(ingest=self.existing)
+        self._observer = self._start_observer()
+        self._thread = threading.Thread(target=self._run, name=f'createc-watcher-{self.root}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        """
+        Stop watching, the files being parsed are still delivered if wait is True
+
+        Parameters
+        ----------
+        wait : bool
+            Whether to wait for the pending files
+
+        Returns
+        -------
+        None : None
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._own_executor:
+            self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _start_observer(self):
+        """
+        Start a watchdog observer waking the polling thread up on file system events, if watchdog is installed
+
+        Returns
+        -------
+        observer : watchdog.observers.Observer or None
+        """
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        wakeup = self._wakeup
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.root, recursive=self.recursive)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def _run(self):
+        """
+        Polling loop of the watcher thread
+        """
+        while not self._stopped.is_set():
+            # poll again soon while files are settling, even if no events come
+            timeout = min(self.interval, self.settle) if self._candidates else self.interval
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if not self._stopped.is_set():
+                self._poll()
+
+    def _scan(self):
+        """
+        List the watched files with their (size, mtime_ns)
+
+        Yields
+        ------
+        (str, str, tuple)
+            file path, kind and (size, mtime_ns)
+        """
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    if self.recursive:
+                        stack.append(entry.path)
+                    continue
+                try:
+                    kind = _file_kind(entry.name)
+                except ValueError:
+                    continue
+                if kind not in self.kinds:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:  # removed in between
+                    continue
+                yield entry.path, kind, (stat.st_size, stat.st_mtime_ns)
+
+    def _poll(self, ingest=True):
+        """
+        Scan the directory once, and submit the files which have settled
+
+        Parameters
+        ----------
+        ingest : bool
+            If False, only mark the current files as done, used on start to skip the existing files
+
+        Returns
+        -------
+        None : None
+        """
+        now = time.monotonic()
+        seen = set()
+        for path, kind, signature in self._scan():
+            seen.add(path)
+            if self._done.get(path) == signature:
+                continue
+            if not ingest:
+                self._done[path] = signature
+                continue
+            if signature[0] < cgc['g_file_data_bin_offset'] and kind != 'specgrid':
+                continue  # the header is not even written yet
+            previous = self._candidates.get(path)
+            if previous is None or previous[0] != signature:
+                self._candidates[path] = (signature, now)
+            elif now - previous[1] >= self.settle:
+                del self._candidates[path]
+                self._done[path] = signature
+                future = self._executor.submit(_load, path, kind, **self.kwargs)
+                future.add_done_callback(lambda f, path=path: self._publish(path, f))
+        # files deleted before they settled
+        for path in self._candidates.keys() - seen:
+            del self._candidates[path]
+
+    def _publish(self, path, future):
+        """
+        Push a parsed file, or the exception, to the subscribers. An exception raised by a subscriber is logged,
+        and does not stop the delivery to the other subscribers.
+
+        Parameters
+        ----------
+        path : str
+            The file path
+        future : concurrent.futures.Future
+            The parsing job
+
+        Returns
+        -------
+        None : None
+        """
+        if future.cancelled():
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        exception = future.exception()
+        for callback, on_error in subscribers:
+            try:
+                if exception is None:
+                    callback(future.result())
+                elif on_error is not None:
+                    on_error(path, exception)
+            except Exception:
+                logger.exception('Subscriber %r failed on %s', callback, path)
+
+
+def watch(root, *callbacks, **kwargs):
+    """
+    Start watching a directory for new Createc files, see Watcher
+
+    Parameters
+    ----------
+    root : str
+        Directory to watch
+    callbacks : callable
+        Subscribers, called with each parsed file object
+    kwargs :
+        Keyword arguments of Watcher
+
+    Returns
+    -------
+    watcher : Watcher
+        The started watcher, call its stop() method to stop watching
+    """
+    watcher = Watcher(root, **kwargs)
+    for callback in callbacks:
+        watcher.subscribe(callback)
+    return watcher.start()
@@ -8,18 +8,24 @@ UndoTool, RedoTool, ResetTool, SaveTool, HoverTool
 from bokeh.palettes import Greys256
 from bokeh.models import Button, HoverTool, TapTool, TextInput, CustomJS, Select
 from bokeh.events import Tap, DoubleTap
+from bokeh.document import without_document_lock
 
+import asyncio
 import base64
 from collections import deque, namedtuple
-import matplotlib.pyplot as plt
+from functools import partial
 import tornado.web
 import numpy as np
 import os
 import secrets
-from createc.Createc_pyFile import DAT_IMG
+import threading
+from createc.aio import aload_many
+from createc.catalog import Catalog
 from createc.Createc_pyCOM import CreatecWin32
-from createc.utils.misc import XY2D, point_rot2D_y_inv
-from createc.utils.image_utils import level_correction
+from createc.utils.image_utils import level_correction, warp_to_canvas
+from createc.utils.misc import XY2D
+from createc.mosaic import Mosaic
+from createc.tile_pyramid import TilePyramid
 
 
 SCAN_BOUNDARY_X = 3000 # scanner range in angstrom
@@ -27,6 +33,48 @@ SCAN_BOUNDARY_Y = 3000
 NUM_SIGMA = 3 # remove any outlier pixels of an image beyond a defined several sigmas
 MAX_CH = 8 # maxium channel number, temp variable
 FILE_TUPLE = namedtuple('FILE_TUPLE', ['file', 'filename'])
+MOSAIC_PIXEL_SIZE = 1 # pixel size of the global map of all uploaded scans in angstrom
+MOSAIC_TILE_SIZE = 256
+
+# the global map of the topography of all uploaded scans, shared by all documents, and its tile pyramid
+mosaic = Mosaic(pixel_size=MOSAIC_PIXEL_SIZE, boundary=XY2D(x=SCAN_BOUNDARY_X, y=SCAN_BOUNDARY_Y),
+                tile_size=MOSAIC_TILE_SIZE, preprocess=level_correction)
+pyramid = TilePyramid(mosaic, os.path.join(os.path.dirname(__file__), 'temp', 'tiles'))
+contrast = {'vmin': np.nan, 'vmax': np.nan}
+# serializes the updates of the mosaic and the pyramid with the tile reads, which run in the executor
+map_lock = threading.Lock()
+# the catalog of the archived data, to list the scans and spectra covering a double-tapped location
+DATA_DIR = os.environ.get('CREATEC_DATA_DIR')
+catalog = Catalog(DATA_DIR) if DATA_DIR else None
+COVER_RADIUS = 5 # spectra within this distance in angstrom are listed
+
+
+class TileHandler(tornado.web.RequestHandler):
+    """
+    Serve the tiles of the global map as PNG at /tiles/level/row/col.png, optionally with ?vmin=...&vmax=...
+    """
+    async def get(self, level, row, col):
+        vmin = self.get_query_argument('vmin', None)
+        vmax = self.get_query_argument('vmax', None)
+        png = await asyncio.get_running_loop().run_in_executor(
+            None, partial(tile_png, int(level), int(row), int(col),
+                          vmin=None if vmin is None else float(vmin),
+                          vmax=None if vmax is None else float(vmax)))
+        if png is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', 'image/png')
+        # the urls carry the tile version, so a tile can be cached until it is updated
+        self.set_header('Cache-Control', 'max-age=86400')
+        self.write(png)
+
+
+def tile_png(level, row, col, vmin=None, vmax=None):
+    """
+    Render a tile of the global map as PNG, run in the executor
+    """
+    with map_lock:
+        return pyramid.to_png(level, row, col, vmin=vmin, vmax=vmax)
+
 
 def make_document(doc):
 
@@ -74,6 +122,16 @@ def make_document(doc):
         rect_que.append(plot)
         status_text.value = 'Area selected'
 
+    def covering_callback(event):
+        """
+        Callback for Double tap to list the archived scans and spectra covering the location
+        """
+        if catalog is None:
+            covered_text.value = 'Set CREATEC_DATA_DIR to search the archived data'
+            return
+        rows = catalog.covering(event.x, event.y, radius=COVER_RADIUS)
+        covered_text.value = ', '.join(row['path'] for row in rows) or 'No archived file covers this location'
+
     def clear_callback(event):
         """
         Callback to clear all marks on map
@@ -122,7 +180,7 @@ def make_document(doc):
             channel = file.channels-1
             ch_select.value = f'{ch_select.value[:-1]}{channel}'
 
-        img = file.imgs[channel]
+        img = file.imgs[channel].copy()  # the file data is left untouched
         # img = level_correction(file.imgs[channel])
 
         # remove any outlier
@@ -131,58 +189,72 @@ def make_document(doc):
         threshold = np.mean(img)-NUM_SIGMA*np.std(img)
         img[img<threshold] = threshold
 
-        temp = file.nom_size.y-file.size.y if file.scan_ymode == 2 else 0
-        anchor = XY2D(x=file.offset.x, 
-                      y=(file.offset.y+temp+file.size.y/2))
-
-        anchor = point_rot2D_y_inv(anchor, XY2D(x=file.offset.x, y=file.offset.y), 
-                             np.deg2rad(file.rotation))
-        # print('offset:', file.offset)
-        # print('angle:', file.rotation)
-        if int(file.rotation*100) not in [0, 9000, -9000, 18000, -18000]:
-            temp_file_name = f'image{filename}_{channel}.png'
-            path = os.path.join(os.path.dirname(__file__), 'temp', temp_file_name)
-            
-            plt.imsave(path, img, cmap='gray')
-            p.image_url([temp_file_name], x=anchor.x, y=anchor.y, anchor='center',
-                                     w=file.size.x, h=file.size.y, 
-                                     angle=file.rotation, 
-                                     angle_units='deg',
-                                     name = filename)
-            path_que.append(path)
-            return None
-
-        elif int(file.rotation*100) == 0:
-            anchor = XY2D(x=anchor.x-file.size.x/2, y=anchor.y+file.size.y/2)
-            width = file.size.x
-            height = file.size.y
-        elif int(file.rotation*100) == 9000:
-            img = img.swapaxes(-2,-1)[...,::-1,:]
-            anchor = XY2D(x=anchor.x-file.size.y/2, y=anchor.y+file.size.x/2)
-            width = file.size.y
-            height = file.size.x
-        elif int(file.rotation*100) == -9000:
-            img = img.swapaxes(-2,-1)[...,::-1]
-            anchor = XY2D(x=anchor.x-file.size.y/2, y=anchor.y+file.size.x/2)
-            width = file.size.y
-            height = file.size.x
-        else:
-            img = img[...,::-1,::-1]
-            anchor = XY2D(x=anchor.x-file.size.x/2, y=anchor.y+file.size.y/2)
-            width = file.size.x
-            height = file.size.y
-        p.image(image=[np.flipud(img)], x=anchor.x, y=anchor.y, 
-                dw=width, dh=height, palette="Greys256")
+        # resample the rotated scan onto an axis-aligned canvas, pixels outside the scan are NaN (transparent)
+        canvas, corner, extent = warp_to_canvas(file, channel, img=img)
+        current_source.data = dict(image=[np.flipud(canvas)], x=[corner.x], y=[corner.y+extent.y],
+                                   dw=[extent.x], dh=[extent.y])
+
+    def update_tiles():
+        """
+        Show the tiles of the global map covering the viewport, at the level matching the zoom
+        """
+        x_range = (p.x_range.start, p.x_range.end)
+        y_range = (p.y_range.start, p.y_range.end)
+        if None in x_range or None in y_range:
+            return
+        data = dict(url=[], x=[], y=[], w=[], h=[])
+        for level, row, col in pyramid.visible_tiles(x_range, y_range, p.inner_width or 800):
+            corner, size = pyramid.tile_extent(level, row, col)
+            data['url'].append(f'/tiles/{level}/{row}/{col}.png?v={pyramid.version(level, row, col)}'
+                               f'&vmin={contrast["vmin"]}&vmax={contrast["vmax"]}')
+            data['x'].append(corner.x+size/2)
+            data['y'].append(corner.y+size/2)
+            data['w'].append(size)
+            data['h'].append(size)
+        tile_source.data = data
+
+    def ranges_callback(attr, old, new):
+        """
+        Callback to load the tiles after panning or zooming
+        """
+        update_tiles()
 
     def file_input_callback(attr, old, new):
         """
         Callback to upload file
         """
-        for value, filename in zip(file_input.value, file_input.filename):
-            file = DAT_IMG(file_binary=base64.b64decode(value), file_name=filename)
-            nonlocal file_holder
-            file_holder = FILE_TUPLE(file=file, filename=filename)
-            plot_img()
+        uploads = [(base64.b64decode(value), filename)
+                   for value, filename in zip(file_input.value, file_input.filename)]
+        status_text.value = 'Loading files'
+        doc.add_next_tick_callback(partial(load_files, uploads))
+
+    @without_document_lock
+    async def load_files(uploads):
+        """
+        Parse the uploaded files in the executor, and plot each one as soon as it is parsed
+        """
+        loop = asyncio.get_running_loop()
+        async for file in aload_many(uploads):
+            await loop.run_in_executor(None, add_to_map, file)
+            doc.add_next_tick_callback(partial(show_file, file))
+
+    def add_to_map(file):
+        """
+        Place a file on the global map, and update the contrast of the map, run in the executor
+        """
+        with map_lock:
+            mosaic.add(file)
+            pyramid.update()
+            contrast['vmin'], contrast['vmax'] = pyramid.value_range()
+
+    def show_file(file):
+        """
+        Plot one parsed file
+        """
+        nonlocal file_holder
+        file_holder = FILE_TUPLE(file=file, filename=file.fn)
+        update_tiles()
+        plot_img()
         status_text.value = 'File uploaded'
 
     def channel_selection_callback(attr, old, new):
@@ -213,6 +285,14 @@ def make_document(doc):
     # setup a map with y-axis inverted, and a virtual boundary of the scanner range
     p = figure(match_aspect=True, tools=[PanTool(), UndoTool(), RedoTool(), ResetTool(), SaveTool()])
     p.y_range.flipped = True
+    for axis_range in [p.x_range, p.y_range]:
+        axis_range.on_change('start', ranges_callback)
+        axis_range.on_change('end', ranges_callback)
+    # the global map of all uploaded scans as tiles, and the last uploaded scan at full resolution on top
+    tile_source = ColumnDataSource(dict(url=[], x=[], y=[], w=[], h=[]))
+    p.image_url(url='url', x='x', y='y', w='w', h='h', anchor='center', source=tile_source)
+    current_source = ColumnDataSource(dict(image=[], x=[], y=[], dw=[], dh=[]))
+    p.image(image='image', x='x', y='y', dw='dw', dh='dh', palette="Greys256", source=current_source)
     # plot = p.rect(x=0, y=0, width=SCAN_BOUNDARY_X, height=SCAN_BOUNDARY_Y, 
     #               fill_alpha=0, line_color='gray', name='none')
     p.line([-SCAN_BOUNDARY_X, -SCAN_BOUNDARY_X, SCAN_BOUNDARY_X, SCAN_BOUNDARY_X, -SCAN_BOUNDARY_X], 
@@ -246,6 +326,9 @@ def make_document(doc):
                             """)
     p.js_on_event(DoubleTap, show_coord_cb)
     p.on_event(DoubleTap, mark_area_callback)
+    # and list the archived files covering the location
+    covered_text = TextInput(title='', value='', disabled=True)
+    p.on_event(DoubleTap, covering_callback)
     
     # Show coordinates when hovering over the canvas
     textxy_hover = TextInput(title='', value='', disabled=True)
@@ -273,15 +356,14 @@ def make_document(doc):
     controls_1 = row([file_input, ch_select, textxy_show], sizing_mode='stretch_width')
     controls_2 = row([textxy_hover, clear_marks_bn, status_text], sizing_mode='stretch_width')
     controls_3 = row([connect_stm_bn, show_stm_area_bn, send_xy_bn], sizing_mode='stretch_width')
-    doc.add_root(column([p, controls_1, controls_2, controls_3], sizing_mode='stretch_both'))
+    controls_4 = row([covered_text], sizing_mode='stretch_width')
+    doc.add_root(column([p, controls_1, controls_2, controls_3, controls_4], sizing_mode='stretch_both'))
 
 
-path_que = deque()
 apps = {'/': make_document}
-extra_patterns = [(r"/(image(.*))", tornado.web.StaticFileHandler, 
+extra_patterns = [(r"/(favicon.ico)", tornado.web.StaticFileHandler, 
                   {"path": os.path.join(os.path.dirname(__file__), 'temp')}),
-                  (r"/(favicon.ico)", tornado.web.StaticFileHandler, 
-                  {"path": os.path.join(os.path.dirname(__file__), 'temp')})]
+                  (r"/tiles/(\d+)/(\d+)/(\d+)\.png", TileHandler)]
 server = Server(apps, extra_patterns=extra_patterns)
 server.start()
 server.io_loop.add_callback(server.show, "/")
@@ -290,8 +372,4 @@ try:
 except KeyboardInterrupt:
     print('keyboard interruption')
 finally:
-    while len(path_que):
-        file = path_que.pop()
-        if os.path.isfile(file):
-            os.remove(file)
     print('Done')
@@ -39,9 +39,12 @@ def find_shift(img_src, img_des, img_previous, extra_sec, continuous_drift=True)
     -------
 
     """
-    shift = [pcc(level_correction(gaussian(ri(src))), level_correction(gaussian(ri(des))))[0]
-             for src, des in zip([img_src.img_array_list[i] for i in params['shift_reg_channel']],
-                                 [img_des.img_array_list[i] for i in params['shift_reg_channel']])]
+    # all the registration channels are level corrected in one batch
+    srcs = level_correction(np.stack([gaussian(ri(img_src.img_array_list[i])) for i in params['shift_reg_channel']]),
+                            inplace=True)
+    dess = level_correction(np.stack([gaussian(ri(img_des.img_array_list[i])) for i in params['shift_reg_channel']]),
+                            inplace=True)
+    shift = [pcc(src, des)[0] for src, des in zip(srcs, dess)]
     shift = np.mean(shift, axis=0)
     dt1 = img_src.timestamp - img_previous.timestamp
     dt2 = time.time() + extra_sec - img_previous.timestamp
@@ -23,5 +23,5 @@ setuptools.setup(
         "Topic :: System :: Hardware :: Hardware Drivers",
         "Topic :: Scientific/Engineering :: Physics",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.8',  # multiprocessing.shared_memory in grid_fit
 )
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def write_specgrid():
+    """
+    Factory writing a .specgrid file from a cube in the layout of GRID_SPEC.specdata, i.e. (x, y, bias, channel)
+
+    The bias column of the spec header defaults to 0, 1, 2 ...; pass bias to set it.
+    """
+    def write(fp, cube, bias=None):
+        nx, ny, npts, _ = cube.shape
+        header = np.zeros(256, dtype=np.uint32)
+        header[[1, 2, 7, 25, 26]] = [nx, ny, npts, 1, 1]
+        specvz = np.zeros((npts, 3), dtype=np.float32)
+        specvz[:, 0] = np.arange(npts) if bias is None else bias
+        with open(fp, 'wb') as f:
+            for arr in [header, specvz, cube.astype(np.float32)]:
+                arr.tofile(f)
+
+    return write
@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+import numpy as np
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_aload():
+    """
+    To test the asyncio loaders aload and aload_many
+    """
+    from createc.aio import aload, aload_many
+    from createc.Createc_pyFile import DAT_IMG
+    fps = [os.path.join(this_dir, fn) for fn in ['A200622.081914.dat', 'A200621.161352.dat', 'A200619.213320.dat']]
+
+    async def main():
+        file = await aload(fps[0])
+        with open(fps[1], 'rb') as f:
+            uploaded = await aload(f.read(), file_name=os.path.basename(fps[1]))
+        files = [file async for file in aload_many(fps, max_pending=2)]
+        return file, uploaded, files
+
+    file, uploaded, files = asyncio.run(main())
+    np.testing.assert_array_equal(file.imgs[0], DAT_IMG(fps[0]).imgs[0])
+    np.testing.assert_array_equal(uploaded.imgs[1], DAT_IMG(fps[1]).imgs[1])
+    assert sorted(file.fn for file in files) == sorted(os.path.basename(fp) for fp in fps)
+
+
+def test_aload_process_pool():
+    """
+    To test that the lazy loads are rejected with a process pool
+    """
+    import pytest
+    from concurrent.futures import ProcessPoolExecutor
+    from createc.aio import aload, aload_many
+    fp = os.path.join(this_dir, 'A200622.081914.dat')
+
+    async def main(executor):
+        with pytest.raises(ValueError):
+            await aload(fp, executor=executor, lazy=True)
+        with pytest.raises(ValueError):
+            [file async for file in aload_many([fp], executor=executor, channels=[0])]
+
+    with ProcessPoolExecutor(1) as executor:
+        asyncio.run(main(executor))
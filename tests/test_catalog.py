@@ -0,0 +1,84 @@
+import os
+import shutil
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_Catalog(tmp_path):
+    """
+    To test the class Catalog and its incremental refresh
+    """
+    from createc.catalog import Catalog
+    from createc.Createc_pyFile import DAT_IMG
+    for fn in ['A200622.081914.dat', 'A200621.161352.dat', 'A201222.074849.VERT']:
+        shutil.copy(os.path.join(this_dir, fn), tmp_path)
+
+    with Catalog(str(tmp_path)) as catalog:
+        assert len(catalog) == 3
+        assert catalog.refresh() == (0, 0)
+        file = DAT_IMG(os.path.join(this_dir, 'A200622.081914.dat'))
+        rows = catalog.query(kind='dat', bias=(file.bias - 1, file.bias + 1),
+                             near=(file.offset.x, file.offset.y, 1))
+        assert 'A200622.081914.dat' in [row['path'] for row in rows]
+        row = [row for row in rows if row['path'] == 'A200622.081914.dat'][0]
+        assert row['xPixel'] == file.xPixel
+        assert row['datetime'] == file.timestamp
+
+        os.remove(os.path.join(str(tmp_path), 'A200621.161352.dat'))
+        assert catalog.refresh() == (0, 1)
+        assert len(catalog.query(kind='vert')) == 1
+
+
+def test_scan_vanished(tmp_path):
+    """
+    To test that the scan skips the files deleted after the directory listing
+    """
+    from createc.catalog import _scan
+    for fn in ['A200622.081914.dat', 'A200621.161352.dat']:
+        shutil.copy(os.path.join(this_dir, fn), tmp_path)
+    scan = _scan(str(tmp_path))
+    path, _, _ = next(scan)
+    os.remove(os.path.join(str(tmp_path), ({'A200622.081914.dat', 'A200621.161352.dat'} - {path}).pop()))
+    assert list(scan) == []
+
+
+def test_Catalog_spatial(tmp_path, monkeypatch):
+    """
+    To test the spatial queries covering, in_rect and nearest of Catalog
+    """
+    import numpy as np
+    from createc.catalog import Catalog
+    from createc.Createc_pyFile import DAT_IMG, VERT_SPEC
+    for fn in ['A200622.081914.dat', 'A200621.161352.dat', 'A201222.074849.VERT', 'A190824.135614.VERT']:
+        shutil.copy(os.path.join(this_dir, fn), tmp_path)
+    file = DAT_IMG(os.path.join(this_dir, 'A200622.081914.dat'))
+    spec = VERT_SPEC._read_head(os.path.join(this_dir, 'A201222.074849.VERT'))
+    center = file.pixel_transform(np.array([(file.img_pixels.x - 1) / 2, (file.img_pixels.y - 1) / 2]))
+    spec_pos = spec.dac_transform(np.array([spec.spec_pos_x, spec.spec_pos_y]))
+
+    with Catalog(str(tmp_path)) as catalog:
+        assert [row['path'] for row in catalog.covering(*center)] == ['A200622.081914.dat']
+        assert catalog.covering(*(spec_pos + 1)) == []
+        assert [row['path'] for row in catalog.covering(*(spec_pos + 1), radius=2)] == ['A201222.074849.VERT']
+        rows = catalog.in_rect((center[0] - 1, center[0] + 1), (-1e4, 1e4), kind='dat')
+        assert [row['path'] for row in rows] == ['A200622.081914.dat']
+
+        rows, distances = catalog.nearest(*spec_pos, k=2)
+        assert rows[0]['path'] == 'A201222.074849.VERT' and distances[0] < 1e-6
+        assert distances[1] > 0
+        rows, distances = catalog.nearest(*center, k=10, kind='vert')
+        assert sorted(row['path'] for row in rows) == ['A190824.135614.VERT', 'A201222.074849.VERT']
+        assert np.all(np.diff(distances) >= 0)
+        # batches growing from a single footprint give the same as checking all at once, also far from the data
+        for point in [center, spec_pos, (1e5, -3e4)]:
+            expected = catalog.nearest(*point, k=2)
+            with monkeypatch.context() as m:
+                m.setattr('createc.catalog._nearest_batch', 1)
+                rows, distances = catalog.nearest(*point, k=2)
+            assert [row['path'] for row in rows] == [row['path'] for row in expected[0]]
+            np.testing.assert_allclose(distances, expected[1])
+
+        os.remove(os.path.join(str(tmp_path), 'A200622.081914.dat'))
+        catalog.refresh()
+        assert catalog.covering(*center) == []
+        assert len(catalog.nearest(*center, k=10)[0]) == 3
@@ -0,0 +1,57 @@
+import functools
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def grid(tmp_path, write_specgrid):
+    """
+    A .specgrid file whose channel 1 is a straight line per spectrum with random coefficients
+    """
+    from createc.Createc_pyFile import GRID_SPEC
+    nx, ny, npts, nch = 5, 3, 6, 2
+    bias = np.linspace(-1, 1, npts)
+    coef = np.random.default_rng(0).random((nx, ny, 2))
+    cube = np.zeros((nx, ny, npts, nch), dtype=np.float32)
+    cube[..., 1] = coef[..., :1] + coef[..., 1:] * bias
+    fp = str(tmp_path / 'A211021.201245.specgrid')
+    write_specgrid(fp, cube, bias=bias)
+    return GRID_SPEC(fp), coef
+
+
+def test_fit_grid_linear(grid):
+    """
+    To test the batched fit of a linear model
+    """
+    from createc.grid_fit import fit_grid, PolynomialModel
+    grid, coef = grid
+    reports = []
+    maps = fit_grid(grid, PolynomialModel(1), chunk_bytes=grid.specdata[0].nbytes,
+                    progress=lambda done, total: reports.append((done, total)))
+    np.testing.assert_allclose(maps['c0'], coef[..., 0].T, atol=1e-5)
+    np.testing.assert_allclose(maps['c1'], coef[..., 1].T, atol=1e-5)
+    assert reports[-1] == (15, 15) and len(reports) == 5
+
+
+def test_fit_grid_function_resume(tmp_path, grid):
+    """
+    To test the process pool fit of a function model, interrupted and resumed from a checkpoint
+    """
+    from createc.grid_fit import fit_grid, FunctionModel
+    grid, coef = grid
+    model = FunctionModel(functools.partial(np.polyfit, deg=1), ['slope', 'intercept'])
+    checkpoint = str(tmp_path / 'fit.npz')
+
+    def interrupt(done, total):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        fit_grid(grid, model, workers=2, checkpoint=checkpoint, progress=interrupt,
+                 chunk_bytes=grid.specdata[0].nbytes)
+    with np.load(checkpoint) as saved:
+        assert 1 <= saved['done'].sum() < 5
+
+    maps = fit_grid(grid, model, workers=2, checkpoint=checkpoint, chunk_bytes=grid.specdata[0].nbytes)
+    np.testing.assert_allclose(maps['slope'], coef[..., 1].T, atol=1e-5)
+    np.testing.assert_allclose(maps['intercept'], coef[..., 0].T, atol=1e-5)
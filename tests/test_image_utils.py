@@ -0,0 +1,110 @@
+import warnings
+
+import numpy as np
+
+
+def test_level_correction():
+    """
+    To test level_correction on single images and stacks
+    """
+    from createc.utils.image_utils import level_correction
+    m, n = 20, 30
+    rows, cols = np.mgrid[:m, :n]
+    noise = np.random.default_rng(0).random((3, m, n))
+    noise -= noise.mean(axis=(1, 2), keepdims=True)
+    planes = np.stack([a + b * rows + c * cols for a, b, c in [(1, 2, 3), (-5, 0.1, 0), (0, 0, -7)]])
+    stack = planes + 1e-3 * noise
+
+    result = level_correction(stack)
+    for img, img_result in zip(stack, result):
+        np.testing.assert_allclose(level_correction(img), img_result, atol=1e-12)
+    np.testing.assert_allclose(result.mean(axis=(1, 2)), 0, atol=1e-9)
+    assert np.abs(result).max() < 1e-2
+
+    level_correction(stack, inplace=True)
+    np.testing.assert_allclose(stack, result)
+
+
+def test_background_corrections():
+    """
+    To test line_correction, median_diff_correction and poly_correction
+    """
+    from createc.utils.image_utils import level_correction, line_correction, median_diff_correction, \
+        poly_correction
+    m, n = 40, 50
+    rows, cols = np.mgrid[:m, :n]
+    noise = 1e-3 * np.random.default_rng(0).random((m, n))
+
+    img = noise + 0.1 * rows + 0.01 * cols * (rows % 3)  # random offset and slope per row
+    assert np.abs(line_correction(img, order=1)).max() < 1e-2
+    stack = np.stack([img, 2 * img])
+    np.testing.assert_allclose(line_correction(stack, order=1)[1], line_correction(2 * img, order=1), atol=1e-12)
+
+    steps = noise + 5 * (rows > 20)
+    np.testing.assert_allclose(median_diff_correction(steps), median_diff_correction(noise), atol=1e-12)
+    mask = np.ones((m, n), dtype=bool)
+    mask[5] = False  # a fully masked row, whose differences to its neighbors are all excluded
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        masked = median_diff_correction(steps, mask=mask)
+    assert np.all(np.isfinite(masked))
+    skipped = np.median(steps[5] - steps[4]) + np.median(steps[6] - steps[5])  # not subtracted from rows 6...
+    np.testing.assert_allclose(masked[6:], median_diff_correction(steps)[6:] + skipped, atol=1e-12)
+
+    img = noise + 1 + 0.3 * rows + 0.01 * rows * cols + 0.002 * cols ** 2
+    assert np.abs(poly_correction(img, order=2)).max() < 1e-2
+    np.testing.assert_allclose(poly_correction(img, order=1), level_correction(img), atol=1e-9)
+    mask = np.ones((m, n), dtype=bool)
+    mask[10:20, 10:20] = False
+    img[~mask] += 50  # an adsorbate excluded from the fit
+    assert np.abs(poly_correction(img, order=2, mask=mask)[mask]).max() < 1e-2
+
+
+def test_warp_to_canvas():
+    """
+    To test the affine resampling, which for multiples of 90 degrees must reduce to flips and transposes
+    """
+    import os
+    from createc.Createc_pyFile import DAT_IMG
+    from createc.utils.image_utils import affine_warp, warp_to_canvas
+    file = DAT_IMG(os.path.join(os.path.dirname(__file__), 'A200622.081914.dat'))
+    img = file.imgs[0]
+    expected = {0: img, 90: img.T[::-1], -90: img.T[:, ::-1], 180: img[::-1, ::-1]}
+    for rotation, result in expected.items():
+        file.rotation = rotation
+        for order in ['nearest', 'bilinear']:
+            canvas, corner, extent = warp_to_canvas(file, 0, order=order)
+            np.testing.assert_allclose(canvas, result, rtol=1e-5)
+        assert np.isclose(extent.x * extent.y, file.size.x * file.size.y)
+
+    file.rotation = 30
+    canvas, corner, extent = warp_to_canvas(file, 0)
+    assert np.nanmin(canvas) >= img.min() and np.nanmax(canvas) <= img.max()
+    assert 0.4 < np.isnan(canvas).mean() < 0.6
+
+    # half a pixel shift interpolates linearly, and a stack is warped image by image
+    stack = np.stack([img, 2 * img])
+    shifted = affine_warp(stack, [[1, 0, 0], [0, 1, 0.5]], (img.shape[0], img.shape[1] - 1))
+    np.testing.assert_allclose(shifted[1], 2 * (img[:, :-1] + img[:, 1:]) / 2, rtol=1e-5)
+
+
+def test_lru_cache_bytes():
+    """
+    To test that the cache of the index maps is bounded by the bytes of the cached arrays
+    """
+    from createc.utils.image_utils import _lru_cache_bytes
+    calls = []
+
+    @_lru_cache_bytes(3000)
+    def make(n):
+        calls.append(n)
+        return np.zeros(n, dtype=np.uint8), np.zeros(n, dtype=np.uint8)
+
+    make(500), make(500), make(400)
+    assert calls == [500, 400] and make.cache_info().nbytes == 1800
+    make(700)  # evicts the least recently used
+    assert make.cache_info().currsize == 2 and make.cache_info().nbytes == 2200
+    make(2000)  # larger than the cache, not cached
+    assert make.cache_info().currsize == 2
+    make(400)
+    assert calls == [500, 400, 700, 2000]
@@ -0,0 +1,29 @@
+import glob
+import os
+
+import numpy as np
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_MetaTable():
+    """
+    To test the class MetaTable
+    """
+    from createc.meta_table import MetaTable
+    from createc.Createc_pyFile import read_meta
+    fps = sorted(glob.glob(os.path.join(this_dir, '*.dat')) + glob.glob(os.path.join(this_dir, '*.VERT')))
+    table = MetaTable.from_paths(fps, all_meta=True)
+    files = [read_meta(fp) for fp in fps]
+    assert len(table) == len(fps)
+    np.testing.assert_array_equal(table.column('bias'), [file.bias for file in files])
+    np.testing.assert_array_equal(table.column('offset_x'), [file.offset.x for file in files])
+    assert list(table.column('path')) == fps
+
+    selected = table.filter(file_version='Paramco32').sort('timestamp', descending=True)
+    assert list(selected.column('fn')) == sorted([file.fn for file in files if file.fn.endswith('.dat')],
+                                                 reverse=True)
+    df = table.to_dataframe(['fn', 'bias', 'xPixel'])
+    assert list(df['fn']) == [file.fn for file in files]
+    assert table.file_meta(0).meta == files[0].meta
+    assert table.row(1)['meta:num.x'] == files[1].meta['num.x']
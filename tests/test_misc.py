@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+
+def test_points_rot2D():
+    """
+    To test points_rot2D, points_rot2D_y_inv and Affine2D against the single point versions
+    """
+    from createc.utils.misc import XY2D, Affine2D, point_rot2D, point_rot2D_y_inv, points_rot2D, \
+        points_rot2D_y_inv
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-100, 100, (50, 2))
+    radians = rng.uniform(-np.pi, np.pi, 50)
+    origin = XY2D(x=3.0, y=-7.0)
+    for func, point_func, y_inv in [(points_rot2D, point_rot2D, False),
+                                    (points_rot2D_y_inv, point_rot2D_y_inv, True)]:
+        expected = np.array([point_func(XY2D(*p), origin, r) for p, r in zip(points, radians)])
+        np.testing.assert_allclose(func(points, origin, radians), expected)
+        result = func(XY2D(x=points[:, 0], y=points[:, 1]), origin, radians)
+        assert isinstance(result, XY2D)
+        np.testing.assert_allclose(np.stack(result, axis=-1), expected)
+        # one angle for all points, and x/y broadcasting
+        np.testing.assert_allclose(func(points, origin, 0.3),
+                                   Affine2D.rotation(0.3, origin, y_inv=y_inv)(points))
+        grid = func(XY2D(x=np.arange(3)[None, :], y=np.arange(4)[:, None]), origin, 0.3)
+        assert grid.x.shape == grid.y.shape == (4, 3)
+
+    transform = Affine2D.translation(10, 0) @ Affine2D.rotation(np.pi / 2) @ Affine2D.scaling(2, 3)
+    np.testing.assert_allclose(transform(np.array([[1, 0], [0, 1]])), [[10, 2], [7, 0]], atol=1e-12)
+    np.testing.assert_allclose(transform.inverse()(transform(points)), points)
+    matrix = np.eye(3)
+    Affine2D(matrix)
+    assert matrix.flags.writeable  # the transform holds a read-only copy
+
+
+def test_pixel_transform():
+    """
+    To test DAT_IMG.pixel_transform against the scan frame of point_rot2D_y_inv
+    """
+    from createc.Createc_pyFile import DAT_IMG
+    from createc.utils.misc import XY2D, point_rot2D_y_inv
+    file = DAT_IMG(os.path.join(os.path.dirname(__file__), 'A200622.081914.dat'))
+    assert file.scan_ymode == 2
+    transform = file.pixel_transform
+    assert file.pixel_transform is transform
+
+    m, n = file.img_pixels.y, file.img_pixels.x
+    assert file.size is file.size
+    assert file.size == XY2D(y=file.nom_size.y * m / file.yPixel, x=file.nom_size.x * n / file.xPixel)
+    corners = np.array([[-0.5, -0.5], [n - 0.5, -0.5], [-0.5, m - 0.5], [n - 0.5, m - 0.5]])
+    temp = file.nom_size.y - file.size.y
+    radians = np.deg2rad(file.rotation)
+    expected = [point_rot2D_y_inv(XY2D(x=file.offset.x + u, y=file.offset.y + temp + v), file.offset, radians)
+                for u, v in [(-file.size.x / 2, 0), (file.size.x / 2, 0),
+                             (-file.size.x / 2, file.size.y), (file.size.x / 2, file.size.y)]]
+    # the header lengths are rounded, the DAC steps are exact
+    np.testing.assert_allclose(transform(corners), expected, atol=0.05)
+    rows, cols = np.mgrid[:m, :n]
+    np.testing.assert_allclose(transform.inverse()(transform(XY2D(x=cols, y=rows))).x, cols, atol=1e-9)
+
+
+def test_pixel_transform_cached(tmp_path):
+    """
+    To test DAT_IMG.pixel_transform of an instance reopened from the cache
+    """
+    from createc.Createc_pyFile import DAT_IMG
+    file_path = os.path.join(os.path.dirname(__file__), 'A200622.081914.dat')
+    file = DAT_IMG(file_path)
+    DAT_IMG.cached(file_path, cache_dir=str(tmp_path))
+    cached = DAT_IMG.cached(file_path, cache_dir=str(tmp_path))
+    np.testing.assert_allclose(cached.pixel_transform.matrix, file.pixel_transform.matrix)
@@ -0,0 +1,42 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_mosaic():
+    """
+    To test that Mosaic places an image as warp_to_canvas does, blends overlaps, and updates tiles incrementally
+    """
+    from createc.Createc_pyFile import DAT_IMG
+    from createc.mosaic import Mosaic
+    from createc.utils.image_utils import _cached_affine_index_map, warp_to_canvas
+    from createc.utils.misc import XY2D
+    file = DAT_IMG(os.path.join(this_dir, 'A200622.081914.dat'))
+
+    mosaic = Mosaic(pixel_size=2, tile_size=100, workers=2)
+    _cached_affine_index_map.cache_clear()
+    updated = mosaic.add(file)
+    assert _cached_affine_index_map.cache_info().currsize == 0  # placements on the grid are not cached
+    assert updated == mosaic.pop_dirty() == set(mosaic.tiles)
+    assert mosaic.add(file) == set() and mosaic.pop_dirty() == set()
+
+    canvas, corner, extent = warp_to_canvas(file, 0, pixel_size=2, grid_origin=mosaic.origin)
+    img, img_corner = mosaic.to_array((corner.x, corner.x + extent.x), (corner.y, corner.y + extent.y))
+    assert np.allclose(img_corner, corner)
+    np.testing.assert_allclose(img, canvas, rtol=1e-6)
+
+    # the same scan again under another name, shifted by 100 angstrom
+    shifted = SimpleNamespace(fn='A200622.091914.dat', timestamp=file.timestamp + 3600,
+                              imgs=[np.zeros_like(file.imgs[0])], offset=XY2D(x=file.offset.x + 100, y=file.offset.y),
+                              size=file.size, nom_size=file.nom_size, scan_ymode=file.scan_ymode, rotation=file.rotation)
+    for blend, overlap in [('mean', canvas[:, 50:] / 2), ('latest', canvas[:, 50:] * 0)]:
+        mosaic = Mosaic(pixel_size=2, tile_size=100, blend=blend)
+        mosaic.add(file)
+        updated = mosaic.add([shifted])
+        assert updated and updated <= set(mosaic.tiles)
+        img, _ = mosaic.to_array((corner.x, corner.x + extent.x), (corner.y, corner.y + extent.y))
+        np.testing.assert_allclose(img[:, :50], canvas[:, :50], rtol=1e-6)
+        np.testing.assert_allclose(img[:, 50:], np.broadcast_to(overlap, img[:, 50:].shape), rtol=1e-6, atol=1e-6)
@@ -17,6 +17,138 @@ def test_DAT_IMG():
             np.testing.assert_allclose(img, npy_img)
 
 
+def test_DAT_IMG_lazy():
+    """
+    To test the lazy mode of the class DAT_IMG
+    """
+    from createc.Createc_pyFile import DAT_IMG
+    file = DAT_IMG(os.path.join(this_dir, 'A200622.081914.dat'), lazy=True)
+    assert file._data_binary is None
+    assert file.xPixel == 512
+    with open(os.path.join(this_dir, 'A200622.081914.npy'), 'rb') as f:
+        for img in file.imgs:
+            np.testing.assert_allclose(img, np.load(f))
+
+    file = DAT_IMG(os.path.join(this_dir, 'A200622.081914.dat'), channels=[0, 1])
+    assert file._img_filled < len(file._img_buffer)  # stopped after the requested channels
+    with open(os.path.join(this_dir, 'A200622.081914.npy'), 'rb') as f:
+        for img in file.imgs:
+            np.testing.assert_allclose(img, np.load(f))
+
+
+def test_DAT_IMG_truncated():
+    """
+    To test that a .dat file with a truncated data section raises instead of loading empty channels
+    """
+    import pytest
+    from createc.Createc_pyFile import DAT_IMG
+    with open(os.path.join(this_dir, 'A200622.081914.dat'), 'rb') as f:
+        binary = f.read()
+    binary = binary[:16384 + (len(binary) - 16384) // 2]
+    with pytest.raises(ValueError, match='truncated'):
+        DAT_IMG(file_binary=binary, file_name='A200622.081914.dat')
+    file = DAT_IMG(file_binary=binary, file_name='A200622.081914.dat', channels=[0])  # complete channel
+    assert file.imgs[0].shape == (354, 512)
+    with pytest.raises(ValueError, match='truncated'):
+        file.imgs[3]
+
+
+def test_DAT_IMG_cache(tmp_path):
+    """
+    To test the cache of the class DAT_IMG
+    """
+    from createc.Createc_pyFile import DAT_IMG
+    fp = os.path.join(str(tmp_path), 'A200622.081914.dat')
+    with open(os.path.join(this_dir, 'A200622.081914.dat'), 'rb') as f_in, open(fp, 'wb') as f_out:
+        f_out.write(f_in.read())
+    file = DAT_IMG.cached(fp, cache_dir=str(tmp_path))
+    cached = DAT_IMG.cached(fp, cache_dir=str(tmp_path))
+    assert isinstance(cached.img_array_list[0], np.memmap)
+    assert cached.meta == file.meta
+    assert cached.img_pixels == file.img_pixels
+    for img, img_ref in zip(cached.imgs, file.imgs):
+        np.testing.assert_array_equal(img, img_ref)
+
+    os.utime(fp, (0, 0))
+    assert not isinstance(DAT_IMG.cached(fp, cache_dir=str(tmp_path)).img_array_list[0], np.memmap)
+    # the cache is rewritten aside, the memory map of the previous instance stays valid
+    np.testing.assert_array_equal(cached.imgs[0], file.imgs[0])
+    assert not [fn for _, _, fns in os.walk(str(tmp_path)) for fn in fns if '.tmp' in fn]
+
+    # concurrent writers of the same cache
+    from concurrent.futures import ThreadPoolExecutor
+    path = str(tmp_path / 'concurrent')
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda _: file.to_cache(path), range(8)))
+    np.testing.assert_array_equal(DAT_IMG.from_cache(path).imgs[0], file.imgs[0])
+    assert sorted(os.listdir(path)) == ['img_array.npy', 'meta.json', 'rows.npy']
+
+
+def test_DAT_IMG_pickle():
+    """
+    To test that a pickled DAT_IMG holds the images once, as views of one array, also in the lazy mode
+    """
+    import pickle
+    from createc.Createc_pyFile import DAT_IMG
+    fp = os.path.join(this_dir, 'A200622.081914.dat')
+    file = DAT_IMG(fp)
+    binary = pickle.dumps(file)
+    assert len(binary) < 1.1 * sum(arr.nbytes for arr in file.img_array_list)
+    for lazy in [False, True]:
+        unpickled = pickle.loads(pickle.dumps(DAT_IMG(fp, lazy=lazy)))
+        assert unpickled._data_binary is None
+        assert all(np.shares_memory(arr, unpickled.img_array_list[0].base) for arr in unpickled.img_array_list)
+        for img, expected in zip(unpickled.imgs, file.imgs):
+            np.testing.assert_array_equal(img, expected)
+        assert unpickled.size == file.size
+
+
+def test_read_meta():
+    """
+    To test the header-only reader read_meta
+    """
+    from createc.Createc_pyFile import DAT_IMG, read_meta
+    fp = os.path.join(this_dir, 'A200622.081914.dat')
+    file = DAT_IMG(fp)
+    with open(fp, 'rb') as f:
+        for meta in [read_meta(fp), read_meta(f)]:
+            assert meta.meta == file.meta
+            assert meta.fn == file.fn
+            assert (meta.xPixel, meta.bias, meta.current, meta.rotation) == \
+                   (file.xPixel, file.bias, file.current, file.rotation)
+            assert meta.offset == file.offset
+
+
+def test_FILE_META():
+    """
+    To test the typed meta data class FILE_META
+    """
+    from createc.Createc_pyFile import DAT_IMG, FILE_META
+    fp = os.path.join(this_dir, 'A200622.081914.dat')
+    file = DAT_IMG(fp)
+    with open(fp, 'rb') as f:
+        file_meta = FILE_META.from_binary(f.read(16384), file.fn)
+    assert file_meta.meta == file.meta
+    assert (file_meta.xPixel, file_meta.channels_code, file_meta.bias) == (512, '3', file.bias)
+    assert file_meta.offset is file_meta.offset  # cached
+    assert (file_meta.offset, file_meta.nom_size, file_meta.datetime) == (file.offset, file.nom_size, file.datetime)
+
+
+def test_load_many():
+    """
+    To test the parallel loader load_many
+    """
+    from createc.Createc_pyFile import DAT_IMG, load_many
+    fps = [os.path.join(this_dir, fn) for fn in ['A200622.081914.dat', 'A200621.161352.dat', 'A200619.213320.dat']]
+    files = load_many(fps, workers=2)
+    assert [file.fn for file in files] == [os.path.basename(fp) for fp in fps]
+    for file, fp in zip(files, fps):
+        for img, img_ref in zip(file.imgs, DAT_IMG(fp).imgs):
+            np.testing.assert_array_equal(img, img_ref)
+    files = load_many(fps, workers=2, ordered=False)
+    assert sorted(file.fn for file in files) == sorted(os.path.basename(fp) for fp in fps)
+
+
 def test_VERT_SPEC():
     """
     To test the class VERT_SPEC
@@ -34,6 +166,69 @@ def test_VERT_SPEC():
     assert_frame_equal(readin, file.spec)
 
 
+def test_VERT_SPEC_stack():
+    """
+    To test stacking .vert files into one array with VERT_SPEC.stack()
+    """
+    from createc.Createc_pyFile import VERT_SPEC
+    import pytest
+
+    fps = [os.path.join(this_dir, fn) for fn in ['A201222.074849.VERT', 'A201222.075325.VERT']]
+    stacked = VERT_SPEC.stack(fps)
+    assert stacked.data.shape == (2, 1024, 8)
+    for spec, fp in zip(stacked.data, fps):
+        file = VERT_SPEC(fp)
+        assert list(file.spec.columns) == stacked.headers
+        np.testing.assert_array_equal(spec, file.spec.to_numpy())
+    np.testing.assert_array_equal(stacked.table.column('spec_pos_x'), file.spec_pos_x)
+
+    with pytest.raises(ValueError):
+        VERT_SPEC.stack(fps + [os.path.join(this_dir, 'A201222.074639.VERT')])
+
+
+def test_GRID_SPEC(tmp_path, write_specgrid):
+    """
+    To test the class GRID_SPEC, in both the in-memory and the memory-mapped modes
+    """
+    from createc.Createc_pyFile import GRID_SPEC
+    fp = str(tmp_path / 'A211021.201245.specgrid')
+    cube = np.random.default_rng(0).random((4, 3, 5, 2), dtype=np.float32)
+    write_specgrid(fp, cube)
+
+    for memmap in [False, True]:
+        file = GRID_SPEC(fp, memmap=memmap)
+        np.testing.assert_array_equal(file.specdata, cube)
+        np.testing.assert_array_equal(file.cube_array, cube[:, :, :, 1].T)
+        np.testing.assert_array_equal(file.spectrum(2, 1), cube[2, 1])
+        np.testing.assert_array_equal(file.energy_slice(3), file.cube_array[3])
+    assert isinstance(file.specdata, np.memmap)
+
+
+def test_GRID_SPEC_chunked(tmp_path, write_specgrid):
+    """
+    To test the chunked reductions of GRID_SPEC against numpy on the whole cube
+    """
+    from createc.Createc_pyFile import GRID_SPEC
+    fp = str(tmp_path / 'A211021.201245.specgrid')
+    cube = np.random.default_rng(0).random((7, 3, 5, 2), dtype=np.float32)
+    write_specgrid(fp, cube)
+    cube = cube.astype(np.float64)
+    file = GRID_SPEC(fp, memmap=True)
+    chunk_bytes = 2 * file.specdata[0].nbytes  # 4 chunks, the last one shorter
+
+    for workers in [1, 2]:
+        kwargs = dict(chunk_bytes=chunk_bytes, workers=workers)
+        np.testing.assert_allclose(file.reduce('mean', **kwargs), cube.mean(axis=(0, 1)))
+        np.testing.assert_allclose(file.reduce('max', channel=1, **kwargs), cube[..., 1].max(axis=(0, 1)))
+        np.testing.assert_allclose(file.reduce('sum', axis='bias', **kwargs), cube.sum(axis=2).swapaxes(0, 1))
+        np.testing.assert_allclose(file.reduce('min', axis='bias', channel=1, **kwargs),
+                                   cube[..., 1].min(axis=2).T)
+        np.testing.assert_allclose(file.gradient(**kwargs), np.gradient(cube[..., 1], file.specvz3[:, 0], axis=2),
+                                   rtol=1e-5)
+        np.testing.assert_allclose(file.map_spectra(lambda s: s.mean(axis=1), **kwargs), cube.mean(axis=2),
+                                   rtol=1e-6)
+
+
 """
     with open('A200622.081914.npy', 'wb') as f:
         for img in file.imgs:
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_parquet(tmp_path):
+    """
+    To test the round trip of VERT_SPEC spectra through to_parquet and read_parquet, with channel and row selection
+    """
+    pytest.importorskip('pyarrow')
+    from createc.Createc_pyFile import VERT_SPEC
+    from createc.spec_parquet import to_parquet, read_parquet
+
+    files = [VERT_SPEC(os.path.join(this_dir, fn)) for fn in ['A201222.074849.VERT', 'A201222.075325.VERT']]
+    path = str(tmp_path / 'spectra.parquet')
+    assert to_parquet(files, path, row_group_size=1) == 2
+
+    everything = read_parquet(path)
+    assert everything.headers == list(files[0].spec.columns)
+    np.testing.assert_array_equal(everything.data[0], files[0].spec.to_numpy())
+
+    selected = read_parquet(path, channels=['I'], filters=[('fn', '=', files[1].fn)])
+    assert selected.data.shape == (1, files[1].spec_total_pt, 1)
+    np.testing.assert_array_equal(selected.data[0, :, 0], files[1].spec['I'].to_numpy())
+    assert selected.table['spec_pos_x'][0] == files[1].spec_pos_x
+
+
+def test_parquet_channels(tmp_path, write_specgrid):
+    """
+    To test that to_parquet writes integer channels as float, and rejects spectra with different channels
+    """
+    pytest.importorskip('pyarrow')
+    from createc.Createc_pyFile import VERT_SPEC, GRID_SPEC
+    from createc.spec_parquet import to_parquet, read_parquet
+
+    files = [VERT_SPEC(os.path.join(this_dir, fn)) for fn in ['A201222.074849.VERT', 'A201222.075325.VERT']]
+    files[1].spec = files[1].spec.round().astype(np.int64)
+    path = str(tmp_path / 'spectra.parquet')
+    assert to_parquet(files, path, row_group_size=1) == 2
+    np.testing.assert_array_equal(read_parquet(path).data[1], files[1].spec.to_numpy())
+
+    fp = str(tmp_path / 'A211021.201245.specgrid')
+    write_specgrid(fp, np.zeros((2, 2, files[0].spec_total_pt, 2), dtype=np.float32))
+    for row_group_size in [1, 4096]:  # across row groups, and within one
+        with pytest.raises(ValueError):
+            to_parquet([files[0], GRID_SPEC(fp)], str(tmp_path / 'mixed.parquet'), row_group_size=row_group_size)
@@ -0,0 +1,50 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_tile_pyramid(tmp_path):
+    """
+    To test the downsampled levels, the disk cache, the invalidation and the viewport query of TilePyramid
+    """
+    from createc.Createc_pyFile import DAT_IMG
+    from createc.mosaic import Mosaic
+    from createc.tile_pyramid import TilePyramid
+    from createc.utils.misc import XY2D
+    mosaic = Mosaic(pixel_size=2, boundary=XY2D(x=1024, y=1024), tile_size=64)
+    pyramid = TilePyramid(mosaic, str(tmp_path))
+    assert pyramid.max_level == 4
+    mosaic.add(DAT_IMG(os.path.join(this_dir, 'A200622.081914.dat')))
+    pyramid.update()
+
+    level0 = mosaic.to_array((-1024, 1024), (-1024, 1024))[0]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        level1 = np.nanmean(level0.reshape(512, 2, 512, 2), axis=(1, 3))
+    for level, row, col in pyramid.visible_tiles((-1024, 1024), (-1024, 1024), 512):
+        assert level == 1
+        np.testing.assert_allclose(pyramid.tile(1, row, col), level1[row * 64:(row + 1) * 64, col * 64:(col + 1) * 64],
+                                   rtol=1e-6)
+    assert os.path.exists(pyramid._path(1, row, col))
+    assert pyramid.tile(pyramid.max_level, 0, 0).shape == (64, 64)
+    assert pyramid.tile(0, 0, 0) is None
+
+    # a new scan invalidates the cached tiles above it
+    shifted = DAT_IMG(os.path.join(this_dir, 'A200621.161352.dat'))
+    mosaic.add(shifted)
+    invalidated = pyramid.update()
+    assert (pyramid.max_level, 0, 0) in invalidated
+    assert not os.path.exists(pyramid._path(pyramid.max_level, 0, 0))
+    assert pyramid.version(pyramid.max_level, 0, 0) == 2
+
+    # a cached tile removed under the reader is a cache miss
+    tile = pyramid.tile(pyramid.max_level, 0, 0)
+    os.remove(pyramid._path(pyramid.max_level, 0, 0))
+    np.testing.assert_array_equal(pyramid.tile(pyramid.max_level, 0, 0), tile)
+
+    pytest.importorskip('matplotlib')
+    assert pyramid.to_png(pyramid.max_level, 0, 0, *pyramid.value_range()).startswith(b'\x89PNG')
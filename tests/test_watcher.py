@@ -0,0 +1,56 @@
+import os
+import queue
+import shutil
+
+this_dir = os.path.dirname(__file__)
+
+
+def test_watch(tmp_path):
+    """
+    To test that a file written into the watched directory is parsed and pushed, and existing files are skipped
+    """
+    from createc.watcher import watch
+    shutil.copy(os.path.join(this_dir, 'A200622.081914.dat'), tmp_path)
+    parsed = queue.Queue()
+    watcher = watch(str(tmp_path), parsed.put, interval=0.05, settle=0.05)
+    try:
+        # write it in two parts, like the STM software saving a file
+        with open(os.path.join(this_dir, 'A200621.161352.dat'), 'rb') as f:
+            content = f.read()
+        with open(tmp_path / 'A200621.161352.dat', 'wb') as f:
+            f.write(content[:20000])
+            f.flush()
+            f.write(content[20000:])
+        file = parsed.get(timeout=10)
+    finally:
+        watcher.stop()
+    assert file.fn == 'A200621.161352.dat'
+    assert file.imgs[0].shape == (file.yPixel, file.xPixel)
+    assert parsed.empty()
+
+
+def test_watch_robust(tmp_path, caplog):
+    """
+    To test that a file deleted before it settles is forgotten, and a failing subscriber does not stop the others
+    """
+    from createc.watcher import Watcher
+    parsed = queue.Queue()
+
+    def fail(file):
+        raise RuntimeError('subscriber failure')
+
+    watcher = Watcher(str(tmp_path), interval=0.05, settle=0.05)
+    watcher.subscribe(fail)
+    watcher.subscribe(parsed.put)
+    fp = str(tmp_path / 'A200621.161352.dat')
+    shutil.copy(os.path.join(this_dir, 'A200621.161352.dat'), fp)
+    watcher._poll()
+    assert fp in watcher._candidates
+    os.remove(fp)
+    watcher._poll()
+    assert not watcher._candidates
+
+    with watcher:
+        shutil.copy(os.path.join(this_dir, 'A200621.161352.dat'), fp)
+        assert parsed.get(timeout=10).fn == 'A200621.161352.dat'
+    assert 'subscriber failure' in caplog.text